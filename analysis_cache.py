@@ -0,0 +1,117 @@
+import hashlib
+import json
+from typing import Dict, List, Optional, Sequence
+
+import metrics
+from shared_cache import SharedCache
+from transcripts import TranscriptChunk
+
+# 分析结果在缓存存储中的命名空间
+ANALYSIS_NAMESPACE = 'analyses'
+
+# 默认片段（AI分析失败时的等分片段）带有此标记，不会作为分析结果缓存
+DEFAULT_SEGMENT_FLAG = 'default'
+# 不完整的分析结果（流式输出中断、部分字幕分块或合并失败）带有此标记，同样不缓存
+PARTIAL_SEGMENT_FLAG = 'partial'
+
+ANALYSIS_CACHE_TOTAL = metrics.counter(
+    'ytchat_analysis_cache_total', '视频分析缓存的查询和写入结果', ('outcome',)
+)
+
+
+def is_default_segments(segments: Sequence[Dict]) -> bool:
+    """片段是否为默认片段（而不是模型的分析结果）"""
+    return any(segment.get(DEFAULT_SEGMENT_FLAG) for segment in segments)
+
+
+def is_partial_segments(segments: Sequence[Dict]) -> bool:
+    """片段是否来自不完整的分析"""
+    return any(segment.get(PARTIAL_SEGMENT_FLAG) for segment in segments)
+
+
+def mark_partial(segments: List[Dict]) -> List[Dict]:
+    """给不完整分析得到的片段加上标记，返回同一个列表"""
+    for segment in segments:
+        segment[PARTIAL_SEGMENT_FLAG] = True
+    return segments
+
+
+def analysis_key(youtube_id: str, title: str, description: str, duration: int, model: str,
+                 prompt_version: str, chunks: Optional[List[TranscriptChunk]] = None) -> str:
+    """分析输入的内容哈希：视频信息、模型和提示词版本任一变化都会得到新的键
+
+    有字幕时按字幕分块分析，字幕内容和分块方式也是输入的一部分。
+    """
+    parts = [youtube_id, title or '', description or '', int(duration or 0), model, prompt_version]
+    if chunks:
+        transcript = hashlib.sha256()
+        for chunk in chunks:
+            transcript.update(f"{chunk.start_time}\t{chunk.end_time}\t{chunk.content}\n".encode('utf-8'))
+        parts.append(transcript.hexdigest())
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """按内容哈希持久化缓存视频分析生成的片段
+
+    键由 analysis_key 计算，视频信息、模型或提示词变化后自然不再命中，不需要主动失效；
+    条目存放在 SharedCache 的 SQLite 文件中，服务重启后和其他worker都能直接使用。
+    默认片段和不完整的分析结果不写入，下次分析时仍会请求模型。
+    """
+
+    def __init__(self, store: SharedCache, ttl: float = 30 * 86400.0):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.refreshes = 0
+        self.skipped_default = 0
+        self.skipped_partial = 0
+
+    async def get(self, key: str) -> Optional[List[Dict]]:
+        value = await self.store.get(ANALYSIS_NAMESPACE, key)
+        segments = None
+        if value is not None:
+            try:
+                segments = json.loads(value)
+            except ValueError as e:
+                print(f"分析缓存条目无法解析: {e}")
+        if segments is None:
+            self.misses += 1
+            ANALYSIS_CACHE_TOTAL.inc(outcome='miss')
+            return None
+        self.hits += 1
+        ANALYSIS_CACHE_TOTAL.inc(outcome='hit')
+        return segments
+
+    async def set(self, key: str, segments: List[Dict]):
+        if not segments or is_default_segments(segments):
+            self.skipped_default += 1
+            ANALYSIS_CACHE_TOTAL.inc(outcome='skipped_default')
+            return
+        if is_partial_segments(segments):
+            self.skipped_partial += 1
+            ANALYSIS_CACHE_TOTAL.inc(outcome='skipped_partial')
+            return
+        await self.store.set(ANALYSIS_NAMESPACE, key, json.dumps(segments, ensure_ascii=False), self.ttl)
+        self.writes += 1
+        ANALYSIS_CACHE_TOTAL.inc(outcome='write')
+
+    def record_refresh(self):
+        """记录一次跳过缓存的强制重新分析"""
+        self.refreshes += 1
+        ANALYSIS_CACHE_TOTAL.inc(outcome='refresh')
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.store.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "refreshes": self.refreshes,
+            "skipped_default": self.skipped_default,
+            "skipped_partial": self.skipped_partial,
+        }
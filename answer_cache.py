@@ -0,0 +1,96 @@
+import json
+import re
+import unicodedata
+from typing import Dict, Optional
+
+from cache import TTLCache
+from shared_cache import SharedCache
+
+# 回答在共享缓存中的命名空间
+ANSWER_NAMESPACE = 'answers'
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本：全角转半角、统一大小写，去掉空白，只去掉词两端的标点
+
+    词内的符号和标点保留，"C++ 怎么学" 和 "C 怎么学"、"node.js" 和 "nodejs" 不会得到同一个键。
+    """
+    text = unicodedata.normalize('NFKC', question).lower()
+    words = []
+    for word in re.split(r'[\s\x00-\x1f\x7f]+', text):
+        start, end = 0, len(word)
+        while start < end and _is_edge_punctuation(word[start]):
+            start += 1
+        while end > start and _is_edge_punctuation(word[end - 1]):
+            end -= 1
+        words.append(word[start:end])
+    return ''.join(words)
+
+
+def _is_edge_punctuation(ch: str) -> bool:
+    # "#" 常作为名称的一部分（C#、F#），不当作标点去掉
+    return ch != '#' and unicodedata.category(ch).startswith(('P', 'C'))
+
+
+class AnswerCache:
+    """按归一化问题缓存聊天回答，条目带有视频库版本，视频库变化后自动失效
+
+    指定 store 时回答同时写入共享缓存：服务重启后仍然有效，多个worker之间共用，
+    其他worker写入新回答时本进程内存中的旧回答会被丢弃。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 86400.0, store: Optional[SharedCache] = None):
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._store = store
+        if store is not None:
+            store.add_listener(ANSWER_NAMESPACE, self._on_invalidate)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    async def get(self, question: str, version: str) -> Optional[str]:
+        """返回缓存的回答（JSON字符串），版本不一致视为未命中"""
+        key = normalize_question(question)
+        entry = self._memory.get(key)
+        if entry is None and self._store is not None:
+            value = await self._store.get(ANSWER_NAMESPACE, key)
+            if value is not None:
+                entry = tuple(json.loads(value))
+                self._memory.set(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] != version:
+            self.stale += 1
+            self.misses += 1
+            self._memory.invalidate(key)
+            return None
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, question: str, version: str, response: str):
+        key = normalize_question(question)
+        if not key:
+            return
+        self._memory.set(key, (version, response))
+        if self._store is not None:
+            await self._store.set(ANSWER_NAMESPACE, key, json.dumps([version, response]), self.ttl)
+
+    def _on_invalidate(self, key: Optional[str]):
+        if key is None:
+            self._memory.clear()
+        else:
+            self._memory.invalidate(key)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory": self._memory.stats(),
+            "shared": self._store.path if self._store is not None else None,
+        }
@@ -0,0 +1,185 @@
+"""基准测试用的视频库数据生成
+
+以 demo_data.json 中的视频和片段为模板，按固定随机种子生成 N 个视频、
+每个视频 M 个片段，相同参数总是得到相同的数据。可以直接写入 SQLite 数据库，
+也可以导出为 MySQL 的 INSERT 脚本。
+
+用法：
+    python -m bench.fixtures --videos 500 --segments 12 --sqlite data/bench.db
+    python -m bench.fixtures --videos 500 --segments 12 --mysql-sql fixture.sql
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import string
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO_DATA_PATH = os.path.join(REPO_ROOT, 'demo_data.json')
+
+# 与 Go 服务 GORM 自动迁移得到的表结构一致
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    you_tube_id VARCHAR(50) NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    description TEXT,
+    thumbnail TEXT NOT NULL DEFAULT '',
+    duration INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME,
+    updated_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS video_segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    start_time INTEGER NOT NULL DEFAULT 0,
+    end_time INTEGER NOT NULL DEFAULT 0,
+    content TEXT,
+    summary TEXT,
+    source VARCHAR(20) NOT NULL DEFAULT 'analysis',
+    created_at DATETIME,
+    updated_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_video_segments_video_id ON video_segments (video_id);
+CREATE INDEX IF NOT EXISTS idx_videos_updated_at ON videos (updated_at);
+CREATE INDEX IF NOT EXISTS idx_video_segments_updated_at ON video_segments (updated_at);
+"""
+
+# 用于让不同视频的内容互不相同的主题词
+TOPICS = [
+    'Python', 'Go', '数据库', '索引', '缓存', '并发', '网络', '机器学习', '深度学习', '前端',
+    '容器', '微服务', '算法', '数据结构', '操作系统', '编译器', '安全', '测试', '部署', '监控',
+    '吉他', '钢琴', '摄影', '烹饪', '旅行', '健身', '历史', '物理', '化学', '天文',
+]
+
+
+def load_templates(path: str = DEMO_DATA_PATH) -> Tuple[List[Dict], List[Dict]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data['videos'], data['segments']
+
+
+def youtube_id_for(index: int, seed: int = 0) -> str:
+    """生成确定的11位YouTube风格ID"""
+    alphabet = string.ascii_letters + string.digits + '-_'
+    rng = random.Random(f"{seed}:{index}")
+    return ''.join(rng.choice(alphabet) for _ in range(11))
+
+
+def generate_library(videos: int, segments: int, seed: int = 0) -> List[Dict]:
+    """生成视频库，每个视频的 segments 字段为其片段列表"""
+    video_templates, segment_templates = load_templates()
+    rng = random.Random(seed)
+    library = []
+    for i in range(videos):
+        template = video_templates[i % len(video_templates)]
+        topics = rng.sample(TOPICS, 3)
+        duration = segments * rng.choice([60, 120, 300])
+        step = duration // segments
+        video = {
+            'id': i + 1,
+            'you_tube_id': youtube_id_for(i, seed),
+            'title': f"{template['title']} - {topics[0]}第{i + 1}讲",
+            'description': f"{template['description']}本期主题：{'、'.join(topics)}。",
+            'thumbnail': template['thumbnail'],
+            'duration': duration,
+            'segments': [],
+        }
+        for j in range(segments):
+            segment_template = segment_templates[j % len(segment_templates)]
+            topic = topics[j % len(topics)]
+            video['segments'].append({
+                'start_time': j * step,
+                'end_time': (j + 1) * step,
+                'content': f"{segment_template['content']}，围绕{topic}展开",
+                'summary': f"{segment_template['summary']}本段重点讨论{topic}的相关问题。",
+            })
+        library.append(video)
+    return library
+
+
+def write_sqlite(path: str, library: List[Dict]):
+    """把视频库写入 SQLite 数据库（覆盖已有文件）"""
+    if os.path.exists(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    now = datetime.now().isoformat(' ')
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript(SQLITE_SCHEMA)
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            connection.executemany(
+                "INSERT INTO videos (id, you_tube_id, title, description, thumbnail, duration, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(video['id'], video['you_tube_id'], video['title'], video['description'],
+                  video['thumbnail'], video['duration'], now, now) for video in library]
+            )
+            connection.executemany(
+                "INSERT INTO video_segments (video_id, start_time, end_time, content, summary, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(video['id'], segment['start_time'], segment['end_time'], segment['content'],
+                  segment['summary'], now, now) for video in library for segment in video['segments']]
+            )
+    finally:
+        connection.close()
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def write_mysql_sql(path: str, library: List[Dict], batch_size: int = 500):
+    """导出为 MySQL 的 INSERT 脚本（在 Go 服务自动迁移建表之后执行）"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("USE `ytchat`;\n")
+        for start in range(0, len(library), batch_size):
+            batch = library[start:start + batch_size]
+            rows = [
+                '(' + ', '.join(_sql_literal(video[key]) for key in
+                                ('id', 'you_tube_id', 'title', 'description', 'thumbnail', 'duration')) + ')'
+                for video in batch
+            ]
+            f.write("INSERT INTO `videos` (`id`, `you_tube_id`, `title`, `description`, `thumbnail`, `duration`) VALUES\n")
+            f.write(',\n'.join(rows) + ';\n')
+            rows = [
+                '(' + ', '.join(_sql_literal(value) for value in (
+                    video['id'], segment['start_time'], segment['end_time'], segment['content'], segment['summary']
+                )) + ')'
+                for video in batch for segment in video['segments']
+            ]
+            if rows:
+                f.write("INSERT INTO `video_segments` (`video_id`, `start_time`, `end_time`, `content`, `summary`) VALUES\n")
+                f.write(',\n'.join(rows) + ';\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成基准测试用的视频库数据')
+    parser.add_argument('--videos', type=int, default=200, help='视频数')
+    parser.add_argument('--segments', type=int, default=10, help='每个视频的片段数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--sqlite', help='写入的 SQLite 数据库路径')
+    parser.add_argument('--mysql-sql', help='导出的 MySQL 脚本路径')
+    args = parser.parse_args()
+    if not args.sqlite and not args.mysql_sql:
+        parser.error('需要指定 --sqlite 或 --mysql-sql')
+
+    library = generate_library(args.videos, args.segments, args.seed)
+    if args.sqlite:
+        write_sqlite(args.sqlite, library)
+        print(f"已写入 {args.sqlite}: {len(library)} 个视频, {len(library) * args.segments} 个片段")
+    if args.mysql_sql:
+        write_mysql_sql(args.mysql_sql, library)
+        print(f"已导出 {args.mysql_sql}: {len(library)} 个视频, {len(library) * args.segments} 个片段")
+
+
+if __name__ == '__main__':
+    main()
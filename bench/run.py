@@ -0,0 +1,409 @@
+"""负载测试和延迟基准
+
+启动本地桩服务（千帆、YouTube）和使用 SQLite 视频库的 Python 服务，
+以固定并发数压测 /chat、/chat/stream、/video/{id} 和 /video/{id}/analyze，
+报告吞吐量和 p50/p95/p99 延迟，并可保存为基线或与基线对比。
+
+用法：
+    python -m bench.run --save-baseline default
+    python -m bench.run --baseline default --tolerance 0.2
+    python -m bench.run --service-url http://localhost:8000 --scenarios video
+
+与基线对比时，任一场景的 p95 延迟上升或吞吐量下降超过容差即以非零状态退出。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from bench.fixtures import TOPICS, generate_library, write_sqlite
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_ROOT, 'bench', 'baselines')
+RESULTS_DIR = os.path.join(REPO_ROOT, 'bench', 'results')
+
+SCENARIOS = ('chat', 'chat_stream', 'video', 'analyze')
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float,
+              first_byte: Optional[List[float]] = None) -> Dict:
+    total = len(latencies) + errors
+    summary = {
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else 0.0,
+    }
+    if first_byte:
+        summary["ttfb_p50"] = percentile(first_byte, 50)
+        summary["ttfb_p95"] = percentile(first_byte, 95)
+    return summary
+
+
+class Scenario:
+    """一个压测场景：request(client, i) 发送第 i 个请求，返回首字节延迟（没有时为 None）"""
+
+    def __init__(self, name: str, request: Callable):
+        self.name = name
+        self.request = request
+
+
+def build_scenarios(library: List[Dict], distinct_questions: int) -> Dict[str, Scenario]:
+    youtube_ids = [video['you_tube_id'] for video in library]
+
+    def question(i: int) -> str:
+        # 默认每个问题都不同，测量未命中回答缓存时的完整链路
+        n = i % distinct_questions if distinct_questions else i
+        video = library[n % len(library)]
+        topic = TOPICS[n % len(TOPICS)]
+        return f"{video['title']}里关于{topic}的部分讲了什么？（{n}）"
+
+    async def chat(client: httpx.AsyncClient, i: int):
+        response = await client.post('/chat', json={"question": question(i)})
+        response.raise_for_status()
+        return None
+
+    async def chat_stream(client: httpx.AsyncClient, i: int):
+        start = time.perf_counter()
+        first_byte = None
+        async with client.stream('POST', '/chat/stream', json={"question": question(i)}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_byte is None and line.startswith('event: token'):
+                    first_byte = time.perf_counter() - start
+                if line.startswith('event: error'):
+                    raise RuntimeError('stream error event')
+        return first_byte
+
+    async def video(client: httpx.AsyncClient, i: int):
+        response = await client.get(f'/video/{youtube_ids[i % len(youtube_ids)]}')
+        response.raise_for_status()
+        return None
+
+    async def analyze(client: httpx.AsyncClient, i: int):
+        response = await client.post(f'/video/{youtube_ids[i % len(youtube_ids)]}/analyze', params={'wait': 'true'})
+        response.raise_for_status()
+        return None
+
+    scenarios = [
+        Scenario('chat', chat),
+        Scenario('chat_stream', chat_stream),
+        Scenario('video', video),
+        Scenario('analyze', analyze),
+    ]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+async def run_load(base_url: str, scenario: Scenario, concurrency: int, requests: int,
+                   warmup: int, timeout: float, offset: int = 0) -> Dict:
+    """以固定并发数发送 requests 个请求"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        for i in range(warmup):
+            try:
+                await scenario.request(client, offset + requests + i)
+            except Exception:
+                pass
+
+        latencies: List[float] = []
+        first_bytes: List[float] = []
+        errors = 0
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index, errors
+            while next_index < requests:
+                i = next_index
+                next_index += 1
+                start = time.perf_counter()
+                try:
+                    first_byte = await scenario.request(client, offset + i)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if first_byte is not None:
+                    first_bytes.append(first_byte)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed, first_bytes)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float, ready: Callable[[httpx.Response], bool] = lambda r: True):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(url, timeout=2)
+            if response.status_code == 200 and ready(response):
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+class Environment:
+    """启动桩服务和 Python 服务，退出时全部关闭"""
+
+    def __init__(self, args, library: List[Dict]):
+        self.args = args
+        self.library = library
+        self.workdir = tempfile.mkdtemp(prefix='ytchat-bench-')
+        self.processes: List[subprocess.Popen] = []
+        self.log = open(os.path.join(self.workdir, 'service.log'), 'w')
+
+    def __enter__(self) -> str:
+        args = self.args
+        db_path = os.path.join(self.workdir, 'bench.db')
+        write_sqlite(db_path, self.library)
+
+        qianfan_port, youtube_port, service_port = free_port(), free_port(), free_port()
+        self._spawn([
+            '-m', 'bench.stubs', 'qianfan', '--port', str(qianfan_port),
+            '--latency', str(args.qianfan_latency), '--error-rate', str(args.qianfan_error_rate),
+            '--chunk-delay', str(args.qianfan_chunk_delay), '--seed', str(args.seed),
+        ])
+        self._spawn([
+            '-m', 'bench.stubs', 'youtube', '--port', str(youtube_port),
+            '--latency', str(args.youtube_latency), '--seed', str(args.seed),
+        ])
+        wait_until_ready(f"http://127.0.0.1:{qianfan_port}/stats", 30)
+        wait_until_ready(f"http://127.0.0.1:{youtube_port}/stats", 30)
+
+        env = {
+            **os.environ,
+            'DB_TYPE': 'sqlite',
+            'DB_PATH': db_path,
+            'QIANFAN_CHAT_URL': f"http://127.0.0.1:{qianfan_port}/v2/chat/completions",
+            'YOUTUBE_API_BASE_URL': f"http://127.0.0.1:{youtube_port}/youtube/v3",
+            'YOUTUBE_API_KEY': 'bench',
+            'VECTOR_INDEX_PATH': os.path.join(self.workdir, 'segment_vectors'),
+            'CATALOG_SNAPSHOT_PATH': os.path.join(self.workdir, 'catalog.snap'),
+            'SHARED_CACHE_PATH': os.path.join(self.workdir, 'shared_cache.db') if args.workers > 1 else '',
+            # 每次运行都从空的分析缓存和字幕目录开始，结果才能与基线比较
+            'ANALYSIS_CACHE_PATH': os.path.join(self.workdir, 'analysis_cache.db'),
+            'TRANSCRIPT_DIR': os.path.join(self.workdir, 'transcripts'),
+        }
+        for item in args.service_env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        self._spawn([
+            '-m', 'uvicorn', 'python_service:app', '--host', '127.0.0.1', '--port', str(service_port),
+            '--log-level', 'warning', '--workers', str(args.workers),
+        ], env=env)
+
+        base_url = f"http://127.0.0.1:{service_port}"
+        videos = len(self.library)
+        wait_until_ready(
+            f"{base_url}/stats", 120,
+            lambda response: response.json()['catalog']['videos'] == videos
+        )
+        return base_url
+
+    def __exit__(self, *exc):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.log.close()
+        if self.args.keep:
+            print(f"保留工作目录: {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _spawn(self, argv: List[str], env: Optional[Dict] = None):
+        self.processes.append(subprocess.Popen(
+            [sys.executable] + argv, cwd=REPO_ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        ))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict[str, Dict[str, Dict]]):
+    header = f"{'场景':<12}{'并发':>6}{'请求':>8}{'错误':>6}{'吞吐(req/s)':>14}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, levels in results.items():
+        for concurrency, summary in levels.items():
+            print(
+                f"{name:<12}{concurrency:>6}{summary['requests']:>8}{summary['errors']:>6}"
+                f"{summary['throughput']:>14.1f}{summary['p50'] * 1000:>10.1f}"
+                f"{summary['p95'] * 1000:>10.1f}{summary['p99'] * 1000:>10.1f}"
+            )
+
+
+def compare(results: Dict[str, Dict[str, Dict]], baseline: Dict[str, Dict[str, Dict]],
+            tolerance: float) -> List[str]:
+    """与基线对比，返回超出容差的退化项"""
+    regressions = []
+    for name, levels in results.items():
+        for concurrency, summary in levels.items():
+            base = baseline.get(name, {}).get(concurrency)
+            if not base:
+                continue
+            if base['p95'] and summary['p95'] > base['p95'] * (1 + tolerance):
+                regressions.append(
+                    f"{name} c={concurrency}: p95 {base['p95'] * 1000:.1f}ms -> {summary['p95'] * 1000:.1f}ms"
+                )
+            if base['throughput'] and summary['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append(
+                    f"{name} c={concurrency}: 吞吐 {base['throughput']:.1f} -> {summary['throughput']:.1f} req/s"
+                )
+            if summary['error_rate'] > base['error_rate'] + tolerance / 10:
+                regressions.append(
+                    f"{name} c={concurrency}: 错误率 {base['error_rate']:.1%} -> {summary['error_rate']:.1%}"
+                )
+    return regressions
+
+
+def baseline_path(name: str) -> str:
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+async def run_all(args, base_url: str, library: List[Dict]) -> Dict[str, Dict[str, Dict]]:
+    scenarios = build_scenarios(library, args.distinct_questions)
+    results: Dict[str, Dict[str, Dict]] = {}
+    offset = 0
+    for name in args.scenarios:
+        results[name] = {}
+        for concurrency in args.concurrency:
+            print(f"运行 {name} 并发={concurrency} 请求数={args.requests} ...", flush=True)
+            results[name][str(concurrency)] = await run_load(
+                base_url, scenarios[name], concurrency, args.requests, args.warmup, args.timeout, offset
+            )
+            # 不同轮次使用不同的问题，避免命中前一轮的回答缓存
+            offset += args.requests + args.warmup
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='YTchat Python 服务负载测试和延迟基准')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        type=lambda value: [name for name in value.split(',') if name],
+                        help=f"逗号分隔的场景: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32',
+                        type=lambda value: [int(level) for level in value.split(',') if level],
+                        help='逗号分隔的并发数')
+    parser.add_argument('--requests', type=int, default=200, help='每个场景每个并发数的请求数')
+    parser.add_argument('--warmup', type=int, default=5, help='每轮开始前的预热请求数')
+    parser.add_argument('--timeout', type=float, default=120.0, help='单个请求超时（秒）')
+    parser.add_argument('--videos', type=int, default=200, help='视频库的视频数')
+    parser.add_argument('--segments', type=int, default=10, help='每个视频的片段数')
+    parser.add_argument('--seed', type=int, default=0, help='数据和桩服务的随机种子')
+    parser.add_argument('--distinct-questions', type=int, default=0,
+                        help='问题的种类数，0 表示每个问题都不同（不命中回答缓存）')
+    parser.add_argument('--qianfan-latency', type=float, default=0.3, help='千帆桩的平均延迟（秒）')
+    parser.add_argument('--qianfan-error-rate', type=float, default=0.0, help='千帆桩返回503的概率')
+    parser.add_argument('--qianfan-chunk-delay', type=float, default=0.01, help='千帆桩流式分块间隔（秒）')
+    parser.add_argument('--youtube-latency', type=float, default=0.05, help='YouTube桩的平均延迟（秒）')
+    parser.add_argument('--workers', type=int, default=1, help='本地服务的uvicorn worker进程数')
+    parser.add_argument('--service-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='传给 Python 服务的环境变量，可重复')
+    parser.add_argument('--service-url', help='压测已运行的服务（需已导入相同参数生成的视频库），不再启动本地服务')
+    parser.add_argument('--output', default=os.path.join(RESULTS_DIR, 'latest.json'), help='结果输出路径')
+    parser.add_argument('--save-baseline', metavar='NAME', help='把结果保存为基线')
+    parser.add_argument('--baseline', metavar='NAME', help='与基线对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='与基线对比时允许的相对退化')
+    parser.add_argument('--keep', action='store_true', help='保留临时工作目录（数据库和服务日志）')
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    library = generate_library(args.videos, args.segments, args.seed)
+
+    if args.service_url:
+        results = asyncio.run(run_all(args, args.service_url, library))
+    else:
+        with Environment(args, library) as base_url:
+            results = asyncio.run(run_all(args, base_url, library))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'save_baseline', 'baseline', 'keep')},
+        },
+        "results": results,
+    }
+    print()
+    print_report(results)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {args.output}")
+
+    if args.save_baseline:
+        path = baseline_path(args.save_baseline)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {path}")
+
+    if args.baseline:
+        with open(baseline_path(args.baseline), 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"\n与基线 {args.baseline} 相比出现退化（容差 {args.tolerance:.0%}）：")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\n与基线 {args.baseline} 相比无明显退化（容差 {args.tolerance:.0%}）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
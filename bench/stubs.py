@@ -0,0 +1,169 @@
+"""基准测试用的本地桩服务：千帆对话接口和 YouTube Data API
+
+千帆桩支持配置延迟、抖动、错误率和流式输出的分块间隔；分析类请求返回片段JSON数组，
+问答请求返回带视频定位的回答JSON。YouTube 桩按请求的ID返回视频信息，
+以 missing 开头的ID视为不存在。
+
+用法：
+    python -m bench.stubs qianfan --port 9001 --latency 0.5 --error-rate 0.02
+    python -m bench.stubs youtube --port 9002 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+QIANFAN_PATH = '/v2/chat/completions'
+YOUTUBE_PATH = '/youtube/v3/videos'
+
+_DURATION_RE = re.compile(r'时长: (\d+)秒')
+
+
+def _delay(rng: random.Random, latency: float, jitter: float) -> float:
+    return max(0.0, latency * rng.uniform(1 - jitter, 1 + jitter))
+
+
+def _segments_content(prompt: str, count: int = 6) -> str:
+    match = _DURATION_RE.search(prompt)
+    duration = int(match.group(1)) if match else 3600
+    step = max(1, duration // count)
+    segments = [{
+        "start_time": i * step,
+        "end_time": min((i + 1) * step, duration),
+        "content": f"第{i + 1}部分的内容描述",
+        "summary": f"第{i + 1}部分的详细摘要，介绍了本段的关键知识点。",
+    } for i in range(count)]
+    return json.dumps(segments, ensure_ascii=False)
+
+
+def _answer_content(rng: random.Random) -> str:
+    start = rng.randrange(0, 3000, 60)
+    return json.dumps({
+        "answer": "根据视频内容，这个问题在相关片段中有详细讲解，建议从对应时间点开始观看。",
+        "video_id": rng.randint(1, 10),
+        "start_time": start,
+        "end_time": start + 300,
+    }, ensure_ascii=False)
+
+
+def create_qianfan_app(latency: float = 0.5, jitter: float = 0.2, error_rate: float = 0.0,
+                       chunk_delay: float = 0.02, chunk_size: int = 8, seed: Optional[int] = None) -> FastAPI:
+    """千帆对话接口桩"""
+    app = FastAPI()
+    rng = random.Random(seed)
+    counts: Counter = Counter()
+
+    @app.post(QIANFAN_PATH)
+    async def chat_completions(request: Request):
+        data = await request.json()
+        messages: List[Dict] = data.get('messages', [])
+        prompt = messages[0].get('content', '') if messages else ''
+        analysis = '视频内容分析' in prompt
+        counts['analysis' if analysis else 'chat'] += 1
+
+        await asyncio.sleep(_delay(rng, latency, jitter))
+        if rng.random() < error_rate:
+            counts['errors'] += 1
+            return JSONResponse(status_code=503, content={"error": {"message": "stub overloaded"}})
+
+        content = _segments_content(prompt) if analysis else _answer_content(rng)
+        if not data.get('stream'):
+            return {
+                "id": f"stub-{sum(counts.values())}",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content)},
+            }
+
+        async def events():
+            for start in range(0, len(content), chunk_size):
+                chunk = {"choices": [{"index": 0, "delta": {"content": content[start:start + chunk_size]}}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if chunk_delay:
+                    await asyncio.sleep(chunk_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get('/stats')
+    async def stats():
+        return dict(counts)
+
+    return app
+
+
+def create_youtube_app(latency: float = 0.05, jitter: float = 0.2, seed: Optional[int] = None) -> FastAPI:
+    """YouTube Data API videos.list 接口桩"""
+    app = FastAPI()
+    rng = random.Random(seed)
+    counts: Counter = Counter()
+
+    @app.get(YOUTUBE_PATH)
+    async def videos(id: str = ''):
+        counts['requests'] += 1
+        video_ids = [video_id for video_id in id.split(',') if video_id]
+        counts['ids'] += len(video_ids)
+        await asyncio.sleep(_delay(rng, latency, jitter))
+        items = []
+        for video_id in video_ids:
+            if video_id.startswith('missing'):
+                continue
+            minutes = 5 + sum(map(ord, video_id)) % 60
+            items.append({
+                "id": video_id,
+                "snippet": {
+                    "title": f"基准测试视频 {video_id}",
+                    "description": f"视频 {video_id} 的描述，用于基准测试。",
+                    "channelTitle": "基准测试频道",
+                    "thumbnails": {"high": {"url": f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"}},
+                },
+                "statistics": {"viewCount": "1000", "likeCount": "10"},
+                "contentDetails": {"duration": f"PT{minutes}M30S"},
+            })
+        return {"kind": "youtube#videoListResponse", "items": items}
+
+    @app.get('/stats')
+    async def stats():
+        return dict(counts)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动基准测试桩服务')
+    parser.add_argument('service', choices=['qianfan', 'youtube'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--latency', type=float, default=None, help='平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.2, help='延迟的相对抖动幅度')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的概率（仅千帆）')
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help='流式输出的分块间隔（秒，仅千帆）')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.service == 'qianfan':
+        app = create_qianfan_app(
+            latency=0.5 if args.latency is None else args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            chunk_delay=args.chunk_delay,
+            seed=args.seed,
+        )
+    else:
+        app = create_youtube_app(
+            latency=0.05 if args.latency is None else args.latency,
+            jitter=args.jitter,
+            seed=args.seed,
+        )
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
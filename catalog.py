@@ -0,0 +1,341 @@
+import asyncio
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from db import DatabaseError
+from transcripts import SOURCE_ANALYSIS
+
+_VIDEO_COLUMNS = "id, you_tube_id, title, description, thumbnail, duration, updated_at"
+_SEGMENT_COLUMNS = "id, video_id, start_time, end_time, content, summary, source, updated_at"
+
+
+class SegmentRecord:
+    __slots__ = ('id', 'video_id', 'start_time', 'end_time', 'content', 'summary', 'source', 'updated_at')
+
+    def __init__(self, row: Dict):
+        self.id = row['id']
+        self.video_id = row['video_id']
+        self.start_time = row['start_time']
+        self.end_time = row['end_time']
+        self.content = row['content']
+        self.summary = row['summary']
+        self.source = row.get('source') or SOURCE_ANALYSIS
+        self.updated_at = row.get('updated_at')
+
+    def as_row(self) -> Dict:
+        return {
+            'id': self.id,
+            'video_id': self.video_id,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'content': self.content,
+            'summary': self.summary,
+            'source': self.source,
+        }
+
+
+class VideoRecord:
+    __slots__ = (
+        'id', 'youtube_id', 'title', 'description', 'thumbnail', 'duration',
+        'updated_at', 'segments', 'signature',
+    )
+
+    def __init__(self, row: Dict, segments: List[SegmentRecord]):
+        self.id = row['id']
+        # YouTube ID 和标题会在多处引用，驻留以共享同一个字符串对象
+        self.youtube_id = sys.intern(row['you_tube_id'])
+        self.title = sys.intern(row['title'] or '')
+        self.description = row['description']
+        self.thumbnail = row.get('thumbnail')
+        self.duration = row['duration']
+        self.updated_at = row.get('updated_at')
+        self.segments = tuple(sorted(segments, key=lambda segment: segment.start_time))
+        # 视频及其片段的版本签名，用于判断内容是否变化
+        self.signature = (
+            self.updated_at,
+            tuple((segment.id, segment.updated_at) for segment in self.segments),
+        )
+
+    def as_row(self) -> Dict:
+        """与 videos 表查询结果相同结构的字典"""
+        return {
+            'id': self.id,
+            'you_tube_id': self.youtube_id,
+            'title': self.title,
+            'description': self.description,
+            'thumbnail': self.thumbnail,
+            'duration': self.duration,
+        }
+
+
+class VideoCatalog:
+    """进程内的视频目录：启动时全量加载（或映射快照），之后按 updated_at 水位增量刷新
+
+    加载快照后，快照中的视频按需从映射中读取，只有之后发生变化的视频保存在内存中。
+    变化会通知给监听者（搜索索引等），监听者需实现
+    videos_updated(records) 和 videos_removed(video_ids) 两个方法，
+    可选实现 catalog_loaded()，在每次全量加载或加载快照后调用；
+    可选实现 snapshot_loaded(snapshot)，未实现时快照中的全部视频以 videos_updated 通知。
+    """
+
+    def __init__(self, database, refresh_interval: float = 30.0):
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self.loaded = False
+        # 每次目录内容变化时递增
+        self.version = 0
+        self._watermark = None
+        # 快照之后变化的视频（没有快照时为全部视频）
+        self._videos: Dict[int, VideoRecord] = {}
+        self._snapshot = None
+        # 快照中已被删除的视频
+        self._snapshot_removed: Set[int] = set()
+        self._video_count = 0
+        self._segment_count = 0
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    @property
+    def library_version(self) -> str:
+        """视频库内容版本：由水位和记录数决定，在不同进程和重启之间保持一致"""
+        watermark = self._watermark.isoformat() if self._watermark else '-'
+        return f"{watermark}:{self._video_count}:{self._segment_count}"
+
+    @property
+    def watermark(self):
+        return self._watermark
+
+    @property
+    def changed_since_snapshot(self) -> bool:
+        """内存中是否有快照之后的变化（没有加载快照时总是 True）"""
+        return self._snapshot is None or bool(self._videos or self._snapshot_removed)
+
+    def get(self, video_id: int) -> Optional[VideoRecord]:
+        video = self._videos.get(video_id)
+        if video is None:
+            index = self._snapshot_index(video_id)
+            if index is not None:
+                video = self._snapshot.record(index)
+        return video
+
+    def youtube_id(self, video_id: int) -> Optional[str]:
+        video = self._videos.get(video_id)
+        if video is not None:
+            return video.youtube_id
+        index = self._snapshot_index(video_id)
+        return self._snapshot.youtube_id(index) if index is not None else None
+
+    def title(self, video_id: int) -> Optional[str]:
+        video = self._videos.get(video_id)
+        if video is not None:
+            return video.title
+        index = self._snapshot_index(video_id)
+        return self._snapshot.title(index) if index is not None else None
+
+    def titles(self) -> List[Tuple[int, str]]:
+        """所有视频的（ID, 标题），不从快照构造完整记录"""
+        return [(video_id, self.title(video_id)) for video_id in self.video_ids()]
+
+    def segments(self, video_id: int) -> Tuple[SegmentRecord, ...]:
+        video = self.get(video_id)
+        return video.segments if video else ()
+
+    def video_ids(self) -> List[int]:
+        """所有视频ID（升序）"""
+        ids = set(self._videos)
+        if self._snapshot is not None:
+            ids.update(int(video_id) for video_id in self._snapshot.video_ids)
+            ids -= self._snapshot_removed
+        return sorted(ids)
+
+    def videos(self) -> List[VideoRecord]:
+        """所有视频（按ID排序）"""
+        return [self.get(video_id) for video_id in self.video_ids()]
+
+    def load_snapshot(self, snapshot) -> bool:
+        """以快照作为目录的初始内容，之后的刷新只拉取快照水位之后的变化
+
+        快照为空（没有水位）时不使用，返回 False，由首次刷新全量加载。
+        """
+        if snapshot.watermark is None:
+            return False
+        self._snapshot = snapshot
+        self._snapshot_removed = set()
+        self._videos = {}
+        self._watermark = snapshot.watermark
+        self._video_count = snapshot.video_count
+        self._segment_count = snapshot.segment_count
+        self.loaded = True
+        self.version += 1
+        for listener in self._listeners:
+            if hasattr(listener, 'snapshot_loaded'):
+                listener.snapshot_loaded(snapshot)
+            else:
+                listener.videos_updated(list(snapshot.records()))
+            if hasattr(listener, 'catalog_loaded'):
+                listener.catalog_loaded()
+        return True
+
+    async def refresh(self) -> bool:
+        """拉取 updated_at 水位之后的变化，返回目录是否变化"""
+        if not self.loaded or self._watermark is None:
+            return await self._load_all()
+
+        # 使用 >= 避免漏掉与水位同一毫秒写入的行，重复拉到的行由签名去重
+        watermark = self._watermark
+        changed_videos = await self.database.fetch_all(
+            "SELECT id FROM videos WHERE updated_at >= %s", (watermark,)
+        )
+        changed_segments = await self.database.fetch_all(
+            "SELECT DISTINCT video_id FROM video_segments WHERE updated_at >= %s", (watermark,)
+        )
+        video_ids = {row['id'] for row in changed_videos}
+        video_ids.update(row['video_id'] for row in changed_segments)
+
+        # 水位查询无法发现删除，需对比现有ID
+        existing = await self.database.fetch_all("SELECT id FROM videos")
+        removed = set(self.video_ids()) - {row['id'] for row in existing}
+
+        updated: List[VideoRecord] = []
+        if video_ids:
+            placeholders = ', '.join(['%s'] * len(video_ids))
+            ids = sorted(video_ids)
+            videos = await self.database.fetch_all(
+                f"SELECT {_VIDEO_COLUMNS} FROM videos WHERE id IN ({placeholders})", ids
+            )
+            segments = await self.database.fetch_all(
+                f"SELECT {_SEGMENT_COLUMNS} FROM video_segments WHERE video_id IN ({placeholders})", ids
+            )
+            updated = self._apply(videos, segments)
+            # 视频行已被删除但片段仍有更新的情况
+            removed.update(video_ids - {video['id'] for video in videos})
+
+        removed = {video_id for video_id in removed if self._remove(video_id)}
+
+        if removed:
+            for listener in self._listeners:
+                listener.videos_removed(sorted(removed))
+        if updated:
+            for listener in self._listeners:
+                listener.videos_updated(updated)
+
+        changed = bool(updated or removed)
+        if changed:
+            self.version += 1
+        return changed
+
+    async def run_refresh_loop(self):
+        """后台定时刷新目录"""
+        while True:
+            try:
+                await self.refresh()
+            except DatabaseError as e:
+                print(f"刷新视频目录失败: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def stats(self) -> Dict:
+        memory = self.memory_usage()
+        return {
+            "loaded": self.loaded,
+            "version": self.version,
+            "library_version": self.library_version,
+            "videos": self._video_count,
+            "segments": self._segment_count,
+            "memory_bytes": memory,
+            "bytes_per_10k_segments": int(memory * 10000 / self._segment_count) if self._segment_count else 0,
+            "in_memory_videos": len(self._videos),
+            "snapshot": self._snapshot.stats() if self._snapshot is not None else None,
+        }
+
+    def memory_usage(self) -> int:
+        """估算目录占用的内存（字节，不含快照映射）"""
+        seen: Set[int] = set()
+
+        def size(obj) -> int:
+            if obj is None or id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+
+        total = sys.getsizeof(self._videos)
+        for video in self._videos.values():
+            total += size(video) + size(video.segments)
+            total += sum(size(getattr(video, name)) for name in ('youtube_id', 'title', 'description', 'thumbnail'))
+            for segment in video.segments:
+                total += size(segment) + size(segment.content) + size(segment.summary)
+        return total
+
+    async def _load_all(self) -> bool:
+        videos = await self.database.fetch_all(f"SELECT {_VIDEO_COLUMNS} FROM videos")
+        segments = await self.database.fetch_all(f"SELECT {_SEGMENT_COLUMNS} FROM video_segments")
+        previous = set(self.video_ids())
+        was_loaded = self.loaded
+        self._videos = {}
+        self._snapshot = None
+        self._snapshot_removed = set()
+        self._video_count = 0
+        self._segment_count = 0
+        updated = self._apply(videos, segments, force=True)
+        self.loaded = True
+
+        removed = sorted(previous - set(self._videos))
+        if removed:
+            for listener in self._listeners:
+                listener.videos_removed(removed)
+        for listener in self._listeners:
+            listener.videos_updated(updated)
+            if hasattr(listener, 'catalog_loaded'):
+                listener.catalog_loaded()
+
+        changed = not was_loaded or bool(updated or removed)
+        if changed:
+            self.version += 1
+        return changed
+
+    def _apply(self, videos: Iterable[Dict], segments: Iterable[Dict], force: bool = False) -> List[VideoRecord]:
+        """用查询结果更新目录，返回内容实际发生变化的视频"""
+        by_video: Dict[int, List[SegmentRecord]] = defaultdict(list)
+        for row in segments:
+            by_video[row['video_id']].append(SegmentRecord(row))
+            self._advance_watermark(row.get('updated_at'))
+
+        updated = []
+        for row in videos:
+            self._advance_watermark(row.get('updated_at'))
+            record = VideoRecord(row, by_video.get(row['id'], []))
+            previous = self.get(record.id)
+            if not force and previous is not None and previous.signature == record.signature:
+                continue
+            if previous is None:
+                self._video_count += 1
+            else:
+                self._segment_count -= len(previous.segments)
+            self._videos[record.id] = record
+            # 快照中删除后又重新出现的视频
+            self._snapshot_removed.discard(record.id)
+            self._segment_count += len(record.segments)
+            updated.append(record)
+        return updated
+
+    def _remove(self, video_id: int) -> bool:
+        video = self.get(video_id)
+        if video is None:
+            return False
+        self._videos.pop(video_id, None)
+        if self._snapshot_index(video_id) is not None:
+            self._snapshot_removed.add(video_id)
+        self._video_count -= 1
+        self._segment_count -= len(video.segments)
+        return True
+
+    def _snapshot_index(self, video_id: int) -> Optional[int]:
+        if self._snapshot is None or video_id in self._snapshot_removed:
+            return None
+        return self._snapshot.video_index(video_id)
+
+    def _advance_watermark(self, updated_at):
+        if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+            self._watermark = updated_at
@@ -0,0 +1,146 @@
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+from search_index import tokenize
+
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿　-〿＀-￯]')
+_SENTENCE_RE = re.compile(r'[^。！？!?；;\n]+[。！？!?；;\n]*')
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估计token数：中文约每字1个token，其他字符约每4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按token估计截断文本"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    for i, ch in enumerate(text):
+        used += 1 if _CJK_RE.match(ch) else 0.25
+        if used > max_tokens:
+            return text[:i] + "…"
+    return text
+
+
+def select_window(text: Optional[str], query_tokens: Set[str], max_tokens: int) -> str:
+    """从长文本中选出与问题最相关的连续句子窗口"""
+    if not text:
+        return ''
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = _SENTENCE_RE.findall(text) or [text]
+    scores = [len(query_tokens.intersection(tokenize(sentence))) for sentence in sentences]
+    costs = [estimate_tokens(sentence) for sentence in sentences]
+
+    best = max(range(len(sentences)), key=lambda i: scores[i])
+    start = end = best
+    used = costs[best]
+    # 向两侧扩展，优先选择得分更高的相邻句子
+    while True:
+        candidates = []
+        if start > 0 and used + costs[start - 1] <= max_tokens:
+            candidates.append((scores[start - 1], -1))
+        if end < len(sentences) - 1 and used + costs[end + 1] <= max_tokens:
+            candidates.append((scores[end + 1], 1))
+        if not candidates:
+            break
+        _, direction = max(candidates)
+        if direction < 0:
+            start -= 1
+            used += costs[start]
+        else:
+            end += 1
+            used += costs[end]
+
+    window = ''.join(sentences[start:end + 1]).strip()
+    window = truncate_to_tokens(window, max_tokens)
+    return ("…" if start > 0 else '') + window + ("…" if end < len(sentences) - 1 else '')
+
+
+def compact_video_line(video: Dict, max_tokens: int = 60) -> str:
+    """生成视频的紧凑摘要行，用于视频目录上下文"""
+    description = (video.get('description') or '').strip()
+    first_sentence = _SENTENCE_RE.findall(description)[:1]
+    summary = truncate_to_tokens(first_sentence[0].strip(), max_tokens) if first_sentence else ''
+    line = f"视频ID: {video['id']} | 标题: {video['title']} | YouTube ID: {video['you_tube_id']}"
+    if video.get('duration'):
+        line += f" | 时长: {video['duration']}秒"
+    if summary:
+        line += f" | 简介: {summary}"
+    return line
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextBuilder:
+    """在token预算内组装问答上下文"""
+
+    def __init__(self, token_budget: int = 3000, snippet_tokens: int = 300, dedupe_threshold: float = 0.8):
+        self.token_budget = token_budget
+        self.snippet_tokens = snippet_tokens
+        self.dedupe_threshold = dedupe_threshold
+
+    def build_results(self, question: str, results: Iterable[Dict]) -> str:
+        """按检索排名依次加入片段，跳过近似重复的片段，超出预算即停止"""
+        query_tokens = set(tokenize(question))
+        header = "以下是相关的视频内容：\n\n"
+        budget = self.token_budget - estimate_tokens(header)
+        blocks = []
+        seen: List[Set[str]] = []
+        for result in results:
+            if result['segment_id']:
+                content = select_window(result['content'], query_tokens, self.snippet_tokens)
+                summary = select_window(result['summary'], query_tokens, self.snippet_tokens // 2)
+                fingerprint = set(tokenize(f"{content}{summary}"))
+            else:
+                description = select_window(result['description'], query_tokens, self.snippet_tokens)
+                fingerprint = set(tokenize(description))
+            if any(_similarity(fingerprint, other) >= self.dedupe_threshold for other in seen):
+                continue
+
+            block = f"视频ID: {result['id']}\n"
+            block += f"标题: {result['title']}\n"
+            block += f"YouTube ID: {result['you_tube_id']}\n"
+            if result['segment_id']:
+                block += f"片段时间: {result['start_time']}-{result['end_time']}秒\n"
+                block += f"片段内容: {content}\n"
+                block += f"片段摘要: {summary}\n"
+            else:
+                block += f"视频描述: {description}\n"
+            block += "\n---\n\n"
+
+            cost = estimate_tokens(block)
+            if cost > budget:
+                break
+            budget -= cost
+            blocks.append(block)
+            seen.append(fingerprint)
+        return header + ''.join(blocks) if blocks else ''
+
+    def build_catalog(self, lines: List[str]) -> str:
+        """用预先计算好的视频摘要行组装视频目录，超出预算时注明省略数量"""
+        if not lines:
+            return ''
+        header = "当前视频库中的视频：\n\n"
+        budget = self.token_budget - estimate_tokens(header) - 20
+        included = []
+        for line in lines:
+            cost = estimate_tokens(line) + 1
+            if cost > budget:
+                break
+            budget -= cost
+            included.append(line)
+        context = header + '\n'.join(included) + '\n'
+        if len(included) < len(lines):
+            context += f"\n（另有{len(lines) - len(included)}个视频未列出）\n"
+        return context
@@ -0,0 +1,275 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import mysql.connector
+from mysql.connector import pooling
+
+# mysql-connector 连接池的上限
+MAX_POOL_SIZE = pooling.CNX_POOL_MAXSIZE
+
+# 调用方统一捕获的数据库异常
+DatabaseError = (mysql.connector.Error, sqlite3.Error)
+
+# SQLite 中的时间列以ISO格式文本存储，读写时与 datetime 互相转换
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+@dataclass
+class PoolStats:
+    pool_size: int
+    in_use: int = 0
+    waiting: int = 0
+    checkouts: int = 0
+    errors: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+
+class AsyncDatabase:
+    """基于连接池的异步数据库访问层
+
+    阻塞的驱动调用放在专用线程池中执行，线程数与连接池大小一致；
+    协程在借出连接前先获取信号量，等待时间计入统计，避免阻塞事件循环。
+    """
+
+    def __init__(self, config: Dict[str, Any], pool_size: int = 10, pool_name: str = 'ytchat'):
+        self.config = config
+        self.pool_size = max(1, min(pool_size, MAX_POOL_SIZE))
+        self.pool_name = pool_name
+        self._pool: Optional[pooling.MySQLConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._stats = PoolStats(pool_size=self.pool_size)
+
+    async def connect(self):
+        """创建线程池和连接池（应用启动时调用）"""
+        self._ensure_started()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._get_pool)
+        except Exception as e:
+            # 数据库暂时不可用时不阻止服务启动，首次查询时会重试
+            print(f"数据库连接池创建失败: {e}")
+
+    async def close(self):
+        """关闭连接池和线程池（应用关闭时调用）"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            # mysql-connector 未提供公开的关闭方法
+            remove = getattr(pool, '_remove_connections', None)
+            if remove:
+                remove()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._semaphore = None
+
+    async def fetch_all(self, sql: str, params: Optional[Sequence] = None) -> List[Dict]:
+        """执行查询并返回所有行"""
+        return await self._run(self._fetch_all, sql, params)
+
+    async def fetch_one(self, sql: str, params: Optional[Sequence] = None) -> Optional[Dict]:
+        """执行查询并返回第一行"""
+        return await self._run(self._fetch_one, sql, params)
+
+    async def run_in_transaction(self, func: Callable[[Any], Any]) -> Any:
+        """在数据库线程中以一个事务执行 func(cursor)，正常返回时提交，抛出异常时回滚"""
+        return await self._run(self._transaction, func)
+
+    async def executemany(self, sql: str, rows: Sequence[Sequence]) -> int:
+        """在一个事务中批量执行写入语句，返回影响的行数"""
+        def write(cursor) -> int:
+            cursor.executemany(sql, rows)
+            return cursor.rowcount
+        return await self.run_in_transaction(write)
+
+    def stats(self) -> Dict:
+        """返回连接池统计信息"""
+        stats = asdict(self._stats)
+        stats['wait_avg'] = stats['wait_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool_size, thread_name_prefix=f"{self.pool_name}-db"
+            )
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+
+    def _get_pool(self) -> pooling.MySQLConnectionPool:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = pooling.MySQLConnectionPool(
+                    pool_name=self.pool_name,
+                    pool_size=self.pool_size,
+                    **self.config
+                )
+            return self._pool
+
+    async def _run(self, func, *args):
+        self._ensure_started()
+        stats = self._stats
+        stats.waiting += 1
+        wait_start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            stats.waiting -= 1
+        waited = time.perf_counter() - wait_start
+        stats.checkouts += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+        stats.in_use += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_use -= 1
+            self._semaphore.release()
+
+    def _fetch_all(self, sql: str, params: Optional[Sequence]) -> List[Dict]:
+        connection = self._get_pool().get_connection()
+        try:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params or ())
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            # 归还连接到连接池
+            connection.close()
+
+    def _fetch_one(self, sql: str, params: Optional[Sequence]) -> Optional[Dict]:
+        rows = self._fetch_all(sql, params)
+        return rows[0] if rows else None
+
+    def _transaction(self, func: Callable[[Any], Any]) -> Any:
+        connection = self._get_pool().get_connection()
+        try:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                result = func(cursor)
+                connection.commit()
+                return result
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
+
+def _dict_factory(cursor: sqlite3.Cursor, row: tuple) -> Dict:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class _SQLiteCursor:
+    """把 MySQL 风格的 %s 占位符转换为 ? 的游标包装"""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, sql: str, params: Optional[Sequence] = None):
+        self._cursor.execute(sql.replace('%s', '?'), tuple(params or ()))
+
+    def executemany(self, sql: str, rows: Sequence[Sequence]):
+        self._cursor.executemany(sql.replace('%s', '?'), [tuple(row) for row in rows])
+
+    def fetchall(self) -> List[Dict]:
+        return self._cursor.fetchall()
+
+    def fetchone(self) -> Optional[Dict]:
+        return self._cursor.fetchone()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteDatabase(AsyncDatabase):
+    """SQLite 数据访问层，接口与 AsyncDatabase 相同，用于本地开发和基准测试
+
+    每个数据库线程持有一个连接；SQL 中 MySQL 风格的 %s 占位符会转换为 ?。
+    """
+
+    def __init__(self, path: str, pool_size: int = 4, pool_name: str = 'ytchat'):
+        super().__init__({'path': path}, pool_size=pool_size, pool_name=pool_name)
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+
+    async def connect(self):
+        """创建线程池并检查数据库文件（应用启动时调用）"""
+        self._ensure_started()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._connection)
+        except sqlite3.Error as e:
+            print(f"数据库连接失败: {e}")
+
+    async def close(self):
+        """关闭所有连接和线程池（应用关闭时调用）"""
+        with self._pool_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+        await super().close()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+            )
+            connection.row_factory = _dict_factory
+            # WAL 模式下读不阻塞写
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+            with self._pool_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _fetch_all(self, sql: str, params: Optional[Sequence]) -> List[Dict]:
+        cursor = self._connection().execute(sql.replace('%s', '?'), tuple(params or ()))
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _transaction(self, func: Callable[[Any], Any]) -> Any:
+        connection = self._connection()
+        cursor = _SQLiteCursor(connection.cursor())
+        try:
+            result = func(cursor)
+            connection.commit()
+            return result
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
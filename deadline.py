@@ -0,0 +1,138 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import Context, ContextVar, copy_context
+from typing import AsyncIterator, Iterator, Optional, TypeVar
+
+import httpx
+
+# 调用方在请求头中给出的剩余时间（秒），如Go服务的HTTP客户端超时
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+T = TypeVar('T')
+
+# 当前请求的截止时间（time.monotonic()），None 表示没有截止时间
+_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """请求已超过截止时间，后续步骤不再执行"""
+
+
+def parse_timeout(value: Optional[str]) -> Optional[float]:
+    """解析请求头中的超时秒数，无效时返回 None"""
+    if not value:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if timeout > 0 else None
+
+
+@contextmanager
+def scope(timeout: Optional[float]) -> Iterator[Optional[float]]:
+    """在 timeout 秒后截止（已有更早的截止时间时保持不变），退出时恢复"""
+    deadline = _deadline.get()
+    if timeout is not None:
+        candidate = time.monotonic() + timeout
+        if deadline is None or candidate < deadline:
+            deadline = candidate
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def detached_context() -> Context:
+    """当前上下文的副本，其中没有截止时间；用于多个请求共享的任务，不受发起请求的截止时间限制"""
+    context = copy_context()
+    context.run(_deadline.set, None)
+    return context
+
+
+def remaining() -> Optional[float]:
+    """距截止时间的剩余秒数（可能为负），没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check():
+    """已超过截止时间时抛出 DeadlineExceeded"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("已超过请求截止时间")
+
+
+def clamp(timeout: Optional[float]) -> Optional[float]:
+    """把超时时间限制在剩余时间之内"""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(left, 0.0)
+    return left if timeout is None else min(timeout, left)
+
+
+def clamp_http_timeout(timeout: Optional[httpx.Timeout]) -> Optional[httpx.Timeout]:
+    """把 httpx 超时的各阶段限制在剩余时间之内；没有截止时间时原样返回"""
+    left = remaining()
+    if left is None:
+        return timeout
+    timeout = timeout or httpx.Timeout(left)
+    return httpx.Timeout(
+        connect=clamp(timeout.connect),
+        read=clamp(timeout.read),
+        write=clamp(timeout.write),
+        pool=clamp(timeout.pool),
+    )
+
+
+@asynccontextmanager
+async def enforce() -> AsyncIterator[None]:
+    """截止时间到达时取消其中的操作并抛出 DeadlineExceeded
+
+    到期时取消当前任务，再把取消转换为 DeadlineExceeded（兼容 Python 3.9，不依赖 asyncio.timeout_at）。
+    """
+    left = remaining()
+    if left is None:
+        yield
+        return
+    task = asyncio.current_task()
+    expired = False
+
+    def expire():
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_running_loop().call_later(max(left, 0.0), expire)
+    try:
+        yield
+    except asyncio.CancelledError:
+        if expired:
+            raise DeadlineExceeded("已超过请求截止时间") from None
+        raise
+    finally:
+        handle.cancel()
+    if expired:
+        # 其中的操作吞掉了取消
+        raise DeadlineExceeded("已超过请求截止时间")
+
+
+async def iterate(iterator: AsyncIterator[T]) -> AsyncIterator[T]:
+    """逐个取出异步迭代器的元素，每次等待都不超过剩余时间，超时抛出 DeadlineExceeded
+
+    用于流式输出：生成器在两次 yield 之间可能挂起，不能用 enforce() 包住整个循环。
+    """
+    while True:
+        try:
+            item = await asyncio.wait_for(iterator.__anext__(), clamp(None))
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError as e:
+            # Python 3.11 之前 asyncio.TimeoutError 与内置 TimeoutError 不是同一个类
+            if isinstance(e, DeadlineExceeded):
+                raise
+            raise DeadlineExceeded("已超过请求截止时间") from e
+        yield item
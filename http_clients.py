@@ -0,0 +1,109 @@
+import os
+from dataclasses import dataclass
+from typing import Dict
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+@dataclass
+class UpstreamConfig:
+    """单个上游服务的连接配置"""
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 5.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "UpstreamConfig":
+        """从环境变量读取配置，例如 QIANFAN_READ_TIMEOUT"""
+        base = cls(**defaults)
+        return cls(
+            connect_timeout=_env_float(f"{prefix}_CONNECT_TIMEOUT", base.connect_timeout),
+            read_timeout=_env_float(f"{prefix}_READ_TIMEOUT", base.read_timeout),
+            write_timeout=_env_float(f"{prefix}_WRITE_TIMEOUT", base.write_timeout),
+            pool_timeout=_env_float(f"{prefix}_POOL_TIMEOUT", base.pool_timeout),
+            max_connections=_env_int(f"{prefix}_MAX_CONNECTIONS", base.max_connections),
+            max_keepalive_connections=_env_int(f"{prefix}_MAX_KEEPALIVE", base.max_keepalive_connections),
+            keepalive_expiry=_env_float(f"{prefix}_KEEPALIVE_EXPIRY", base.keepalive_expiry),
+            http2=os.getenv(f"{prefix}_HTTP2", '1' if base.http2 else '0') == '1',
+        )
+
+    def timeout(self, **overrides) -> httpx.Timeout:
+        values = {
+            'connect': self.connect_timeout,
+            'read': self.read_timeout,
+            'write': self.write_timeout,
+            'pool': self.pool_timeout,
+        }
+        values.update(overrides)
+        return httpx.Timeout(**values)
+
+
+class HTTPClients:
+    """按上游划分的长连接HTTP客户端，生命周期与应用一致"""
+
+    def __init__(self):
+        self._configs: Dict[str, UpstreamConfig] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def register(self, name: str, config: UpstreamConfig):
+        self._configs[name] = config
+
+    def config(self, name: str) -> UpstreamConfig:
+        return self._configs[name]
+
+    def timeout(self, name: str, **overrides) -> httpx.Timeout:
+        """返回指定上游的超时配置，可覆盖其中部分值"""
+        return self._configs[name].timeout(**overrides)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """获取（必要时创建）指定上游的客户端"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(self._configs[name])
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        """关闭所有客户端（应用关闭时调用）"""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def _create(self, config: UpstreamConfig) -> httpx.AsyncClient:
+        http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE:
+            print("未安装h2，HTTP客户端退回HTTP/1.1")
+        return httpx.AsyncClient(
+            http2=http2,
+            timeout=config.timeout(),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+        )
+
+
+# 全局实例
+http_clients = HTTPClients()
+http_clients.register('qianfan', UpstreamConfig.from_env('QIANFAN', read_timeout=60.0))
+http_clients.register('youtube', UpstreamConfig.from_env('YOUTUBE', read_timeout=10.0))
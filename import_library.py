@@ -0,0 +1,310 @@
+"""批量导入视频库
+
+读取 YouTube 视频ID列表，分批获取视频信息，并发分析生成片段，按块以多行写入的事务写入
+videos / video_segments 表。每块提交后把其中的视频ID追加到检查点文件，导入中断后
+重新运行同一命令会跳过检查点中和数据库中已有的视频，从中断处继续。
+分析失败（只得到默认片段或不完整的结果）的视频不会写入，重新运行时会再次分析。
+
+输入文件：
+    *.jsonl  每行一个视频ID字符串，或带 youtube_id（或 you_tube_id / id）字段的对象，
+             对象带有 title 等字段时直接使用，不再请求 YouTube
+    *.csv    带 youtube_id（或 you_tube_id / id）列的表头，或第一列为视频ID
+    *.json   与 demo_data.json 相同结构（videos 和按视频序号关联的 segments），
+             或视频ID / 视频对象的数组
+
+用法：
+    python import_library.py channel_ids.jsonl --concurrency 8
+    python import_library.py demo_data.json
+数据库和千帆、YouTube 的配置与服务相同（DB_TYPE、DB_PATH、YOUTUBE_API_KEY 等环境变量）。
+分析结果与服务共用分析缓存（ANALYSIS_CACHE_PATH），已分析过的视频不再请求模型，--refresh 时重新分析。
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from analysis_cache import is_default_segments, is_partial_segments
+from db import DatabaseError
+from transcripts import SOURCE_ANALYSIS, is_valid_video_id
+
+_ID_FIELDS = ('youtube_id', 'you_tube_id', 'id')
+_INFO_FIELDS = ('title', 'description', 'thumbnail', 'duration')
+
+
+@dataclass
+class ImportEntry:
+    youtube_id: str
+    # 输入中已有的视频信息和片段，没有时分别从 YouTube 获取、由模型分析
+    info: Optional[Dict] = None
+    segments: Optional[List[Dict]] = None
+
+
+def _entry_from_object(obj, segments: Optional[List[Dict]] = None) -> Optional[ImportEntry]:
+    if isinstance(obj, str):
+        return ImportEntry(obj.strip())
+    if not isinstance(obj, dict):
+        return None
+    youtube_id = next((str(obj[name]).strip() for name in _ID_FIELDS if obj.get(name)), None)
+    if youtube_id is None:
+        return None
+    info = None
+    if obj.get('title'):
+        info = {name: obj.get(name) for name in _INFO_FIELDS}
+    return ImportEntry(youtube_id, info, segments)
+
+
+def read_entries(path: str) -> List[ImportEntry]:
+    """读取输入文件，返回去重后的待导入视频（无效的视频ID会被跳过并打印）"""
+    raw: List[Optional[ImportEntry]] = []
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8-sig') as f:
+        if ext == '.csv':
+            rows = list(csv.reader(f))
+            header = [name.strip().lower() for name in rows[0]] if rows else []
+            if any(name in header for name in _ID_FIELDS):
+                raw.extend(_entry_from_object(dict(zip(header, row))) for row in rows[1:])
+            else:
+                raw.extend(ImportEntry(row[0].strip()) for row in rows if row and row[0].strip())
+        elif ext == '.json':
+            data = json.load(f)
+            if isinstance(data, dict):
+                # demo_data.json：segments 的 video_id 是视频在 videos 中的序号（从1开始）
+                by_video: Dict[int, List[Dict]] = {}
+                for segment in data.get('segments', []):
+                    by_video.setdefault(segment['video_id'], []).append(segment)
+                raw.extend(
+                    _entry_from_object(video, by_video.get(i))
+                    for i, video in enumerate(data.get('videos', []), 1)
+                )
+            else:
+                raw.extend(_entry_from_object(item) for item in data)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    raw.append(_entry_from_object(json.loads(line) if line[0] in '{"' else line))
+
+    entries: Dict[str, ImportEntry] = {}
+    for entry in raw:
+        if entry is None or not is_valid_video_id(entry.youtube_id):
+            print(f"跳过无效的输入: {entry.youtube_id if entry else '(缺少视频ID)'}")
+            continue
+        entries.setdefault(entry.youtube_id, entry)
+    return list(entries.values())
+
+
+class Checkpoint:
+    """已导入视频ID的检查点文件，每行一个ID，只追加"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+    def record(self, youtube_ids: Iterable[str]):
+        youtube_ids = list(youtube_ids)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(f"{youtube_id}\n" for youtube_id in youtube_ids)
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(youtube_ids)
+
+
+class LibraryImporter:
+    """分批获取视频信息、并发分析、按块事务写入"""
+
+    def __init__(self, database, youtube_service, analyze, checkpoint: Checkpoint,
+                 batch_size: int = 200, chunk_size: int = 50, concurrency: int = 4):
+        self.database = database
+        self.youtube_service = youtube_service
+        # analyze(youtube_id, info) -> 片段列表，info 为视频信息字典；带有默认片段或不完整标记的结果视为失败
+        self.analyze = analyze
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.total = 0
+        self.imported = 0
+        self.segments = 0
+        self.skipped = 0
+        self.failed = 0
+        self._started = 0.0
+
+    async def run(self, entries: List[ImportEntry]):
+        self.total = len(entries)
+        self._started = time.perf_counter()
+        pending = [entry for entry in entries if entry.youtube_id not in self.checkpoint.done]
+        self.skipped = len(entries) - len(pending)
+        if self.skipped:
+            print(f"检查点中已有 {self.skipped} 个视频，跳过")
+        for i in range(0, len(pending), self.batch_size):
+            await self._import_batch(pending[i:i + self.batch_size])
+        self._report(final=True)
+
+    async def _import_batch(self, batch: List[ImportEntry]):
+        # 数据库中已有的视频（如上次在写入检查点前中断）直接记入检查点
+        existing = await self._existing_ids([entry.youtube_id for entry in batch])
+        if existing:
+            self.checkpoint.record(existing)
+            self.skipped += len(existing)
+            batch = [entry for entry in batch if entry.youtube_id not in existing]
+
+        missing_info = [entry.youtube_id for entry in batch if entry.info is None]
+        if missing_info:
+            infos = await self.youtube_service.get_videos_info(missing_info)
+            for entry in batch:
+                if entry.info is not None:
+                    continue
+                info = infos.get(entry.youtube_id)
+                if isinstance(info, Exception) or info is None:
+                    print(f"获取视频信息失败 {entry.youtube_id}: {info}")
+                    self.failed += 1
+                    continue
+                entry.info = {name: getattr(info, name) for name in _INFO_FIELDS}
+            batch = [entry for entry in batch if entry.info is not None]
+
+        # 分析完成的视频攒够一块就写入
+        chunk: List[ImportEntry] = []
+        for task in asyncio.as_completed([self._analyze(entry) for entry in batch]):
+            entry = await task
+            if entry is None:
+                continue
+            chunk.append(entry)
+            if len(chunk) >= self.chunk_size:
+                await self._write_chunk(chunk)
+                chunk = []
+        if chunk:
+            await self._write_chunk(chunk)
+
+    async def _analyze(self, entry: ImportEntry) -> Optional[ImportEntry]:
+        if entry.segments is not None:
+            return entry
+        async with self._semaphore:
+            try:
+                segments = await self.analyze(entry.youtube_id, entry.info)
+            except Exception as e:
+                print(f"分析视频失败 {entry.youtube_id}: {e}")
+                self.failed += 1
+                return None
+        # 分析失败时得到的是默认片段或不完整的片段，不写入也不记入检查点，下次运行时重试
+        if is_default_segments(segments) or is_partial_segments(segments):
+            kind = "默认片段" if is_default_segments(segments) else "不完整的分析结果"
+            print(f"分析视频失败 {entry.youtube_id}: 只得到{kind}")
+            self.failed += 1
+            return None
+        entry.segments = segments
+        return entry
+
+    async def _existing_ids(self, youtube_ids: List[str]) -> Set[str]:
+        if not youtube_ids:
+            return set()
+        placeholders = ', '.join(['%s'] * len(youtube_ids))
+        rows = await self.database.fetch_all(
+            f"SELECT you_tube_id FROM videos WHERE you_tube_id IN ({placeholders})", youtube_ids
+        )
+        return {row['you_tube_id'] for row in rows}
+
+    async def _write_chunk(self, chunk: List[ImportEntry]):
+        """在一个事务中写入一块视频及其全部片段，提交后记入检查点"""
+        youtube_ids = [entry.youtube_id for entry in chunk]
+
+        def write(cursor) -> int:
+            now = datetime.now()
+            cursor.executemany(
+                "INSERT INTO videos (you_tube_id, title, description, thumbnail, duration, created_at, updated_at)"
+                " VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                [(entry.youtube_id, entry.info['title'] or '', entry.info.get('description'),
+                  entry.info.get('thumbnail') or '', entry.info.get('duration') or 0, now, now)
+                 for entry in chunk]
+            )
+            placeholders = ', '.join(['%s'] * len(youtube_ids))
+            cursor.execute(
+                f"SELECT id, you_tube_id FROM videos WHERE you_tube_id IN ({placeholders})", youtube_ids
+            )
+            ids = {row['you_tube_id']: row['id'] for row in cursor.fetchall()}
+            rows = [
+                (ids[entry.youtube_id], segment['start_time'], segment['end_time'],
+                 segment.get('content'), segment.get('summary'), SOURCE_ANALYSIS, now, now)
+                for entry in chunk for segment in entry.segments
+            ]
+            if rows:
+                cursor.executemany(
+                    "INSERT INTO video_segments"
+                    " (video_id, start_time, end_time, content, summary, source, created_at, updated_at)"
+                    " VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    rows
+                )
+            return len(rows)
+
+        try:
+            self.segments += await self.database.run_in_transaction(write)
+        except DatabaseError as e:
+            # 整块回滚，不记入检查点，下次运行时重新导入
+            print(f"写入视频失败（{len(chunk)} 个视频）: {e}")
+            self.failed += len(chunk)
+            return
+        self.checkpoint.record(youtube_ids)
+        self.imported += len(chunk)
+        self._report()
+
+    def _report(self, final: bool = False):
+        elapsed = time.perf_counter() - self._started
+        rate = self.imported / elapsed * 60 if elapsed > 0 else 0.0
+        done = self.imported + self.skipped + self.failed
+        prefix = "导入完成" if final else "导入进度"
+        print(f"{prefix}: {done}/{self.total}，新导入 {self.imported} 个视频（{self.segments} 个片段），"
+              f"跳过 {self.skipped}，失败 {self.failed}，{rate:.1f} 个视频/分钟，耗时 {elapsed:.0f} 秒")
+
+
+async def _run(args):
+    from python_service import database, generate_video_segments, youtube_service
+    from youtube_service import YouTubeVideoInfo
+
+    async def analyze(youtube_id: str, info: Dict) -> List[Dict]:
+        # 分析使用输入文件中或批量获取的视频信息，不再逐个请求 YouTube
+        video_info = YouTubeVideoInfo(
+            title=info['title'] or '',
+            description=info.get('description') or '',
+            thumbnail=info.get('thumbnail') or '',
+            duration=int(info.get('duration') or 0),
+            channel_title='',
+            view_count=0,
+            like_count=0,
+        )
+        return await generate_video_segments(youtube_id, refresh=args.refresh, info=video_info)
+
+    entries = read_entries(args.input)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.input}.checkpoint")
+    importer = LibraryImporter(
+        database, youtube_service, analyze, checkpoint,
+        batch_size=args.batch_size, chunk_size=args.chunk_size, concurrency=args.concurrency,
+    )
+    await database.connect()
+    try:
+        await importer.run(entries)
+    finally:
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入视频库（可中断后继续）')
+    parser.add_argument('input', help='视频ID列表（.jsonl / .csv）或 demo_data.json 结构的文件')
+    parser.add_argument('--checkpoint', default=None, help='检查点文件，默认为 <input>.checkpoint')
+    parser.add_argument('--batch-size', type=int, default=200, help='每批获取视频信息的视频数')
+    parser.add_argument('--chunk-size', type=int, default=50, help='每个写入事务的视频数')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('IMPORT_CONCURRENCY', '4')),
+                        help='同时分析的视频数')
+    parser.add_argument('--refresh', action='store_true', help='不使用缓存的分析结果，重新分析所有视频')
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
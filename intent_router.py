@@ -0,0 +1,298 @@
+import importlib
+import re
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import metrics
+
+INTENT_ROUTES_TOTAL = metrics.counter(
+    'ytchat_intent_routes_total', '问题路由结果：意图及是否由本地处理', ('intent', 'outcome')
+)
+
+LIST_VIDEOS = 'list_videos'
+COUNT_VIDEOS = 'count_videos'
+VIDEO_DURATION = 'video_duration'
+SEGMENT_AT = 'segment_at'
+
+# 列表回答中最多列出的视频数
+MAX_LISTED_VIDEOS = 50
+# 问题中没有完整标题时，标题的字符二元组至少有这么多出现在问题中才认为指的是该视频
+TITLE_MATCH_THRESHOLD = 0.7
+
+_CLOCK_RE = re.compile(r'(?<!\d)(?:(\d{1,2}):)?(\d{1,3}):(\d{2})(?!\d)')
+_UNIT_TIME_RE = re.compile(r'(?:(\d+)个?(?:小时|钟头))?(?:(\d+)分(?:钟)?)?(?:(\d+)秒)?')
+_VIDEO_ID_RE = re.compile(r'(?:视频|id|编号)(?:为|是|号)?(\d+)(?:号)?|(?:第)?(\d+)号视频')
+
+_COUNT_RE = re.compile(r'(?:多少|几)(?:个|部|条)?视频|视频(?:的)?(?:数量|总数|个数)')
+_LIST_RE = re.compile(
+    r'(?:有哪些|有什么|有啥|都有些?什么)视频|(?:列出|列举|显示|展示|看看|查看)(?:一下)?(?:所有|全部)?(?:的)?视频'
+    r'|^(?:所有|全部)(?:的)?视频(?:列表)?$|视频(?:列表|清单|目录)'
+)
+# 带主题限定的问题（如"有哪些讲Python的视频"、"有几个视频提到机器学习"）需要检索，交给大模型
+_TOPIC_RE = re.compile(r'关于|讲|介绍|涉及|相关|有关|包含|提到')
+# 列表和数量问题去掉意图短语后只能剩下这些词，否则说明带有限定条件（如"Python和Go有哪些视频"）
+_FILLER_RE = re.compile(
+    r'请问|请|麻烦|帮我|给我|告诉我|想知道|想要|想|我们|你们|你|我|这里|这儿|目前|现在|当前'
+    r'|一共|总共|总|共|都|所有|全部|视频库|资料库|库里|库中|里面|里|中|系统|平台|能不能|能否|可以|能|一下'
+    r'|是多少|是几个|是几|有|是|的|了|吗|呢|吧|啊|呀|么'
+)
+# 判断主题限定时去掉书名号中的标题和"第7讲"这样的序号，它们本身可能含有主题词
+_NOT_TOPIC_RE = re.compile(r'《[^》]*》|第[\d一二三四五六七八九十百]+讲')
+_DURATION_RE = re.compile(r'多长|多久|时长|长度|几分钟|多少分钟|多少秒|几个小时|多少小时')
+# 问的是做某件事需要的时间（"学习Python要多久"、"多长时间能学会Go"）或某部分内容的时长（"有多少秒的广告"），
+# 不是视频时长
+_OTHER_DURATION_RE = re.compile(
+    r'(?:要|需要|得|花|用)(?:多长时间|多少时间|多久|几分钟|多少分钟|多少秒|几个小时|多少小时)'
+    r'|(?:多长时间|多少时间|多久|几分钟|多少分钟|几个小时|多少小时)(?:才|就|能|可以|学|看完|掌握)'
+    r'|(?:多长时间|几分钟|多少分钟|多少秒|几个小时|多少小时)的'
+)
+_SEGMENT_CUE_RE = re.compile(r'讲|说|内容|是什么|在干|发生|播放|哪一段|哪个片段|哪段')
+
+
+@dataclass
+class Intent:
+    """问题的意图，params 为处理需要的参数（如时间点）"""
+    name: str
+    params: Dict = field(default_factory=dict)
+
+
+def parse_timestamp(text: str) -> Optional[int]:
+    """从问题中取出时间点（秒），支持 "12:34"、"1:02:03"、"12分30秒"、"734秒" 等写法"""
+    match = _CLOCK_RE.search(text)
+    if match:
+        hours, minutes, seconds = match.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+    for match in _UNIT_TIME_RE.finditer(text):
+        hours, minutes, seconds = match.groups()
+        if hours or minutes or seconds:
+            return int(hours or 0) * 3600 + int(minutes or 0) * 60 + int(seconds or 0)
+    return None
+
+
+def format_duration(seconds: Optional[int]) -> str:
+    if not seconds:
+        return '未知'
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours}小时")
+    if minutes:
+        parts.append(f"{minutes}分")
+    if seconds or not parts:
+        parts.append(f"{seconds}秒")
+    return ''.join(parts)
+
+
+def _title_key(text: str) -> str:
+    """标题匹配用的文本：统一全半角和大小写，去掉所有空白、标点和符号，比缓存键更宽松"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(ch for ch in text if not unicodedata.category(ch).startswith(('P', 'Z', 'C', 'S')))
+
+
+def _bigrams(text: str) -> FrozenSet[str]:
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+
+def _compact(question: str) -> str:
+    """统一全半角和大小写并去掉空白，保留标点（时间中的冒号需要保留）"""
+    return re.sub(r'\s+', '', unicodedata.normalize('NFKC', question).lower())
+
+
+def _is_bare(text: str, pattern: re.Pattern) -> bool:
+    """去掉意图短语和客套词后没有剩下其他文字，即问题没有附加限定条件"""
+    rest = _FILLER_RE.sub('', pattern.sub('', text))
+    return not re.sub(r'[\W_]', '', rest)
+
+
+class RuleIntentClassifier:
+    """基于规则的意图分类：只识别可以直接由视频目录回答的问题，其余返回 None 交给大模型"""
+
+    def classify(self, question: str) -> Optional[Intent]:
+        text = _compact(question)
+        if not text:
+            return None
+        t = parse_timestamp(text)
+        if t is not None and _SEGMENT_CUE_RE.search(text):
+            return Intent(SEGMENT_AT, {'t': t})
+        # 带主题或其他限定条件的问题需要检索，不由视频目录直接回答
+        if _TOPIC_RE.search(_NOT_TOPIC_RE.sub('', text)):
+            return None
+        if _COUNT_RE.search(text):
+            return Intent(COUNT_VIDEOS) if _is_bare(text, _COUNT_RE) else None
+        if _DURATION_RE.search(text) and not _OTHER_DURATION_RE.search(text):
+            return Intent(VIDEO_DURATION)
+        if _LIST_RE.search(text) and _is_bare(text, _LIST_RE):
+            return Intent(LIST_VIDEOS)
+        return None
+
+
+def load_classifier(spec: Optional[str]):
+    """加载意图分类器，spec 形如 "module:factory"，为空时使用规则分类器
+
+    分类器需实现 classify(question) -> Optional[Intent]。
+    """
+    if not spec:
+        return RuleIntentClassifier()
+    module_name, _, attr = spec.partition(':')
+    factory: Callable = getattr(importlib.import_module(module_name), attr)
+    return factory()
+
+
+class CatalogAnswerer:
+    """由视频目录和片段索引直接回答问题，无法确定答案时返回 None"""
+
+    def __init__(self, catalog, segment_index):
+        self.catalog = catalog
+        self.segment_index = segment_index
+        # 按视频库版本缓存的（归一化标题, 标题二元组, 视频ID）列表
+        self._titles: Tuple[Optional[str], List[Tuple[str, FrozenSet[str], int]]] = (None, [])
+
+    async def answer(self, intent: Intent, question: str) -> Optional[Dict]:
+        if not self.catalog.loaded:
+            return None
+        handler = getattr(self, f"_answer_{intent.name}", None)
+        if handler is None:
+            return None
+        return await handler(intent, question)
+
+    async def _answer_list_videos(self, intent: Intent, question: str) -> Optional[Dict]:
+        video_ids = self.catalog.video_ids()
+        if not video_ids:
+            return {'answer': "视频库中还没有视频。"}
+        lines = []
+        for i, video_id in enumerate(video_ids[:MAX_LISTED_VIDEOS], 1):
+            video = self.catalog.get(video_id)
+            lines.append(f"{i}. {video.title}（视频ID: {video.id}，时长: {format_duration(video.duration)}）")
+        if len(video_ids) > MAX_LISTED_VIDEOS:
+            lines.append(f"……等共{len(video_ids)}个视频")
+        return {'answer': f"视频库中共有{len(video_ids)}个视频：\n" + '\n'.join(lines)}
+
+    async def _answer_count_videos(self, intent: Intent, question: str) -> Optional[Dict]:
+        stats = self.catalog.stats()
+        return {'answer': f"视频库中共有{stats['videos']}个视频，共{stats['segments']}个片段。"}
+
+    async def _answer_video_duration(self, intent: Intent, question: str) -> Optional[Dict]:
+        video = self.resolve_video(question)
+        if video is None:
+            return None
+        return {
+            'answer': f"《{video.title}》的时长为{format_duration(video.duration)}。",
+            'video_id': video.id,
+            'youtube_id': video.youtube_id,
+        }
+
+    async def _answer_segment_at(self, intent: Intent, question: str) -> Optional[Dict]:
+        video = self.resolve_video(question)
+        if video is None:
+            return None
+        t = intent.params['t']
+        segment = (await self.segment_index.get(video.id)).at(t)
+        if segment is None:
+            return {
+                'answer': f"《{video.title}》在{format_duration(t)}处没有对应的片段。",
+                'video_id': video.id,
+                'youtube_id': video.youtube_id,
+            }
+        summary = segment.get('summary') or ''
+        answer = f"《{video.title}》第{format_duration(t)}处的内容：{segment['content']}"
+        if summary:
+            answer += f"\n{summary}"
+        return {
+            'answer': answer,
+            'video_id': video.id,
+            'youtube_id': video.youtube_id,
+            'start_time': segment['start_time'],
+            'end_time': segment['end_time'],
+        }
+
+    def resolve_video(self, question: str):
+        """找出问题所指的视频
+
+        依次尝试：问题中出现的完整标题（取最长的），明确的视频ID，
+        大部分字符二元组出现在问题中的标题（最佳匹配不唯一时视为无法确定）。
+        标题优先于视频ID，因为标题本身可能包含 "视频1" 这样的文字。
+        """
+        normalized = _title_key(question)
+        question_bigrams = _bigrams(normalized)
+        best: Optional[Tuple[int, int]] = None
+        best_overlap, best_partial, tied = 0.0, None, False
+        for title, title_bigrams, video_id in self._title_table():
+            if not title:
+                continue
+            if title in normalized:
+                if best is None or len(title) > best[0]:
+                    best = (len(title), video_id)
+                continue
+            if best is None and title_bigrams:
+                overlap = len(title_bigrams & question_bigrams) / len(title_bigrams)
+                if overlap > best_overlap:
+                    best_overlap, best_partial, tied = overlap, video_id, False
+                elif overlap == best_overlap:
+                    tied = True
+        if best is not None:
+            return self.catalog.get(best[1])
+        for match in _VIDEO_ID_RE.finditer(_compact(question)):
+            video = self.catalog.get(int(match.group(1) or match.group(2)))
+            if video is not None:
+                return video
+        if best_partial is not None and best_overlap >= TITLE_MATCH_THRESHOLD and not tied:
+            return self.catalog.get(best_partial)
+        return None
+
+    def _title_table(self) -> List[Tuple[str, FrozenSet[str], int]]:
+        version = self.catalog.library_version
+        if self._titles[0] != version:
+            titles = []
+            for video_id, title in self.catalog.titles():
+                title = _title_key(title)
+                titles.append((title, _bigrams(title), video_id))
+            self._titles = (version, titles)
+        return self._titles[1]
+
+
+class IntentRouter:
+    """把可以由视频目录直接回答的问题路由到本地处理，其余交给大模型；记录每次路由决定"""
+
+    def __init__(self, classifier, answerer: CatalogAnswerer, recent: int = 100):
+        self.classifier = classifier
+        self.answerer = answerer
+        # 最近的路由决定，用于排查误判
+        self._recent = deque(maxlen=recent)
+
+    async def route(self, question: str) -> Optional[Dict]:
+        """返回本地回答（ChatResponse 的字段），需要交给大模型时返回 None"""
+        started = time.perf_counter()
+        try:
+            intent = self.classifier.classify(question)
+        except Exception as e:
+            print(f"意图分类失败: {e}")
+            intent = None
+        answer = None
+        if intent is not None:
+            try:
+                answer = await self.answerer.answer(intent, question)
+            except Exception as e:
+                print(f"本地回答失败: {e}")
+        name = intent.name if intent is not None else 'llm'
+        # local: 本地回答；fallback: 识别出意图但无法回答（如找不到视频），交给大模型
+        outcome = 'local' if answer is not None else ('fallback' if intent is not None else 'llm')
+        elapsed = (time.perf_counter() - started) * 1000
+        INTENT_ROUTES_TOTAL.inc(intent=name, outcome=outcome)
+        self._recent.append({
+            'question': question[:200],
+            'intent': name,
+            'params': intent.params if intent is not None else {},
+            'outcome': outcome,
+            'ms': round(elapsed, 2),
+        })
+        if intent is not None:
+            print(f"问题路由: {name} -> {outcome} ({elapsed:.1f}ms) {question[:80]}")
+        return answer
+
+    def stats(self) -> Dict:
+        return {"recent": list(self._recent)}
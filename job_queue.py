@@ -0,0 +1,183 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+@dataclass
+class AnalysisJob:
+    id: str
+    video_id: str
+    # 跳过分析结果缓存，重新请求模型
+    refresh: bool = False
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "video_id": self.video_id,
+            "refresh": self.refresh,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class AnalysisJobQueue:
+    """视频分析后台任务队列：固定数量的worker并发执行，同一视频的重复提交会合并
+
+    handler(video_id, refresh) 执行分析；on_update 在任务开始执行和结束时调用，可用于把任务状态发布给其他进程。
+    """
+
+    def __init__(self, handler: Callable[[str, bool], Awaitable[Any]], concurrency: int = 2, max_finished: int = 1000,
+                 on_update: Optional[Callable[[AnalysisJob], Awaitable[None]]] = None):
+        self.handler = handler
+        self.on_update = on_update
+        self.concurrency = concurrency
+        self.max_finished = max_finished
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._jobs: Dict[str, AnalysisJob] = {}
+        self._active: Dict[str, AnalysisJob] = {}
+        # 视频的任务执行中又收到 refresh 提交时，等当前任务结束后再执行的重新分析任务
+        self._followups: Dict[str, AnalysisJob] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, video_id: str, refresh: bool = False) -> Tuple[AnalysisJob, bool]:
+        """提交分析任务，返回（任务, 是否新建）；视频已在排队或执行中时返回已有任务
+
+        refresh 的任务合并到仍在排队的已有任务时，该任务也改为强制重新分析；
+        已有任务正在执行时（它可能使用了缓存的结果），返回一个在其结束后执行的重新分析任务。
+        """
+        job = self._active.get(video_id)
+        if job is not None and refresh and job.status == RUNNING:
+            followup = self._followups.get(video_id)
+            if followup is not None:
+                self.deduplicated += 1
+                return followup, False
+            followup = self._new_job(video_id, refresh=True)
+            self._followups[video_id] = followup
+            return followup, True
+        if job is not None:
+            if refresh:
+                job.refresh = True
+            self.deduplicated += 1
+            return job, False
+        job = self._new_job(video_id, refresh=refresh)
+        self._active[video_id] = job
+        self._queue.put_nowait(job)
+        return job, True
+
+    def _new_job(self, video_id: str, refresh: bool) -> AnalysisJob:
+        job = AnalysisJob(id=uuid.uuid4().hex, video_id=video_id, refresh=refresh)
+        self._jobs[job.id] = job
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: AnalysisJob, poll_interval: float = 0.2) -> AnalysisJob:
+        while job.status in (QUEUED, RUNNING):
+            await asyncio.sleep(poll_interval)
+        return job
+
+    def stats(self) -> Dict:
+        finished = self.succeeded + self.failed
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "running": sum(1 for job in self._active.values() if job.status == RUNNING),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "pending_refresh": len(self._followups),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "wait_avg": self.wait_total / finished if finished else 0.0,
+            "run_avg": self.run_total / finished if finished else 0.0,
+            "run_max": self.run_max,
+        }
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            job.started_at = time.time()
+            await self._notify(job)
+            try:
+                job.result = await self.handler(job.video_id, job.refresh)
+                job.status = SUCCEEDED
+                self.succeeded += 1
+            except asyncio.CancelledError:
+                job.status = FAILED
+                job.error = "任务被取消"
+                raise
+            except Exception as e:
+                print(f"视频分析任务失败: {e}")
+                job.status = FAILED
+                job.error = str(e)
+                self.failed += 1
+            finally:
+                job.finished_at = time.time()
+                self._record(job)
+                self._queue.task_done()
+            await self._notify(job)
+
+    async def _notify(self, job: AnalysisJob):
+        if self.on_update is None:
+            return
+        try:
+            await self.on_update(job)
+        except Exception as e:
+            print(f"发布任务状态失败: {e}")
+
+    def _record(self, job: AnalysisJob):
+        if self._active.get(job.video_id) is job:
+            del self._active[job.video_id]
+            followup = self._followups.pop(job.video_id, None)
+            if followup is not None:
+                self._active[job.video_id] = followup
+                self._queue.put_nowait(followup)
+        wait = job.started_at - job.created_at
+        run = job.finished_at - job.started_at
+        self.wait_total += wait
+        self.run_total += run
+        self.run_max = max(self.run_max, run)
+        # 只保留最近完成的任务
+        self._finished[job.id] = None
+        while len(self._finished) > self.max_finished:
+            old_id, _ = self._finished.popitem(last=False)
+            self._jobs.pop(old_id, None)
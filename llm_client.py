@@ -0,0 +1,389 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+import deadline
+from http_clients import http_clients
+
+# 请求优先级，数值越小越优先
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# 需要重试的HTTP状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(Exception):
+    """上游大模型服务不可用（重试耗尽或熔断中）"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """熔断器打开，直接拒绝请求"""
+
+
+class PrioritySemaphore:
+    """按优先级唤醒等待者的信号量"""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = []
+        self._counter = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int):
+        if self._value > 0 and not self.waiting:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已被唤醒但随后被取消，需要把名额还回去
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+class TokenBucket:
+    """令牌桶限速，rate 为每秒请求数，rate <= 0 表示不限速"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # 在事件循环中首次使用时创建：客户端在模块导入时构建，Python 3.9 的锁会绑定到导入时的事件循环
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却结束后放行一个探测请求"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release_probe(self):
+        """探测请求没有得到结果就结束（截止时间到达或被取消）时归还探测名额，下一个请求重新探测"""
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class HedgePolicy:
+    """对冲请求：主请求超过延迟阈值仍未返回时，用更便宜、更快的模型并发发送一个备用请求
+
+    阈值取最近主请求耗时的分位数（默认p95），样本不足时使用固定的 delay。
+    """
+
+    def __init__(self, model: str, delay: float = 3.0, percentile: float = 95.0,
+                 window: int = 200, min_samples: int = 20):
+        self.model = model
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+
+    def threshold(self) -> float:
+        if len(self._latencies) < self.min_samples:
+            return self.delay
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return latencies[index]
+
+    def observe(self, latency: float):
+        """记录一次主请求耗时（被取消的主请求记录取消前已等待的时间）"""
+        self._latencies.append(latency)
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model,
+            "threshold": self.threshold(),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class LLMClient:
+    """千帆调用的统一出口：全局并发上限、令牌桶限速、优先级、带抖动的指数退避重试和熔断"""
+
+    def __init__(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        upstream: str = 'qianfan',
+        max_concurrency: int = 8,
+        rate: float = 5.0,
+        burst: float = 10.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.url = url
+        self.headers = headers
+        self.upstream = upstream
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = PrioritySemaphore(max_concurrency)
+        self._bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    async def complete(self, data: Dict, priority: int = PRIORITY_INTERACTIVE,
+                       timeout: Optional[httpx.Timeout] = None) -> Dict:
+        """发送一次对话补全请求，返回解析后的JSON
+
+        请求有截止时间时，每次尝试的超时不超过剩余时间，超过截止时间后不再重试。
+        """
+        deadline.check()
+        probe = self._check_breaker()
+        try:
+            last_error: Optional[Exception] = None
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    # 上一次尝试已经记录了失败，探测名额随之结束
+                    probe = False
+                    backoff = self._backoff(attempt)
+                    left = deadline.remaining()
+                    if left is not None and left <= backoff:
+                        self.failures += 1
+                        raise deadline.DeadlineExceeded(f"剩余时间不足以重试: {last_error}")
+                    self.retries += 1
+                    await asyncio.sleep(backoff)
+                    deadline.check()
+                    probe = self._check_breaker()
+                async with self._slot(priority):
+                    try:
+                        response = await http_clients.get(self.upstream).post(
+                            self.url, json=data, headers=self.headers, timeout=deadline.clamp_http_timeout(timeout)
+                        )
+                    except httpx.TransportError as e:
+                        last_error = e
+                        self.breaker.record_failure()
+                        continue
+                if response.status_code in RETRYABLE_STATUS:
+                    last_error = LLMUnavailableError(f"HTTP {response.status_code}")
+                    self.breaker.record_failure()
+                    continue
+                self.breaker.record_success()
+                return response.json()
+
+            self.failures += 1
+            deadline.check()
+            raise LLMUnavailableError(f"AI服务请求失败: {last_error}")
+        finally:
+            # 截止时间、取消等没有记录成功或失败就结束时，不能一直占着探测名额
+            if probe:
+                self.breaker.release_probe()
+
+    async def complete_hedged(self, data: Dict, hedge: Optional[HedgePolicy],
+                              priority: int = PRIORITY_INTERACTIVE,
+                              timeout: Optional[httpx.Timeout] = None) -> Dict:
+        """发送对话补全请求，主请求超过对冲阈值时并发请求备用模型，返回先成功的结果
+
+        一方失败（异常或返回 error）时继续等待另一方；两者都失败时返回或抛出最后一个失败。
+        """
+        if hedge is None:
+            return await self.complete(data, priority, timeout)
+        hedge.requests += 1
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self.complete(data, priority, timeout))
+
+        def observe(task: asyncio.Task):
+            if task.cancelled() or task.exception() is None:
+                hedge.observe(time.monotonic() - started)
+
+        primary.add_done_callback(observe)
+        pending = {primary}
+        try:
+            await asyncio.wait(pending, timeout=hedge.threshold())
+            if not primary.done():
+                hedge.hedged += 1
+                pending.add(asyncio.ensure_future(self.complete({**data, "model": hedge.model}, priority, timeout)))
+            failure: Optional[asyncio.Task] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and "error" not in task.result():
+                        if task is primary:
+                            hedge.primary_wins += 1
+                        else:
+                            hedge.hedge_wins += 1
+                        return task.result()
+                    failure = task
+            return failure.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @asynccontextmanager
+    async def stream(self, data: Dict, priority: int = PRIORITY_INTERACTIVE,
+                     timeout: Optional[httpx.Timeout] = None) -> AsyncIterator[httpx.Response]:
+        """以流式模式发送请求（开始输出后不再重试）"""
+        deadline.check()
+        probe = self._check_breaker()
+        try:
+            async with self._slot(priority), AsyncExitStack() as stack:
+                try:
+                    # 截止时间前没有收到响应头时取消，不依赖传输层的超时
+                    async with deadline.enforce():
+                        response = await stack.enter_async_context(http_clients.get(self.upstream).stream(
+                            "POST", self.url, json=data, headers=self.headers,
+                            timeout=deadline.clamp_http_timeout(timeout)
+                        ))
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise LLMUnavailableError(f"HTTP {response.status_code}")
+                    yield response
+                except (httpx.TransportError, LLMUnavailableError):
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    probe = False
+                    raise
+            self.breaker.record_success()
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self._semaphore.waiting,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+        }
+
+    def _check_breaker(self) -> bool:
+        """熔断中时拒绝请求；返回本次请求是否为半开状态下的探测请求"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("AI服务暂时不可用（熔断中）")
+        return self.breaker.state == CircuitBreaker.HALF_OPEN
+
+    def _backoff(self, attempt: int) -> float:
+        # 全抖动的指数退避
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @asynccontextmanager
+    async def _slot(self, priority: int):
+        await self._semaphore.acquire(priority)
+        try:
+            await self._bucket.acquire()
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._semaphore.release()
+
+
+def create_hedge_policy() -> Optional[HedgePolicy]:
+    """根据环境变量创建对冲策略，未配置备用模型时不对冲"""
+    model = os.getenv('QIANFAN_HEDGE_MODEL', '')
+    if not model:
+        return None
+    return HedgePolicy(
+        model,
+        delay=float(os.getenv('QIANFAN_HEDGE_DELAY', '3')),
+        percentile=float(os.getenv('QIANFAN_HEDGE_PERCENTILE', '95')),
+    )
+
+
+def create_llm_client(url: str, headers: Dict[str, str]) -> LLMClient:
+    """根据环境变量创建千帆客户端"""
+    return LLMClient(
+        url,
+        headers,
+        max_concurrency=int(os.getenv('QIANFAN_MAX_CONCURRENCY', '8')),
+        rate=float(os.getenv('QIANFAN_RATE_LIMIT', '5')),
+        burst=float(os.getenv('QIANFAN_BURST', '10')),
+        max_retries=int(os.getenv('QIANFAN_MAX_RETRIES', '3')),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv('QIANFAN_BREAKER_THRESHOLD', '5')),
+            reset_timeout=float(os.getenv('QIANFAN_BREAKER_RESET', '30')),
+        ),
+    )
@@ -19,6 +19,12 @@ type Video struct {
 	Segments []VideoSegment `json:"segments" gorm:"foreignKey:VideoID"`
 }
 
+// 视频片段来源，与 Python 服务 transcripts.py 中的 SOURCE_ANALYSIS / SOURCE_TRANSCRIPT 一致
+const (
+	SegmentSourceAnalysis   = "analysis"
+	SegmentSourceTranscript = "transcript"
+)
+
 // VideoSegment 视频片段模型
 type VideoSegment struct {
 	ID        uint      `json:"id" gorm:"primaryKey"`
@@ -30,6 +36,9 @@ type VideoSegment struct {
 	CreatedAt time.Time `json:"created_at"`
 	UpdatedAt time.Time `json:"updated_at"`
 
+	// 片段来源：analysis（内容分析，由 ProcessVideoContent 替换）或 transcript（字幕分块，由 Python 服务替换）
+	Source string `json:"source" gorm:"size:20;not null;default:analysis"`
+
 	// 关联
 	Video Video `json:"video" gorm:"foreignKey:VideoID"`
 }
@@ -6,12 +6,14 @@ import (
 	"fmt"
 	"io"
 	"net/http"
+	"strconv"
 	"time"
 	"ytchat/dao"
 	"ytchat/models"
 	"ytchat/settings"
 
 	"go.uber.org/zap"
+	"gorm.io/gorm"
 )
 
 // VideoInfoResponse Python服务返回的视频信息
@@ -71,7 +73,15 @@ func ProcessChatWithPython(question string) (*ChatResponse, error) {
 		return nil, fmt.Errorf("序列化请求失败: %v", err)
 	}
 
-	resp, err := client.Post(settings.Conf.PythonServiceConfig.URL+"/chat", "application/json", bytes.NewBuffer(jsonData))
+	req, err := http.NewRequest(http.MethodPost, settings.Conf.PythonServiceConfig.URL+"/chat", bytes.NewBuffer(jsonData))
+	if err != nil {
+		return nil, fmt.Errorf("创建请求失败: %v", err)
+	}
+	req.Header.Set("Content-Type", "application/json")
+	// 把客户端超时告诉Python服务，超时后它会取消仍在进行的模型请求
+	req.Header.Set("X-Request-Timeout", strconv.Itoa(settings.Conf.PythonServiceConfig.Timeout))
+
+	resp, err := client.Do(req)
 	if err != nil {
 		return nil, fmt.Errorf("请求Python服务失败: %v", err)
 	}
@@ -96,51 +106,123 @@ func ProcessChatWithPython(question string) (*ChatResponse, error) {
 	return &chatResp, nil
 }
 
-// ProcessVideoContent 异步处理视频内容分析
-func ProcessVideoContent(videoID uint, youtubeID string) {
-	client := &http.Client{Timeout: 300 * time.Second}
+// analysisSegment Python服务分析出的视频片段
+type analysisSegment struct {
+	StartTime int    `json:"start_time"`
+	EndTime   int    `json:"end_time"`
+	Content   string `json:"content"`
+	Summary   string `json:"summary"`
+}
 
-	url := fmt.Sprintf("%s/video/%s/analyze", settings.Conf.PythonServiceConfig.URL, youtubeID)
-	resp, err := client.Post(url, "application/json", nil)
+// analysisJob Python服务返回的分析任务
+type analysisJob struct {
+	JobID  string `json:"job_id"`
+	Status string `json:"status"`
+	Error  string `json:"error"`
+	Result *struct {
+		Segments []analysisSegment `json:"segments"`
+		// 分析失败时 Python 服务返回的默认片段
+		Default bool `json:"default"`
+	} `json:"result"`
+}
+
+const (
+	analysisPollInterval = 2 * time.Second
+	analysisTimeout      = 300 * time.Second
+)
+
+// getAnalysisJob 获取分析任务状态
+func getAnalysisJob(client *http.Client, method, url string) (*analysisJob, error) {
+	req, err := http.NewRequest(method, url, nil)
 	if err != nil {
-		zap.L().Error("分析视频内容失败", zap.Error(err))
-		return
+		return nil, err
+	}
+	resp, err := client.Do(req)
+	if err != nil {
+		return nil, fmt.Errorf("请求Python服务失败: %v", err)
 	}
 	defer resp.Body.Close()
 
 	if resp.StatusCode != http.StatusOK {
 		body, _ := io.ReadAll(resp.Body)
-		zap.L().Error("分析视频内容失败", zap.String("error", string(body)))
+		return nil, fmt.Errorf("Python服务返回错误: %s", string(body))
+	}
+
+	var job analysisJob
+	if err := json.NewDecoder(resp.Body).Decode(&job); err != nil {
+		return nil, fmt.Errorf("解析响应失败: %v", err)
+	}
+	return &job, nil
+}
+
+// ProcessVideoContent 异步处理视频内容分析
+func ProcessVideoContent(videoID uint, youtubeID string) {
+	client := &http.Client{Timeout: 30 * time.Second}
+
+	// 提交分析任务，然后轮询任务状态
+	url := fmt.Sprintf("%s/video/%s/analyze", settings.Conf.PythonServiceConfig.URL, youtubeID)
+	job, err := getAnalysisJob(client, http.MethodPost, url)
+	if err != nil {
+		zap.L().Error("分析视频内容失败", zap.Error(err))
 		return
 	}
 
-	var result struct {
-		Segments []struct {
-			StartTime int    `json:"start_time"`
-			EndTime   int    `json:"end_time"`
-			Content   string `json:"content"`
-			Summary   string `json:"summary"`
-		} `json:"segments"`
+	jobURL := fmt.Sprintf("%s/jobs/%s", settings.Conf.PythonServiceConfig.URL, job.JobID)
+	deadline := time.Now().Add(analysisTimeout)
+	for job.Status == "queued" || job.Status == "running" {
+		if time.Now().After(deadline) {
+			zap.L().Error("分析视频内容超时", zap.String("job_id", job.JobID))
+			return
+		}
+		time.Sleep(analysisPollInterval)
+		if job, err = getAnalysisJob(client, http.MethodGet, jobURL); err != nil {
+			zap.L().Error("查询分析任务失败", zap.Error(err))
+			return
+		}
 	}
 
-	if err := json.NewDecoder(resp.Body).Decode(&result); err != nil {
-		zap.L().Error("解析分析结果失败", zap.Error(err))
+	if job.Status != "succeeded" || job.Result == nil {
+		zap.L().Error("分析视频内容失败", zap.String("error", job.Error))
 		return
 	}
+	result := job.Result
+	if result.Default {
+		// 默认片段只是按时长等分的占位内容，不替换已有的分析片段
+		zap.L().Warn("视频内容分析失败，只得到默认片段", zap.String("youtube_id", youtubeID))
+		var count int64
+		if err := dao.GetDB().Model(&models.VideoSegment{}).Where("video_id = ?", videoID).Count(&count).Error; err != nil || count > 0 {
+			return
+		}
+	}
 
-	// 保存片段到数据库
-	db := dao.GetDB()
+	// 在一个事务中用新的分析片段替换该视频原有的分析片段；字幕分块由 Python 服务维护，不受影响
+	segments := make([]models.VideoSegment, 0, len(result.Segments))
 	for _, segment := range result.Segments {
-		videoSegment := models.VideoSegment{
+		segments = append(segments, models.VideoSegment{
 			VideoID:   videoID,
 			StartTime: segment.StartTime,
 			EndTime:   segment.EndTime,
 			Content:   segment.Content,
 			Summary:   segment.Summary,
+			Source:    models.SegmentSourceAnalysis,
+		})
+	}
+	err = dao.GetDB().Transaction(func(tx *gorm.DB) error {
+		if err := tx.Where("video_id = ? AND source = ?", videoID, models.SegmentSourceAnalysis).
+			Delete(&models.VideoSegment{}).Error; err != nil {
+			return err
 		}
-		if err := db.Create(&videoSegment).Error; err != nil {
-			zap.L().Error("保存视频片段失败", zap.Error(err))
+		if len(segments) > 0 {
+			if err := tx.Create(&segments).Error; err != nil {
+				return err
+			}
 		}
+		// 更新视频的时间戳，让 Python 服务的视频目录发现片段变化（包括被删除的旧片段）
+		return tx.Model(&models.Video{}).Where("id = ?", videoID).Update("updated_at", time.Now()).Error
+	})
+	if err != nil {
+		zap.L().Error("保存视频片段失败", zap.Error(err))
+		return
 	}
 
 	zap.L().Info("视频内容分析完成",
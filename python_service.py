@@ -1,15 +1,46 @@
 import asyncio
+import hashlib
 import json
-import httpx
+import math
 import re
 import os
-import mysql.connector
-from mysql.connector import Error
-from typing import Dict, List, Optional, Tuple
+import time
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import uvicorn
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, confloat
+import deadline
+import metrics
+from analysis_cache import (
+    DEFAULT_SEGMENT_FLAG, AnalysisCache, analysis_key, is_default_segments, is_partial_segments, mark_partial,
+)
+from answer_cache import AnswerCache, normalize_question
+from cache import SingleFlight
+from catalog import VideoCatalog
+from context_builder import ContextBuilder, compact_video_line
+from db import AsyncDatabase, DatabaseError, SQLiteDatabase
+from http_clients import http_clients
+from intent_router import CatalogAnswerer, IntentRouter, load_classifier
+from job_queue import FAILED, AnalysisJob, AnalysisJobQueue
+from llm_client import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, LLMUnavailableError, create_hedge_policy, create_llm_client,
+)
+from search_index import LibrarySearchIndex, build_result_row, segment_text
+from segment_index import SegmentIntervalIndex
+from segment_parser import SegmentCallback, SegmentStreamParser, parse_json_object
+from shared_cache import SharedCache
+from snapshot import open_snapshot, read_watermark, write_snapshot
+from transcripts import FORMATS as TRANSCRIPT_FORMATS
+from transcripts import (
+    TranscriptChunk, TranscriptError, detect_format, is_valid_video_id, iter_cues, store_transcript_segments,
+)
+from vector_index import VectorIndex, load_embedder
+from video_analysis import MapReduceAnalyzer
 from youtube_service import youtube_service, YouTubeVideoInfo
 
 # 使用你现有的API配置
@@ -18,7 +49,18 @@ qianfan_headers = {
     "Authorization": "xxxxxxxxxxx",
 }
 
-qianfan_chat_url = "https://qianfan.baidubce.com/v2/chat/completions"
+# 可通过环境变量指向其他地址（如基准测试的本地桩服务）
+qianfan_chat_url = os.getenv('QIANFAN_CHAT_URL', "https://qianfan.baidubce.com/v2/chat/completions")
+
+# 所有千帆请求共用的调度器（并发上限、限速、重试和熔断）
+llm_client = create_llm_client(qianfan_chat_url, qianfan_headers)
+# 问答请求的对冲策略（QIANFAN_HEDGE_MODEL 为空时不对冲）
+llm_hedge = create_hedge_policy()
+
+# 问答请求的截止时间（秒）：调用方在 X-Request-Timeout 头中给出更短的时间时以调用方为准，
+# 并预留 DEADLINE_MARGIN 秒把响应送回调用方；超过截止时间后取消仍在进行的检索和模型请求
+CHAT_DEADLINE = float(os.getenv('CHAT_DEADLINE', '55'))
+DEADLINE_MARGIN = float(os.getenv('DEADLINE_MARGIN', '0.5'))
 
 # MySQL数据库配置
 DB_CONFIG = {
@@ -30,6 +72,185 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+# /videos/batch 单次请求允许的视频ID数
+MAX_BATCH_VIDEO_IDS = int(os.getenv('MAX_BATCH_VIDEO_IDS', '1000'))
+
+# /segments/batch 单次请求允许的视频数，/video/{id}/segment_at 单次请求允许的时间点数
+MAX_BATCH_SEGMENT_VIDEOS = int(os.getenv('MAX_BATCH_SEGMENT_VIDEOS', '500'))
+MAX_SEGMENT_AT_TIMESTAMPS = int(os.getenv('MAX_SEGMENT_AT_TIMESTAMPS', '1000'))
+
+# 同时执行的视频分析任务数
+ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', '2'))
+
+# 有字幕的视频按时间分块并发分析：每块的时长（秒）、每块最多的字幕token数、
+# 单个视频同时进行的分块请求数，以及合并步骤每次请求的token预算
+ANALYSIS_CHUNK_SECONDS = float(os.getenv('ANALYSIS_CHUNK_SECONDS', '600'))
+ANALYSIS_CHUNK_TOKENS = int(os.getenv('ANALYSIS_CHUNK_TOKENS', '2500'))
+ANALYSIS_MAP_CONCURRENCY = int(os.getenv('ANALYSIS_MAP_CONCURRENCY', '4'))
+ANALYSIS_REDUCE_TOKENS = int(os.getenv('ANALYSIS_REDUCE_TOKENS', '3000'))
+
+# 视频分析使用的模型和提示词版本；修改 analyze_video_with_ai 或 video_analysis 中的提示词时
+# 递增版本号，已缓存的分析结果随之失效
+ANALYSIS_MODEL = "ernie-3.5-8k-preview"
+ANALYSIS_PROMPT_VERSION = "1"
+
+# 上传字幕文件的大小上限（字节）
+TRANSCRIPT_MAX_BYTES = int(os.getenv('TRANSCRIPT_MAX_BYTES', str(50 * 1024 * 1024)))
+
+# 连接池大小（同时也是数据库线程池的线程数）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+
+# 数据库类型：mysql，或 sqlite（本地开发和基准测试，数据文件为 DB_PATH）
+DB_TYPE = os.getenv('DB_TYPE', 'mysql')
+DB_PATH = os.getenv('DB_PATH', 'data/ytchat.db')
+
+if DB_TYPE == 'sqlite':
+    database = SQLiteDatabase(DB_PATH, pool_size=DB_POOL_SIZE)
+else:
+    database = AsyncDatabase(DB_CONFIG, pool_size=DB_POOL_SIZE)
+
+# 视频目录刷新间隔（秒）和每次检索返回的结果数
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', '30'))
+SEARCH_TOP_K = int(os.getenv('SEARCH_TOP_K', '8'))
+
+# 问答上下文的token预算（ernie-3.5-8k 的窗口为8k，需为提示词模板和回答留出空间）
+context_builder = ContextBuilder(
+    token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000')),
+    snippet_tokens=int(os.getenv('CONTEXT_SNIPPET_TOKENS', '300')),
+)
+
+# uvicorn worker进程数，大于1时以多进程方式运行（python python_service.py 启动时生效）
+WORKERS = int(os.getenv('WORKERS', '1'))
+SERVICE_HOST = os.getenv('SERVICE_HOST', '0.0.0.0')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', '8000'))
+
+# 跨进程共享缓存（视频信息、聊天回答、分析任务），为空时只使用进程内缓存；
+# 多worker部署时默认启用，各worker的写入和失效在 SHARED_CACHE_POLL_INTERVAL 秒内同步；
+# 每个命名空间最多保留 SHARED_CACHE_MAX_ENTRIES 条，定期清理时淘汰最早过期的条目
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH', 'data/shared_cache.db' if WORKERS > 1 else '')
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv('SHARED_CACHE_MAX_ENTRIES', '100000'))
+shared_cache = SharedCache(
+    SHARED_CACHE_PATH,
+    poll_interval=float(os.getenv('SHARED_CACHE_POLL_INTERVAL', '1')),
+    max_entries=SHARED_CACHE_MAX_ENTRIES,
+) if SHARED_CACHE_PATH else None
+if shared_cache is not None:
+    youtube_service.use_shared_cache(shared_cache)
+
+# 视频分析结果的持久化缓存（SQLite文件，为空时不缓存）及其保留时间（秒），
+# 与共享缓存路径相同时共用同一个存储
+ANALYSIS_CACHE_PATH = os.getenv('ANALYSIS_CACHE_PATH', 'data/analysis_cache.db')
+if ANALYSIS_CACHE_PATH and ANALYSIS_CACHE_PATH == SHARED_CACHE_PATH:
+    analysis_store = shared_cache
+else:
+    # 只用于清理过期条目，不需要频繁同步
+    analysis_store = SharedCache(
+        ANALYSIS_CACHE_PATH, poll_interval=60.0, max_entries=SHARED_CACHE_MAX_ENTRIES,
+    ) if ANALYSIS_CACHE_PATH else None
+analysis_cache = AnalysisCache(
+    analysis_store,
+    ttl=float(os.getenv('ANALYSIS_CACHE_TTL', str(30 * 86400))),
+) if analysis_store is not None else None
+
+# 分析任务状态在共享缓存中的命名空间和保留时间（秒），任何worker都能查询
+JOB_NAMESPACE = 'jobs'
+JOB_TTL = float(os.getenv('JOB_TTL', '86400'))
+
+# 回答缓存配置
+answer_cache = AnswerCache(
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', '86400')),
+    store=shared_cache,
+)
+
+# 合并进行中的相同问题；所有请求方都断开后取消执行
+chat_flight = SingleFlight(cancel_when_abandoned=True)
+
+# 检索模式：bm25（关键词）、semantic（语义向量）、hybrid（关键词结果不足时用语义结果补齐）
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+# 语义向量矩阵的持久化路径（不含扩展名），多个worker以内存映射方式共享
+VECTOR_INDEX_PATH = os.getenv('VECTOR_INDEX_PATH', 'data/segment_vectors')
+
+# 视频目录和倒排索引的快照文件，启动时映射后只需增量刷新；为空时每次启动全量加载
+CATALOG_SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', 'data/catalog.snap')
+
+# 进程内视频目录，搜索索引随目录增量更新
+catalog = VideoCatalog(database, refresh_interval=CATALOG_REFRESH_INTERVAL)
+vector_index = VectorIndex(load_embedder(os.getenv('SEMANTIC_EMBEDDER')))
+search_index = LibrarySearchIndex(vector_index=vector_index)
+catalog.add_listener(search_index)
+# 按视频缓存的片段和时间区间，随目录变化失效
+segment_index = SegmentIntervalIndex(
+    database, catalog,
+    maxsize=int(os.getenv('SEGMENT_CACHE_SIZE', '4096')),
+    ttl=float(os.getenv('SEGMENT_CACHE_TTL', '3600')),
+)
+catalog.add_listener(segment_index)
+
+# 视频列表、数量、时长和某时间点片段等问题由视频目录直接回答，不调用大模型；
+# INTENT_CLASSIFIER 形如 "module:factory"，可替换默认的规则分类器
+intent_router = IntentRouter(
+    load_classifier(os.getenv('INTENT_CLASSIFIER')),
+    CatalogAnswerer(catalog, segment_index),
+)
+
+# 请求头中带有该字段时，在响应的 Server-Timing 头中返回各阶段耗时
+DEBUG_TIMING_HEADER = 'X-Debug-Timing'
+
+# Prometheus 指标
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'ytchat_http_request_duration_seconds', 'HTTP请求耗时（秒）', ('method', 'route', 'status')
+)
+HTTP_REQUESTS_IN_FLIGHT = metrics.gauge('ytchat_http_requests_in_flight', '正在处理的HTTP请求数')
+DEADLINE_EXCEEDED_TOTAL = metrics.counter(
+    'ytchat_deadline_exceeded_total', '超过截止时间被取消的请求数', ('route',)
+)
+DEFAULT_SEGMENTS_TOTAL = metrics.counter('ytchat_default_segments_total', '使用默认片段代替AI分析结果的次数')
+JSON_PARSE_FAILURES_TOTAL = metrics.counter(
+    'ytchat_json_parse_failures_total', '模型输出中的JSON解析失败次数', ('source',)
+)
+metrics.callback_gauge(
+    'ytchat_in_flight', '各组件正在处理和排队的任务数', lambda: {
+        ('llm',): llm_client.in_flight,
+        ('llm_waiting',): llm_client.stats()['waiting'],
+        ('chat',): chat_flight.stats()['inflight'],
+        ('analysis',): analysis_queue.stats()['running'],
+        ('analysis_queued',): analysis_queue.stats()['queue_depth'],
+        ('db',): database.stats()['in_use'],
+        ('db_waiting',): database.stats()['waiting'],
+    }, ('component',)
+)
+metrics.callback_gauge(
+    'ytchat_cache_hits_total', '缓存命中次数', lambda: {
+        ('youtube',): youtube_service.cache_stats()['hits'],
+        ('answer',): answer_cache.stats()['hits'],
+        ('segments',): segment_index.stats()['hits'],
+    }, ('cache',), type_name='counter'
+)
+metrics.callback_gauge(
+    'ytchat_cache_misses_total', '缓存未命中次数', lambda: {
+        ('youtube',): youtube_service.cache_stats()['misses'],
+        ('answer',): answer_cache.stats()['misses'],
+        ('segments',): segment_index.stats()['misses'],
+    }, ('cache',), type_name='counter'
+)
+metrics.callback_gauge(
+    'ytchat_llm_events_total', '千帆请求事件次数', lambda: {
+        (name,): llm_client.stats()[name] for name in ('requests', 'retries', 'failures', 'rejected')
+    }, ('event',), type_name='counter'
+)
+metrics.callback_gauge(
+    'ytchat_llm_hedge_total', '问答对冲请求次数：总请求、发出对冲、主请求胜出、对冲请求胜出', lambda: {
+        (name,): llm_hedge.stats()[name] for name in ('requests', 'hedged', 'primary_wins', 'hedge_wins')
+    } if llm_hedge is not None else {}, ('event',), type_name='counter'
+)
+metrics.callback_gauge(
+    'ytchat_catalog_size', '视频目录中的记录数', lambda: {
+        ('videos',): catalog.stats()['videos'],
+        ('segments',): catalog.stats()['segments'],
+    }, ('kind',)
+)
+
 @dataclass
 class VideoInfo:
     title: str
@@ -37,6 +258,18 @@ class VideoInfo:
     thumbnail: str
     duration: int
 
+class VideoBatchRequest(BaseModel):
+    video_ids: List[str]
+
+class SegmentBatchRequest(BaseModel):
+    video_ids: List[int]
+
+# 视频中的时间点（秒），必须是非负的有限数
+Timestamp = confloat(ge=0, allow_inf_nan=False)
+
+class SegmentAtRequest(BaseModel):
+    timestamps: List[Timestamp]
+
 class ChatRequest(BaseModel):
     question: str
 
@@ -47,84 +280,160 @@ class ChatResponse(BaseModel):
     start_time: Optional[int] = None
     end_time: Optional[int] = None
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建连接池并加载视频目录，关闭时释放"""
+    await database.connect()
+    started_at = time.time()
+    vector_index.load(VECTOR_INDEX_PATH)
+    load_catalog_snapshot()
+    refresh_task = asyncio.create_task(catalog.run_refresh_loop())
+    sync_task = asyncio.create_task(shared_cache.run_sync_loop()) if shared_cache is not None else None
+    analysis_sync_task = None
+    if analysis_store is not None and analysis_store is not shared_cache:
+        analysis_sync_task = asyncio.create_task(analysis_store.run_sync_loop())
+    await analysis_queue.start()
+    yield
+    await analysis_queue.stop()
+    refresh_task.cancel()
+    if sync_task is not None:
+        sync_task.cancel()
+    if analysis_sync_task is not None:
+        analysis_sync_task.cancel()
+    vector_index.save(VECTOR_INDEX_PATH)
+    save_catalog_snapshot(started_at)
+    if shared_cache is not None:
+        shared_cache.close()
+    if analysis_store is not None and analysis_store is not shared_cache:
+        analysis_store.close()
+    await http_clients.aclose()
+    await database.close()
+
+def load_catalog_snapshot():
+    """映射目录快照作为视频目录的初始内容"""
+    if not CATALOG_SNAPSHOT_PATH:
+        return
+    started = time.perf_counter()
+    snapshot = open_snapshot(CATALOG_SNAPSHOT_PATH)
+    if snapshot is not None and catalog.load_snapshot(snapshot):
+        print(f"已加载目录快照: {snapshot.video_count} 个视频, {snapshot.segment_count} 个片段, "
+              f"耗时 {time.perf_counter() - started:.3f} 秒")
 
-def get_db_connection():
-    """获取数据库连接"""
+def save_catalog_snapshot(started_at: float):
+    """目录在快照之后有变化时重写快照；其他worker已写入更新的快照时跳过"""
+    if not CATALOG_SNAPSHOT_PATH or not catalog.loaded or not catalog.changed_since_snapshot:
+        return
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
-    except Error as e:
-        print(f"数据库连接错误: {e}")
-        return None
+        if os.path.getmtime(CATALOG_SNAPSHOT_PATH) > started_at:
+            written = read_watermark(CATALOG_SNAPSHOT_PATH)
+            if written is not None and catalog.watermark is not None and written >= catalog.watermark:
+                return
+    except OSError:
+        pass
+    try:
+        write_snapshot(CATALOG_SNAPSHOT_PATH, catalog.videos(), catalog.watermark)
+    except OSError as e:
+        print(f"保存目录快照失败: {e}")
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    """与默认处理相同返回422；JSON请求体中的 NaN、Infinity 会出现在错误详情里，转为字符串才能编码"""
+    return JSONResponse(status_code=422, content={"detail": json_safe(jsonable_encoder(exc.errors()))})
+
+def json_safe(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [json_safe(item) for item in value]
+    return value
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """记录请求耗时和并发数；请求带有计时头时返回分阶段耗时，带有超时头时设置截止时间"""
+    timings = metrics.start_request_timing() if request.headers.get(DEBUG_TIMING_HEADER) else None
+    timeout = deadline.parse_timeout(request.headers.get(deadline.DEADLINE_HEADER))
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        with deadline.scope(max(timeout - DEADLINE_MARGIN, 0.0) if timeout is not None else None):
+            response = await call_next(request)
+        status = response.status_code
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        # 使用路由模板作为标签，避免每个视频ID产生一个时间序列
+        route = request.scope.get('route')
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route is not None else 'unmatched',
+            status=status,
+        )
+    if timings is not None:
+        timings.append(('total', time.perf_counter() - start))
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+    return response
 
-def get_all_videos():
+async def get_all_videos():
     """获取所有视频信息"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
+    if catalog.loaded:
+        return [video.as_row() for video in catalog.videos()]
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM videos")
-        videos = cursor.fetchall()
-        return videos
-    except Error as e:
+        return await database.fetch_all("SELECT * FROM videos")
+    except DatabaseError as e:
         print(f"查询视频错误: {e}")
         return []
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
-def get_video_segments(video_id: int):
+async def get_video_segments(video_id: int):
     """获取指定视频的所有片段"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM video_segments WHERE video_id = %s ORDER BY start_time", (video_id,))
-        segments = cursor.fetchall()
-        return segments
-    except Error as e:
+        return (await segment_index.get(video_id)).rows
+    except DatabaseError as e:
         print(f"查询视频片段错误: {e}")
         return []
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-
-def search_video_content(query: str):
-    """搜索视频内容"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
+
+async def search_video_content(query: str):
+    """搜索视频内容（内存BM25索引，可选语义向量检索）"""
+    if RETRIEVAL_MODE == 'semantic':
+        return vector_index.search(query, top_k=SEARCH_TOP_K)
+
+    results = search_index.search(query, top_k=SEARCH_TOP_K)
+    if RETRIEVAL_MODE == 'hybrid' and len(results) < SEARCH_TOP_K:
+        seen = {result['segment_id'] for result in results if result['segment_id']}
+        for row in vector_index.search(query, top_k=SEARCH_TOP_K):
+            if len(results) >= SEARCH_TOP_K:
+                break
+            if row['segment_id'] is None or row['segment_id'] not in seen:
+                results.append(row)
+    return results
+
+_catalog_lines: Tuple[Optional[str], List[str]] = (None, [])
+
+async def get_catalog_lines() -> List[str]:
+    """视频目录摘要行，按视频库版本缓存"""
+    global _catalog_lines
+    if not catalog.loaded:
+        return [compact_video_line(video) for video in await get_all_videos()]
+    version = catalog.library_version
+    if _catalog_lines[0] != version:
+        _catalog_lines = (version, [compact_video_line(video.as_row()) for video in catalog.videos()])
+    return _catalog_lines[1]
+
+async def get_youtube_id(video_id: int) -> Optional[str]:
+    """根据数据库视频ID获取YouTube ID（目录中没有时查询数据库）"""
+    youtube_id = catalog.youtube_id(video_id)
+    if youtube_id is not None:
+        return youtube_id
     try:
-        cursor = connection.cursor(dictionary=True)
-        # 搜索视频标题、描述和片段内容
-        search_query = """
-        SELECT DISTINCT v.id, v.title, v.description, v.you_tube_id, v.duration,
-               s.id as segment_id, s.start_time, s.end_time, s.content, s.summary
-        FROM videos v
-        LEFT JOIN video_segments s ON v.id = s.video_id
-        WHERE v.title LIKE %s OR v.description LIKE %s 
-           OR s.content LIKE %s OR s.summary LIKE %s
-        ORDER BY v.id, s.start_time
-        """
-        search_term = f"%{query}%"
-        cursor.execute(search_query, (search_term, search_term, search_term, search_term))
-        results = cursor.fetchall()
-        return results
-    except Error as e:
-        print(f"搜索视频内容错误: {e}")
-        return []
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        row = await database.fetch_one("SELECT you_tube_id FROM videos WHERE id = %s", (video_id,))
+    except DatabaseError as e:
+        print(f"获取YouTube ID失败: {e}")
+        return None
+    return row['you_tube_id'] if row else None
 
 # 模拟数据库连接（实际项目中应该连接真实数据库）
 videos_db = {}
@@ -134,6 +443,33 @@ segments_db = {}
 async def root():
     return {"message": "YouTube Chat Python Service"}
 
+@app.get("/stats")
+async def stats():
+    """服务运行统计"""
+    return {
+        "worker_pid": os.getpid(),
+        "db_pool": database.stats(),
+        "catalog": catalog.stats(),
+        "search_index": search_index.stats(),
+        "vector_index": vector_index.stats(),
+        "segment_index": segment_index.stats(),
+        "intent_router": intent_router.stats(),
+        "youtube_cache": youtube_service.cache_stats(),
+        "answer_cache": answer_cache.stats(),
+        "shared_cache": shared_cache.stats() if shared_cache is not None else None,
+        "chat_singleflight": chat_flight.stats(),
+        "analysis_jobs": analysis_queue.stats(),
+        "analysis_cache": analysis_cache.stats() if analysis_cache is not None else None,
+        "video_analyzer": video_analyzer.stats(),
+        "llm": llm_client.stats(),
+        "llm_hedge": llm_hedge.stats() if llm_hedge is not None else None,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/video/{video_id}")
 async def get_video_info(video_id: str):
     """获取视频信息"""
@@ -151,44 +487,398 @@ async def get_video_info(video_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/videos/batch")
+async def get_videos_info(request: VideoBatchRequest):
+    """批量获取视频信息"""
+    if len(request.video_ids) > MAX_BATCH_VIDEO_IDS:
+        raise HTTPException(status_code=400, detail=f"一次最多获取{MAX_BATCH_VIDEO_IDS}个视频")
+    
+    results = await youtube_service.get_videos_info(request.video_ids)
+    videos = {}
+    errors = {}
+    for video_id, result in results.items():
+        if isinstance(result, Exception):
+            errors[video_id] = str(result)
+        else:
+            videos[video_id] = VideoInfo(
+                title=result.title,
+                description=result.description,
+                thumbnail=result.thumbnail,
+                duration=result.duration
+            )
+    return {"videos": videos, "errors": errors}
+
+@app.post("/segments/batch")
+async def get_segments_batch(request: SegmentBatchRequest):
+    """批量获取多个视频的片段（按视频分组，未缓存的视频用一次查询加载）"""
+    if len(request.video_ids) > MAX_BATCH_SEGMENT_VIDEOS:
+        raise HTTPException(status_code=400, detail=f"一次最多获取{MAX_BATCH_SEGMENT_VIDEOS}个视频的片段")
+    try:
+        segments = await segment_index.get_many(request.video_ids)
+    except DatabaseError as e:
+        print(f"查询视频片段错误: {e}")
+        raise HTTPException(status_code=500, detail="查询视频片段失败")
+    return {"segments": {video_id: entry.rows for video_id, entry in segments.items()}}
+
+@app.get("/video/{video_id}/segment_at")
+async def get_segment_at(video_id: int, t: Annotated[Timestamp, Query()]):
+    """查询视频在时间点 t（秒）所在的片段，没有时 segment 为 null"""
+    segment = (await find_segments_at(video_id, [t]))[0]
+    return {"video_id": video_id, "t": t, "segment": segment}
+
+@app.post("/video/{video_id}/segment_at")
+async def get_segments_at(video_id: int, request: SegmentAtRequest):
+    """批量查询多个时间点所在的片段，结果与时间点一一对应"""
+    if len(request.timestamps) > MAX_SEGMENT_AT_TIMESTAMPS:
+        raise HTTPException(status_code=400, detail=f"一次最多查询{MAX_SEGMENT_AT_TIMESTAMPS}个时间点")
+    segments = await find_segments_at(video_id, request.timestamps)
+    return {
+        "video_id": video_id,
+        "results": [{"t": t, "segment": segment} for t, segment in zip(request.timestamps, segments)],
+    }
+
+async def find_segments_at(video_id: int, timestamps: List[float]) -> List[Optional[Dict]]:
+    try:
+        return await segment_index.segments_at(video_id, timestamps)
+    except DatabaseError as e:
+        print(f"查询视频片段错误: {e}")
+        raise HTTPException(status_code=500, detail="查询视频片段失败")
+
+async def run_analysis_job(video_id: str, refresh: bool = False) -> Dict:
+    """后台任务：写入字幕分块（如果有字幕），然后分析视频内容并生成片段
+
+    refresh 为 True 时不使用缓存的分析结果。结果中 default 表示分析失败、片段为默认片段，
+    partial 表示分析不完整（输出中断或部分分块失败），两者都不会被缓存。
+
+    新分析出的片段替换视频在语义索引中的片段；缓存的结果（已经入库和索引过）不再写入索引，
+    默认片段不会入库，也不写入索引，流式阶段已经加入的片段恢复为视频目录中的数据。
+    """
+    try:
+        transcript_segments = await ingest_video_transcript(video_id)
+    except TranscriptError as e:
+        print(f"解析字幕失败: {e}")
+        transcript_segments = None
+    streamed = []
+    
+    async def index_segment(segment: Dict):
+        # 每解析出一个片段就加入语义索引，让它立即可被检索
+        streamed.append(segment)
+        await index_analyzed_segments(video_id, [segment])
+    
+    segments, cached = await analyze_video_segments(video_id, on_segment=index_segment, refresh=refresh)
+    if is_default_segments(segments):
+        if streamed:
+            await restore_indexed_segments(video_id)
+    elif not cached:
+        await index_analyzed_segments(video_id, segments, replace=True)
+    result = {
+        "segments": segments,
+        "default": is_default_segments(segments),
+        "partial": is_partial_segments(segments),
+    }
+    if transcript_segments is not None:
+        result["transcript_segments"] = transcript_segments
+    return result
+
+async def ingest_video_transcript(youtube_id: str) -> Optional[int]:
+    """用字幕分块替换视频在 video_segments 中的字幕片段（分析片段不变），返回写入的片段数
+
+    没有字幕文件或视频尚未入库时返回 None；字幕无法解析时抛出 TranscriptError。
+    """
+    chunks = await youtube_service.get_video_transcript(youtube_id)
+    if chunks is None:
+        return None
+    try:
+        video = await database.fetch_one("SELECT id FROM videos WHERE you_tube_id = %s", (youtube_id,))
+        if not video:
+            return None
+        count = await store_transcript_segments(database, video['id'], chunks)
+        segment_index.invalidate(video['id'])
+        return count
+    except DatabaseError as e:
+        print(f"写入字幕片段失败: {e}")
+        return None
+
+async def publish_job(job: AnalysisJob):
+    """把任务状态写入共享缓存，让其他worker也能查询"""
+    if shared_cache is not None:
+        await shared_cache.set(JOB_NAMESPACE, job.id, json.dumps(job.to_dict(), ensure_ascii=False), JOB_TTL)
+
+analysis_queue = AnalysisJobQueue(run_analysis_job, concurrency=ANALYSIS_CONCURRENCY, on_update=publish_job)
+
 @app.post("/video/{video_id}/analyze")
-async def analyze_video(video_id: str):
-    """分析视频内容并生成片段"""
+async def analyze_video(video_id: str, wait: bool = False, refresh: bool = False):
+    """提交视频分析任务，立即返回任务ID；wait=true 时等待分析完成并返回片段
+
+    视频信息、模型和提示词版本都没有变化时直接使用缓存的分析结果，refresh=true 时强制重新分析。
+    """
+    job, created = analysis_queue.submit(video_id, refresh=refresh)
+    if created:
+        await publish_job(job)
+    if not wait:
+        return job.to_dict()
+    
+    await analysis_queue.wait(job)
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    return job.result
+
+@app.put("/video/{video_id}/transcript")
+async def upload_transcript(video_id: str, request: Request, fmt: Optional[str] = Query(None, alias="format")):
+    """上传视频字幕（请求体为 WebVTT、SRT 或 YouTube timedtext XML 原文）
+
+    字幕流式写入字幕目录并校验，视频已入库时立即替换其字幕片段。
+    未指定 format 时根据内容判断格式。
+    """
+    if not is_valid_video_id(video_id):
+        raise HTTPException(status_code=400, detail="无效的视频ID")
+    if fmt is not None and fmt not in TRANSCRIPT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的字幕格式: {fmt}")
+    
+    directory = youtube_service.transcript_dir
+    upload_path = os.path.join(directory, f".{video_id}.upload")
+    # 文件读写和解析都在线程池中进行，较大的字幕文件不会阻塞事件循环
+    loop = asyncio.get_running_loop()
+    size = 0
+    head = b''
     try:
-        # 这里应该调用YouTube API获取视频内容
-        # 然后使用AI分析生成片段
-        segments = await generate_video_segments(video_id)
-        return {"segments": segments}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        f = await loop.run_in_executor(None, open_upload_file, upload_path)
+        try:
+            async for data in request.stream():
+                size += len(data)
+                if size > TRANSCRIPT_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="字幕文件过大")
+                if len(head) < 64:
+                    head += data[:64]
+                await loop.run_in_executor(None, f.write, data)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        fmt = fmt or detect_format(head.decode('utf-8-sig', errors='ignore'))
+        try:
+            cues = await loop.run_in_executor(None, install_transcript, upload_path, directory, video_id, fmt)
+        except TranscriptError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not cues:
+            raise HTTPException(status_code=400, detail="字幕中没有内容")
+    finally:
+        await loop.run_in_executor(None, remove_upload_file, upload_path)
+    
+    segments = await ingest_video_transcript(video_id)
+    return {"youtube_id": video_id, "format": fmt, "bytes": size, "cues": cues, "segments": segments}
+
+def open_upload_file(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'wb')
+
+def install_transcript(upload_path: str, directory: str, video_id: str, fmt: str) -> int:
+    """完整解析上传的字幕，有内容时替换视频已有的字幕文件，返回字幕条数
+
+    先解析再替换，无效的字幕不会覆盖已有文件。
+    """
+    cues = sum(1 for _ in iter_cues(upload_path, fmt))
+    if not cues:
+        return 0
+    # 同一视频只保留一份字幕
+    for ext in TRANSCRIPT_FORMATS:
+        old_path = os.path.join(directory, f"{video_id}.{ext}")
+        if ext != fmt and os.path.exists(old_path):
+            os.remove(old_path)
+    os.replace(upload_path, os.path.join(directory, f"{video_id}.{fmt}"))
+    return cues
+
+def remove_upload_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询分析任务状态和结果"""
+    job = analysis_queue.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    # 任务可能由其他worker执行
+    if shared_cache is not None:
+        value = await shared_cache.get(JOB_NAMESPACE, job_id)
+        if value is not None:
+            return json.loads(value)
+    raise HTTPException(status_code=404, detail="任务不存在")
+
+@app.delete("/video/{video_id}/cache")
+async def invalidate_video_cache(video_id: str):
+    """丢弃视频信息缓存，多worker部署时所有worker都会失效"""
+    await youtube_service.invalidate(video_id)
+    return {"video_id": video_id, "invalidated": True}
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
-    """处理聊天请求"""
+    """处理聊天请求，超过截止时间返回504"""
     try:
-        response = await process_question(request.question)
-        return response
+        with deadline.scope(CHAT_DEADLINE):
+            async with deadline.enforce():
+                # 并发的相同问题只执行一次
+                key = normalize_question(request.question) or request.question
+                return await chat_flight.do(key, lambda: process_question(request.question))
+    except deadline.DeadlineExceeded:
+        DEADLINE_EXCEEDED_TOTAL.inc(route='chat')
+        raise HTTPException(status_code=504, detail="请求超时")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def generate_video_segments(video_id: str) -> List[Dict]:
-    """生成视频片段"""
+async def index_analyzed_segments(youtube_id: str, segments: List[Dict], replace: bool = False):
+    """将新分析出的片段立即加入语义索引，入库后由定时刷新替换为正式数据
+
+    replace 为 True 时替换视频在索引中的全部片段（按片段内容签名，内容相同时跳过），
+    否则追加，用于流式分析中逐个解析出的片段。
+    """
+    video = await fetch_indexed_video(youtube_id)
+    if not video:
+        return
+
+    rows = [{
+        'id': video['id'],
+        'title': video['title'],
+        'description': video['description'],
+        'you_tube_id': youtube_id,
+        'duration': video['duration'],
+        'segment_id': None,
+        'start_time': segment.get('start_time'),
+        'end_time': segment.get('end_time'),
+        'content': segment.get('content'),
+        'summary': segment.get('summary'),
+    } for segment in segments]
+    texts = [segment_text(row) for row in rows]
+    if replace:
+        signature = hashlib.sha256(json.dumps(segments, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+        vector_index.replace_video(video['id'], rows, texts, signature=signature)
+    else:
+        vector_index.append(video['id'], rows, texts)
+
+async def restore_indexed_segments(youtube_id: str):
+    """把视频在语义索引中的片段恢复为视频目录中的数据（丢弃分析失败前流式加入的片段）"""
+    video = await fetch_indexed_video(youtube_id)
+    if not video:
+        return
+    record = catalog.get(video['id'])
+    if record is None:
+        vector_index.remove_video(video['id'])
+        return
+    rows = [build_result_row(record, segment) for segment in record.segments]
+    vector_index.replace_video(record.id, rows, [segment_text(row) for row in rows], signature=repr(record.signature))
+
+async def fetch_indexed_video(youtube_id: str) -> Optional[Dict]:
     try:
-        # 获取视频信息
-        youtube_info = await youtube_service.get_video_info(video_id)
+        return await database.fetch_one(
+            "SELECT id, title, description, duration FROM videos WHERE you_tube_id = %s", (youtube_id,)
+        )
+    except DatabaseError as e:
+        print(f"查询视频失败: {e}")
+        return None
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """流式处理聊天请求（Server-Sent Events）
+
+    模型输出的每段文本以 token 事件推送，结束时推送一个 done 事件，
+    其内容与 /chat 返回的 ChatResponse 相同。
+    """
+    return StreamingResponse(
+        stream_with_deadline(request.question),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def generate_video_segments(video_id: str, on_segment: Optional[SegmentCallback] = None,
+                                  refresh: bool = False, info: Optional[YouTubeVideoInfo] = None) -> List[Dict]:
+    """生成视频片段，逐个解析出片段时调用 on_segment（分块分析、缓存的结果和默认片段不会调用）
+
+    分析结果按输入的内容哈希缓存，refresh 为 True 时忽略缓存重新分析并覆盖缓存。
+    调用方已有视频信息（如批量导入的输入文件中带有）时通过 info 传入，不再请求 YouTube。
+    """
+    segments, _ = await analyze_video_segments(video_id, on_segment, refresh, info)
+    return segments
+
+async def analyze_video_segments(video_id: str, on_segment: Optional[SegmentCallback] = None,
+                                 refresh: bool = False, info: Optional[YouTubeVideoInfo] = None
+                                 ) -> Tuple[List[Dict], bool]:
+    """与 generate_video_segments 相同，同时返回片段是否来自分析缓存"""
+    try:
+        youtube_info = info
+        if youtube_info is None:
+            # 获取视频信息
+            with metrics.stage('analysis_video_info'):
+                youtube_info = await youtube_service.get_video_info(video_id)
         total_duration = youtube_info.duration
         
-        # 使用AI分析视频内容并生成片段
-        segments = await analyze_video_with_ai(video_id, youtube_info)
+        chunks = await load_analysis_chunks(video_id)
+        key = analysis_key(
+            video_id, youtube_info.title, youtube_info.description, total_duration,
+            ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION, chunks,
+        )
+        if analysis_cache is not None:
+            if refresh:
+                analysis_cache.record_refresh()
+            else:
+                cached = await analysis_cache.get(key)
+                if cached is not None:
+                    print(f"使用缓存的视频分析结果: {video_id}")
+                    return cached, True
+        
+        # 有字幕时按时间分块并发分析，再合并为最终片段
+        if chunks:
+            segments = await video_analyzer.analyze(youtube_info.title, total_duration, chunks)
+        else:
+            # 使用AI分析视频内容并生成片段
+            segments = await analyze_video_with_ai(video_id, youtube_info, on_segment)
         
-        return segments
+        if analysis_cache is not None:
+            await analysis_cache.set(key, segments)
+        return segments, False
     except Exception as e:
         print(f"生成视频片段失败: {e}")
         # 返回默认片段
-        return await generate_default_segments(video_id)
+        return await generate_default_segments(video_id, info), False
 
-async def analyze_video_with_ai(video_id: str, video_info: YouTubeVideoInfo) -> List[Dict]:
-    """使用AI分析视频内容"""
+async def load_analysis_chunks(video_id: str) -> Optional[List[TranscriptChunk]]:
+    """读取视频字幕并切分为互不重叠的分析块，没有字幕或无法解析时返回 None"""
+    transcript = await youtube_service.get_video_transcript(
+        video_id, window=ANALYSIS_CHUNK_SECONDS, stride=ANALYSIS_CHUNK_SECONDS
+    )
+    if transcript is None:
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, list, transcript)
+    except TranscriptError as e:
+        print(f"解析字幕失败: {e}")
+        return None
+
+async def complete_analysis_prompt(prompt: str) -> str:
+    """发送一次后台分析请求，返回模型输出的文本"""
+    data = {
+        "model": ANALYSIS_MODEL,
+        "messages": [{"role": "system", "content": prompt}],
+    }
+    result = await llm_client.complete(data, priority=PRIORITY_BACKGROUND)
+    if "error" in result:
+        raise RuntimeError(f"AI分析失败: {result.get('error', {}).get('message', str(result))}")
+    content = result.get("choices")[0].get("message", {}).get("content")
+    if not content:
+        raise RuntimeError("AI服务响应格式错误")
+    return content
+
+video_analyzer = MapReduceAnalyzer(
+    complete_analysis_prompt,
+    concurrency=ANALYSIS_MAP_CONCURRENCY,
+    chunk_tokens=ANALYSIS_CHUNK_TOKENS,
+    reduce_tokens=ANALYSIS_REDUCE_TOKENS,
+)
+
+async def analyze_video_with_ai(video_id: str, video_info: YouTubeVideoInfo,
+                                on_segment: Optional[SegmentCallback] = None) -> List[Dict]:
+    """使用AI分析视频内容
+
+    以流式模式请求模型，每个片段的JSON一闭合就解析校验并交给 on_segment，
+    不必等待整个回答结束。中途出错时保留已解析的片段并标记为不完整，一个都没有时才使用默认片段。
+    """
     # 构建AI提示词
     messages = [{
         "role": "system",
@@ -218,52 +908,47 @@ async def analyze_video_with_ai(video_id: str, video_info: YouTubeVideoInfo) ->
     }]
     
     data = {
-        "model": "ernie-3.5-8k-preview",
+        "model": ANALYSIS_MODEL,
         "messages": messages,
+        "stream": True,
     }
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url=qianfan_chat_url, 
-                json=data, 
-                headers=qianfan_headers, 
-                timeout=60
-            )
-            result = response.json()
-            
-            if "error" in result:
-                print(f"AI分析失败: {result.get('error', {}).get('message', str(result))}")
-                return await generate_default_segments(video_id)
-            
-            content = result.get("choices")[0].get("message", {}).get("content")
-            if not content:
-                return await generate_default_segments(video_id)
-            
-            # 解析JSON响应
-            try:
-                json_start = content.find('[')
-                json_end = content.rfind(']') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = content[json_start:json_end]
-                    segments = json.loads(json_str)
-                    return segments
-            except:
-                pass
-            
-            return await generate_default_segments(video_id)
-            
-        except Exception as e:
-            print(f"AI分析出错: {e}")
-            return await generate_default_segments(video_id)
+    parser = SegmentStreamParser()
+    segments = []
+    interrupted = False
+    try:
+        with metrics.stage('analysis_llm'):
+            async with llm_client.stream(data, priority=PRIORITY_BACKGROUND) as response:
+                async for delta in iter_stream_deltas(response):
+                    with metrics.stage('analysis_parse'):
+                        parsed = parser.feed(delta)
+                    for segment in parsed:
+                        segments.append(segment)
+                        if on_segment is not None:
+                            await on_segment(segment)
+    except Exception as e:
+        print(f"AI分析出错（已解析{len(segments)}个片段）: {e}")
+        interrupted = True
+    
+    if parser.invalid:
+        print(f"AI分析结果中有{parser.invalid}个片段无法解析")
+    if segments:
+        # 只有完整结束、没有被丢弃片段的输出才是完整的分析结果
+        if interrupted or parser.truncated or parser.invalid:
+            mark_partial(segments)
+        return segments
+    
+    JSON_PARSE_FAILURES_TOTAL.inc(source='analysis')
+    return await generate_default_segments(video_id)
 
-async def generate_default_segments(video_id: str) -> List[Dict]:
-    """生成默认片段（当AI分析失败时使用）"""
+async def generate_default_segments(video_id: str, info: Optional[YouTubeVideoInfo] = None) -> List[Dict]:
+    """生成默认片段（当AI分析失败时使用），每个片段带有默认片段标记，不会被缓存"""
+    DEFAULT_SEGMENTS_TOTAL.inc()
     segments = []
     
     # 获取视频信息以确定时长
     try:
-        youtube_info = await youtube_service.get_video_info(video_id)
+        youtube_info = info or await youtube_service.get_video_info(video_id)
         total_duration = youtube_info.duration
     except:
         total_duration = 3600  # 默认1小时
@@ -278,44 +963,26 @@ async def generate_default_segments(video_id: str) -> List[Dict]:
             "start_time": start_time,
             "end_time": end_time,
             "content": f"视频片段 {i+1} - 第{start_time//60}分钟到第{end_time//60}分钟",
-            "summary": f"这是视频的第{i+1}个片段，包含了视频的重要内容和关键信息。"
+            "summary": f"这是视频的第{i+1}个片段，包含了视频的重要内容和关键信息。",
+            DEFAULT_SEGMENT_FLAG: True,
         }
         segments.append(segment)
     
     return segments
 
-async def process_question(question: str) -> ChatResponse:
-    """处理用户问题"""
-    
+async def build_chat_messages(question: str) -> List[Dict]:
+    """检索相关视频内容并构建问答提示词"""
     # 首先搜索相关的视频内容
-    search_results = search_video_content(question)
+    with metrics.stage('chat_search'):
+        search_results = await search_video_content(question)
     
-    # 构建上下文信息
-    context_info = ""
-    if search_results:
-        context_info = "以下是相关的视频内容：\n\n"
-        for result in search_results[:5]:  # 限制最多5个结果
-            context_info += f"视频ID: {result['id']}\n"
-            context_info += f"标题: {result['title']}\n"
-            context_info += f"YouTube ID: {result['you_tube_id']}\n"
-            if result['segment_id']:
-                context_info += f"片段时间: {result['start_time']}-{result['end_time']}秒\n"
-                context_info += f"片段内容: {result['content']}\n"
-                context_info += f"片段摘要: {result['summary']}\n"
-            else:
-                context_info += f"视频描述: {result['description']}\n"
-            context_info += "\n---\n\n"
-    else:
-        # 如果没有搜索结果，获取所有视频列表
-        all_videos = get_all_videos()
-        if all_videos:
-            context_info = "当前视频库中的视频：\n\n"
-            for video in all_videos:
-                context_info += f"视频ID: {video['id']}\n"
-                context_info += f"标题: {video['title']}\n"
-                context_info += f"YouTube ID: {video['you_tube_id']}\n"
-                context_info += f"描述: {video['description'][:200]}...\n"
-                context_info += "\n---\n\n"
+    # 在token预算内构建上下文信息
+    with metrics.stage('chat_context'):
+        if search_results:
+            context_info = context_builder.build_results(question, search_results)
+        else:
+            # 如果没有搜索结果，使用视频目录
+            context_info = context_builder.build_catalog(await get_catalog_lines())
     
     # 构建AI提示词
     system_prompt = f"""你是一个专业的视频内容问答助手。基于提供的视频库内容回答用户问题。
@@ -350,69 +1017,186 @@ async def process_question(question: str) -> ChatResponse:
         "role": "user",
         "content": question
     }]
+    return messages
+
+async def process_question(question: str) -> ChatResponse:
+    """处理用户问题"""
+    
+    # 目录类问题直接由本地回答
+    local = await intent_router.route(question)
+    if local is not None:
+        return ChatResponse(**local)
+    
+    # 相同问题且视频库未变化时直接返回缓存的回答
+    library_version = catalog.library_version
+    cached = await answer_cache.get(question, library_version)
+    if cached is not None:
+        return ChatResponse.model_validate_json(cached)
+    
+    messages = await build_chat_messages(question)
     
     data = {
         "model": "ernie-3.5-8k-preview",
         "messages": messages,
     }
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url=qianfan_chat_url, 
-                json=data, 
-                headers=qianfan_headers, 
-                timeout=50
+    try:
+        with metrics.stage('chat_llm'):
+            # 主模型较慢时对冲到更快的模型，先返回的结果胜出
+            result = await llm_client.complete_hedged(
+                data,
+                llm_hedge,
+                priority=PRIORITY_INTERACTIVE,
+                timeout=http_clients.timeout('qianfan', read=50)
             )
-            result = response.json()
-            
-            if "error" in result:
-                return ChatResponse(
-                    answer=f"AI服务错误: {result.get('error', {}).get('message', str(result))}"
-                )
-            
-            content = result.get("choices")[0].get("message", {}).get("content")
-            if not content:
-                return ChatResponse(answer="AI服务响应格式错误")
-            
-            # 尝试解析JSON响应
-            try:
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = content[json_start:json_end]
-                    response_data = json.loads(json_str)
-                    
-                    # 如果有video_id，获取对应的YouTube ID
-                    youtube_id = None
-                    if response_data.get("video_id"):
-                        try:
-                            conn = get_db_connection()
-                            cursor = conn.cursor(dictionary=True)
-                            cursor.execute("SELECT you_tube_id FROM videos WHERE id = %s", (response_data.get("video_id"),))
-                            video_result = cursor.fetchone()
-                            if video_result:
-                                youtube_id = video_result['you_tube_id']
-                            cursor.close()
-                            conn.close()
-                        except Exception as e:
-                            print(f"获取YouTube ID失败: {e}")
-                    
-                    return ChatResponse(
-                        answer=response_data.get("answer", content),
-                        video_id=response_data.get("video_id"),
-                        youtube_id=youtube_id,
-                        start_time=response_data.get("start_time"),
-                        end_time=response_data.get("end_time")
-                    )
-            except:
-                pass
-            
-            # 如果无法解析JSON，返回纯文本回答
-            return ChatResponse(answer=content)
+        
+        if "error" in result:
+            return ChatResponse(
+                answer=f"AI服务错误: {result.get('error', {}).get('message', str(result))}"
+            )
+        
+        content = result.get("choices")[0].get("message", {}).get("content")
+        if not content:
+            return ChatResponse(answer="AI服务响应格式错误")
+        
+        response = await parse_chat_content(content)
+        await answer_cache.set(question, library_version, response.model_dump_json())
+        return response
+        
+    except LLMUnavailableError as e:
+        print(f"AI服务不可用: {e}")
+        return ChatResponse(answer="AI服务暂时不可用，请稍后再试")
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        return ChatResponse(answer=f"处理问题时出错: {str(e)}")
+
+def sse_event(event: str, data: Dict) -> str:
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class StreamResponseError(Exception):
+    """流式输出中千帆返回了错误"""
+
+async def iter_stream_deltas(response) -> AsyncIterator[str]:
+    """逐段取出千帆流式响应中模型输出的文本，上游返回错误时抛出 StreamResponseError"""
+    async for line in response.aiter_lines():
+        line = line.strip()
+        if line.startswith("data:"):
+            payload = line[len("data:"):].strip()
+        elif line.startswith("{"):
+            # 出错时千帆直接返回普通JSON
+            payload = line
+        else:
+            continue
+        if payload == "[DONE]":
+            break
+        
+        chunk = json.loads(payload)
+        if "error" in chunk:
+            message = chunk.get('error', {}).get('message', str(chunk))
+            raise StreamResponseError(f"AI服务错误: {message}")
+        
+        choices = chunk.get("choices") or [{}]
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+async def stream_with_deadline(question: str) -> AsyncIterator[str]:
+    """在问答截止时间内流式回答（截止时间需在生成器内设置，迭代它的是响应任务）"""
+    with deadline.scope(CHAT_DEADLINE):
+        async for event in stream_question(question):
+            yield event
+
+async def stream_question(question: str) -> AsyncIterator[str]:
+    """以流式模式调用千帆，逐段转发模型输出；超过截止时间时推送 error 事件并结束"""
+    local = await intent_router.route(question)
+    if local is not None:
+        response = ChatResponse(**local)
+        yield sse_event("token", {"content": response.answer})
+        yield sse_event("done", response.model_dump())
+        return
+    
+    library_version = catalog.library_version
+    cached = await answer_cache.get(question, library_version)
+    if cached is not None:
+        response = ChatResponse.model_validate_json(cached)
+        yield sse_event("token", {"content": response.answer})
+        yield sse_event("done", response.model_dump())
+        return
+    
+    messages = await build_chat_messages(question)
+    data = {
+        "model": "ernie-3.5-8k-preview",
+        "messages": messages,
+        "stream": True,
+    }
+    
+    parts = []
+    try:
+        with metrics.stage('chat_llm_stream'):
+            async with llm_client.stream(
+                data,
+                priority=PRIORITY_INTERACTIVE,
+                timeout=http_clients.timeout('qianfan', read=50)
+            ) as response:
+                async for delta in deadline.iterate(iter_stream_deltas(response)):
+                    parts.append(delta)
+                    yield sse_event("token", {"content": delta})
+    except LLMUnavailableError as e:
+        print(f"AI服务不可用: {e}")
+        yield sse_event("error", {"message": "AI服务暂时不可用，请稍后再试"})
+        return
+    except deadline.DeadlineExceeded:
+        DEADLINE_EXCEEDED_TOTAL.inc(route='chat_stream')
+        yield sse_event("error", {"message": "请求超时"})
+        return
+    except StreamResponseError as e:
+        yield sse_event("error", {"message": str(e)})
+        return
+    except Exception as e:
+        yield sse_event("error", {"message": f"处理问题时出错: {str(e)}"})
+        return
+    
+    content = ''.join(parts)
+    if not content:
+        yield sse_event("error", {"message": "AI服务响应格式错误"})
+        return
+    
+    response = await parse_chat_content(content)
+    await answer_cache.set(question, library_version, response.model_dump_json())
+    yield sse_event("done", response.model_dump())
+
+async def parse_chat_content(content: str) -> ChatResponse:
+    """解析模型返回的回答内容"""
+    # 尝试解析JSON响应
+    try:
+        with metrics.stage('chat_parse'):
+            response_data = parse_json_object(content)
+        if response_data is not None:
+            # 如果有video_id，获取对应的YouTube ID
+            youtube_id = None
+            if response_data.get("video_id"):
+                with metrics.stage('chat_youtube_id'):
+                    youtube_id = await get_youtube_id(response_data.get("video_id"))
             
-        except Exception as e:
-            return ChatResponse(answer=f"处理问题时出错: {str(e)}")
+            return ChatResponse(
+                answer=response_data.get("answer", content),
+                video_id=response_data.get("video_id"),
+                youtube_id=youtube_id,
+                start_time=response_data.get("start_time"),
+                end_time=response_data.get("end_time")
+            )
+    except Exception as e:
+        print(f"解析回答失败: {e}")
+    JSON_PARSE_FAILURES_TOTAL.inc(source='chat')
+    
+    # 如果无法解析JSON，返回纯文本回答
+    return ChatResponse(answer=content)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        # 多进程时由uvicorn按模块路径在每个worker中重新导入应用
+        uvicorn.run("python_service:app", host=SERVICE_HOST, port=SERVICE_PORT, workers=WORKERS)
+    else:
+        uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT)
@@ -0,0 +1,287 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 中日韩统一表意文字及扩展A区
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿]+|[a-z0-9]+')
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿]')
+
+DocKey = Tuple[str, int]
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """分词：中文按字符二元组切分，拉丁文字按单词切分"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def build_result_row(video, segment=None) -> Dict:
+    """由目录记录构建检索结果行（与原 videos LEFT JOIN video_segments 查询结构相同）"""
+    return {
+        'id': video.id,
+        'title': video.title,
+        'description': video.description,
+        'you_tube_id': video.youtube_id,
+        'duration': video.duration,
+        'segment_id': segment.id if segment else None,
+        'start_time': segment.start_time if segment else None,
+        'end_time': segment.end_time if segment else None,
+        'content': segment.content if segment else None,
+        'summary': segment.summary if segment else None,
+    }
+
+
+def segment_text(row: Dict) -> str:
+    """片段用于语义向量化的文本"""
+    return f"{row.get('content') or ''}\n{row.get('summary') or ''}"
+
+
+def video_document(video) -> str:
+    """视频在倒排索引中的文档文本"""
+    return f"{video.title}\n{video.description or ''}"
+
+
+def segment_document(video, segment) -> str:
+    """片段在倒排索引中的文档文本"""
+    return f"{video.title}\n{segment.content or ''}\n{segment.summary or ''}"
+
+
+def bm25_idf(n_docs: int, df: int) -> float:
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+
+class BM25Index:
+    """支持增删文档的BM25倒排索引"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[DocKey, int]] = defaultdict(dict)
+        self._doc_lengths: Dict[DocKey, int] = {}
+        self._doc_terms: Dict[DocKey, Tuple[str, ...]] = {}
+        self._rows: Dict[DocKey, Any] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    @property
+    def total_length(self) -> int:
+        return self._total_length
+
+    def posting(self, token: str) -> Dict[DocKey, int]:
+        return self._postings.get(token) or {}
+
+    def add(self, key: DocKey, text: str, row: Any):
+        """添加文档，已存在的同名文档会被替换"""
+        self.remove(key)
+        tokens = tokenize(text)
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        for token, tf in counts.items():
+            self._postings[token][key] = tf
+        self._doc_lengths[key] = len(tokens)
+        self._doc_terms[key] = tuple(counts)
+        self._rows[key] = row
+        self._total_length += len(tokens)
+
+    def remove(self, key: DocKey):
+        terms = self._doc_terms.pop(key, None)
+        if terms is None:
+            return
+        for token in terms:
+            posting = self._postings[token]
+            posting.pop(key, None)
+            if not posting:
+                del self._postings[token]
+        self._total_length -= self._doc_lengths.pop(key)
+        self._rows.pop(key, None)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, Any]]:
+        """返回得分最高的top_k个文档（得分, 文档数据）"""
+        n_docs = len(self._doc_lengths)
+        if not n_docs:
+            return []
+        avg_length = self._total_length / n_docs or 1.0
+        scores: Dict[DocKey, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            posting = self._postings.get(token)
+            if not posting:
+                continue
+            self.accumulate(scores, posting, bm25_idf(n_docs, len(posting)), avg_length)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self._rows[key]) for key, score in best]
+
+    def accumulate(self, scores: Dict[DocKey, float], posting: Dict[DocKey, int], idf: float, avg_length: float):
+        """把一个词在 posting 中各文档上的得分累加到 scores"""
+        for key, tf in posting.items():
+            norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[key] / avg_length)
+            scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def row(self, key: DocKey) -> Any:
+        return self._rows[key]
+
+
+class LibrarySearchIndex:
+    """视频库搜索索引，监听视频目录的变化进行增量更新
+
+    目录从快照加载时，快照中的倒排列表直接在映射上检索，内存中的索引只包含之后变化的视频，
+    两者合并计算BM25得分；变化或删除的视频在快照中的文档会被屏蔽。
+    """
+
+    def __init__(self, vector_index=None):
+        self.index = BM25Index()
+        # 可选的语义向量索引，与倒排索引同步更新
+        self.vector_index = vector_index
+        self._video_docs: Dict[int, List[DocKey]] = {}
+        self._snapshot = None
+        # 快照中仍然有效的文档，及其文档数和总词数
+        self._snapshot_alive: Optional[np.ndarray] = None
+        self._snapshot_docs = 0
+        self._snapshot_length = 0
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """搜索视频内容，返回与原SQL查询相同结构的行"""
+        if self._snapshot is None:
+            return [build_result_row(*refs) for _, refs in self.index.search(query, top_k)]
+        return self._search_with_snapshot(query, top_k)
+
+    def snapshot_loaded(self, snapshot):
+        """以快照作为索引的初始内容"""
+        self.index = BM25Index(self.index.k1, self.index.b)
+        self._video_docs = {}
+        self._snapshot = snapshot
+        self._snapshot_alive = np.ones(len(snapshot.doc_lengths), dtype=bool)
+        self._snapshot_docs = len(snapshot.doc_lengths)
+        self._snapshot_length = int(snapshot.doc_lengths.sum(dtype=np.int64))
+        if self.vector_index is not None:
+            # 向量索引文件中没有的视频（如首次启动）需要计算向量
+            indexed = set(self.vector_index.video_ids())
+            for index, video_id in enumerate(snapshot.video_ids):
+                if int(video_id) not in indexed:
+                    video = snapshot.record(index)
+                    rows = [build_result_row(video, segment) for segment in video.segments]
+                    self.vector_index.replace_video(
+                        video.id, rows, [segment_text(row) for row in rows], signature=repr(video.signature)
+                    )
+
+    def videos_updated(self, videos):
+        """（重新）索引给定视频及其片段"""
+        for video in videos:
+            self._remove_video(video.id, include_vectors=False)
+            self._mask_snapshot_video(video.id)
+            keys = [('video', video.id)]
+            self.index.add(keys[0], video_document(video), (video, None))
+            for segment in video.segments:
+                key = ('segment', segment.id)
+                self.index.add(key, segment_document(video, segment), (video, segment))
+                keys.append(key)
+            self._video_docs[video.id] = keys
+
+            if self.vector_index is not None:
+                rows = [build_result_row(video, segment) for segment in video.segments]
+                # 向量索引由 replace_video 按签名替换
+                self.vector_index.replace_video(
+                    video.id, rows, [segment_text(row) for row in rows], signature=repr(video.signature)
+                )
+
+    def videos_removed(self, video_ids: List[int]):
+        for video_id in video_ids:
+            self._remove_video(video_id)
+            self._mask_snapshot_video(video_id)
+
+    def catalog_loaded(self):
+        """目录全量加载后，删除持久化向量索引中已不在视频库里的视频"""
+        if self.vector_index is not None:
+            current = set(self._video_docs)
+            if self._snapshot is not None:
+                current.update(int(video_id) for video_id in self._snapshot.video_ids)
+            for video_id in set(self.vector_index.video_ids()) - current:
+                self.vector_index.remove_video(video_id)
+
+    def stats(self) -> Dict:
+        snapshot_videos = int(self._snapshot_alive[:self._snapshot.video_count].sum()) if self._snapshot else 0
+        return {
+            "documents": len(self.index) + self._snapshot_docs,
+            "videos": len(self._video_docs) + snapshot_videos,
+            "in_memory_documents": len(self.index),
+            "snapshot_documents": self._snapshot_docs,
+        }
+
+    def _mask_snapshot_video(self, video_id: int):
+        if self._snapshot is None:
+            return
+        index = self._snapshot.video_index(video_id)
+        if index is None:
+            return
+        video_doc, start, end = self._snapshot.document_range(index)
+        docs = np.r_[video_doc, start:end]
+        alive = docs[self._snapshot_alive[docs]]
+        if not len(alive):
+            return
+        self._snapshot_alive[alive] = False
+        self._snapshot_docs -= len(alive)
+        self._snapshot_length -= int(self._snapshot.doc_lengths[alive].sum(dtype=np.int64))
+
+    def _search_with_snapshot(self, query: str, top_k: int) -> List[Dict]:
+        snapshot = self._snapshot
+        n_docs = self._snapshot_docs + len(self.index)
+        if not n_docs:
+            return []
+        avg_length = (self._snapshot_length + self.index.total_length) / n_docs or 1.0
+        k1, b = self.index.k1, self.index.b
+        doc_parts, score_parts = [], []
+        memory_scores: Dict[DocKey, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            docs, tfs = snapshot.postings(token)
+            if len(docs):
+                keep = self._snapshot_alive[docs]
+                docs, tfs = docs[keep], tfs[keep].astype(np.float64)
+            posting = self.index.posting(token)
+            df = len(docs) + len(posting)
+            if not df:
+                continue
+            idf = bm25_idf(n_docs, df)
+            if len(docs):
+                norm = k1 * (1 - b + b * snapshot.doc_lengths[docs] / avg_length)
+                doc_parts.append(docs)
+                score_parts.append(idf * tfs * (k1 + 1) / (tfs + norm))
+            if posting:
+                self.index.accumulate(memory_scores, posting, idf, avg_length)
+
+        candidates = [(score, False, key) for key, score in memory_scores.items()]
+        if doc_parts:
+            # 同一文档在多个词上的得分求和
+            unique, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(score_parts))
+            k = min(top_k, len(unique))
+            top = np.argpartition(-totals, k - 1)[:k]
+            candidates.extend((float(totals[i]), True, int(unique[i])) for i in top)
+        best = heapq.nlargest(top_k, candidates, key=lambda candidate: candidate[0])
+        return [
+            snapshot.result_row(key) if from_snapshot else build_result_row(*self.index.row(key))
+            for _, from_snapshot, key in best
+        ]
+
+    def _remove_video(self, video_id: int, include_vectors: bool = True):
+        if include_vectors and self.vector_index is not None:
+            self.vector_index.remove_video(video_id)
+        for key in self._video_docs.pop(video_id, []):
+            self.index.remove(key)
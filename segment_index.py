@@ -0,0 +1,123 @@
+import bisect
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from cache import TTLCache
+from transcripts import SOURCE_TRANSCRIPT
+
+_SEGMENT_COLUMNS = "id, video_id, start_time, end_time, content, summary, source"
+
+
+class VideoSegments:
+    """一个视频按开始时间排序的片段，以及按时间点二分查找用的区间数组
+
+    rows 包含全部片段；按时间点定位时视频有分析片段就只在分析片段中查找，
+    只有字幕分块时才在字幕分块中查找。
+    """
+
+    __slots__ = ('rows', 'starts', 'ends', '_located', '_reach')
+
+    def __init__(self, rows: Iterable[Dict]):
+        self.rows = sorted(rows, key=lambda row: (row['start_time'] or 0, row['end_time'] or 0))
+        self._located = [row for row in self.rows if row.get('source') != SOURCE_TRANSCRIPT] or self.rows
+        self.starts = [row['start_time'] or 0 for row in self._located]
+        self.ends = [row['end_time'] or 0 for row in self._located]
+        # 结束时间的前缀最大值：片段可能相互重叠（如字幕分块），向前查找到不可能覆盖时间点为止
+        self._reach = list(accumulate(self.ends, max))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def at(self, t: float) -> Optional[Dict]:
+        """返回覆盖时间点 t 的片段（start_time <= t <= end_time），有多个时取开始时间最晚的"""
+        i = bisect.bisect_right(self.starts, t) - 1
+        while i >= 0 and self._reach[i] >= t:
+            if self.ends[i] >= t:
+                return self._located[i]
+            i -= 1
+        return None
+
+
+class SegmentIntervalIndex:
+    """按视频缓存片段，支持批量获取和按时间点定位片段
+
+    未命中的视频一次批量加载：目录已加载时从目录读取，否则用一条 IN 查询从数据库读取。
+    作为视频目录的监听者，视频重新分析或片段变化后对应的缓存条目失效。
+    """
+
+    def __init__(self, database, catalog=None, maxsize: int = 4096, ttl: float = 3600.0):
+        self.database = database
+        self.catalog = catalog
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # 每次失效时递增，加载期间发生过失效的结果不写入缓存
+        self._generation = 0
+        self.loads = 0
+
+    async def get(self, video_id: int) -> VideoSegments:
+        return (await self.get_many([video_id]))[video_id]
+
+    async def get_many(self, video_ids: Iterable[int]) -> Dict[int, VideoSegments]:
+        """获取多个视频的片段，没有片段（或不存在）的视频返回空列表；数据库出错时抛出 DatabaseError"""
+        result: Dict[int, VideoSegments] = {}
+        missing = []
+        for video_id in dict.fromkeys(video_ids):
+            entry = self._cache.get(video_id)
+            if entry is None:
+                missing.append(video_id)
+            else:
+                result[video_id] = entry
+        if missing:
+            generation = self._generation
+            loaded = await self._load(missing)
+            for video_id in missing:
+                entry = VideoSegments(loaded.get(video_id, ()))
+                if generation == self._generation:
+                    self._cache.set(video_id, entry)
+                result[video_id] = entry
+        return result
+
+    async def segments_at(self, video_id: int, timestamps: Sequence[float]) -> List[Optional[Dict]]:
+        """返回每个时间点所在的片段（没有时为 None）"""
+        segments = await self.get(video_id)
+        return [segments.at(t) for t in timestamps]
+
+    def invalidate(self, video_id: Optional[int] = None):
+        """丢弃一个视频的缓存，video_id 为 None 时全部丢弃"""
+        self._generation += 1
+        if video_id is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(video_id)
+
+    # 视频目录监听者接口
+
+    def videos_updated(self, videos):
+        for video in videos:
+            self.invalidate(video.id)
+
+    def videos_removed(self, video_ids: List[int]):
+        for video_id in video_ids:
+            self.invalidate(video_id)
+
+    def snapshot_loaded(self, snapshot):
+        self.invalidate()
+
+    def catalog_loaded(self):
+        self.invalidate()
+
+    def stats(self) -> Dict:
+        return {**self._cache.stats(), "loads": self.loads}
+
+    async def _load(self, video_ids: List[int]) -> Dict[int, List[Dict]]:
+        self.loads += 1
+        if self.catalog is not None and self.catalog.loaded:
+            return {video_id: [segment.as_row() for segment in self.catalog.segments(video_id)]
+                    for video_id in video_ids}
+        placeholders = ', '.join(['%s'] * len(video_ids))
+        rows = await self.database.fetch_all(
+            f"SELECT {_SEGMENT_COLUMNS} FROM video_segments WHERE video_id IN ({placeholders})", video_ids
+        )
+        grouped: Dict[int, List[Dict]] = {}
+        for row in rows:
+            grouped.setdefault(row['video_id'], []).append(row)
+        return grouped
@@ -0,0 +1,238 @@
+import json
+import re
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+import metrics
+
+SEGMENTS_PARSED_TOTAL = metrics.counter('ytchat_segments_parsed_total', '从模型输出中解析出的有效片段数')
+SEGMENTS_INVALID_TOTAL = metrics.counter('ytchat_segments_invalid_total', '模型输出中无法解析或校验失败的片段数')
+JSON_REPAIRS_TOTAL = metrics.counter('ytchat_json_repairs_total', '解析模型输出时修复的JSON问题次数', ('kind',))
+
+# 流式分析时每解析出一个片段调用一次的回调
+SegmentCallback = Callable[[Dict], Awaitable[None]]
+
+_CLOCK_RE = re.compile(r'^(?:(\d+):)?(\d{1,2}):(\d{2})(?:\.\d+)?$')
+
+# 字符串外出现的全角标点按对应的半角标点处理
+_FULLWIDTH = {'：': ':', '，': ','}
+# 字符串的开始和结束引号（中文引号和单引号会被当作JSON引号）
+_QUOTES = {'"': '"', '“': '”', '‘': '’', "'": "'"}
+
+
+class AnalysisSegment(BaseModel):
+    """模型输出的一个视频片段"""
+    start_time: int
+    end_time: int
+    content: str
+    summary: str = ''
+
+    @field_validator('start_time', 'end_time', mode='before')
+    @classmethod
+    def _parse_time(cls, value):
+        # 接受小数秒和 "mm:ss" / "hh:mm:ss" 形式的时间
+        if isinstance(value, float):
+            return int(value)
+        if isinstance(value, str):
+            value = value.strip().rstrip('秒s')
+            match = _CLOCK_RE.match(value)
+            if match:
+                hours, minutes, seconds = match.groups()
+                return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+            try:
+                return int(float(value))
+            except ValueError:
+                return value
+        return value
+
+    @field_validator('content')
+    @classmethod
+    def _require_content(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError('content 不能为空')
+        return value
+
+    @field_validator('summary', mode='before')
+    @classmethod
+    def _default_summary(cls, value):
+        return '' if value is None else value
+
+    @model_validator(mode='after')
+    def _check_range(self):
+        if self.start_time < 0:
+            raise ValueError('start_time 不能为负数')
+        if self.end_time < self.start_time:
+            raise ValueError('end_time 早于 start_time')
+        return self
+
+
+class JSONObjectStream:
+    """增量解析模型输出中的JSON对象
+
+    逐段喂入文本，每当顶层数组（或没有数组时的顶层）中的一个对象闭合就立即返回它。
+    解析时顺带修复常见问题：代码块标记和说明文字、尾随逗号、中文引号和单引号、
+    字符串外的全角冒号和逗号、字符串中的裸换行。
+    """
+
+    def __init__(self):
+        self._depth = 0
+        # 对象所在的层级：进入顶层数组后为1
+        self._level = 0
+        self._done = False
+        self._buffer: List[str] = []
+        self._capturing = False
+        self._quote: Optional[str] = None
+        self._escape = False
+        self._pending_comma = False
+        self.objects = 0
+        self.errors = 0
+
+    @property
+    def truncated(self) -> bool:
+        """顶层数组已经开始但还没有闭合（如输出被截断）"""
+        return self._level == 1 and not self._done
+
+    def feed(self, text: str) -> List[Dict]:
+        """喂入一段文本，返回其中新闭合的对象"""
+        objects = []
+        for ch in text:
+            obj = self._consume(ch)
+            if obj is not None:
+                objects.append(obj)
+        return objects
+
+    def _emit(self, text: str):
+        if self._capturing:
+            self._buffer.append(text)
+
+    def _consume(self, ch: str) -> Optional[Dict]:
+        if self._done:
+            return None
+        if self._quote is not None:
+            self._consume_string(ch)
+            return None
+
+        if ch.isspace() or ch == '`':
+            return None
+        ch = _FULLWIDTH.get(ch, ch)
+        if self._pending_comma:
+            self._pending_comma = False
+            if ch in '}]':
+                JSON_REPAIRS_TOTAL.inc(kind='trailing_comma')
+            else:
+                self._emit(',')
+        if ch == ',':
+            self._pending_comma = True
+            return None
+
+        if ch in _QUOTES:
+            if not self._capturing:
+                return None
+            if ch != '"':
+                JSON_REPAIRS_TOTAL.inc(kind='quote')
+            self._quote = _QUOTES[ch]
+            self._emit('"')
+        elif ch in '[{':
+            if ch == '[' and self._depth == 0 and not self._capturing:
+                self._level = 1
+            elif ch == '{' and self._depth == self._level:
+                self._capturing = True
+                self._buffer = []
+            self._depth += 1
+            self._emit(ch)
+        elif ch in ']}':
+            if self._depth == 0:
+                return None
+            self._depth -= 1
+            self._emit(ch)
+            if ch == '}' and self._capturing and self._depth == self._level:
+                self._capturing = False
+                return self._decode(''.join(self._buffer))
+            if ch == ']' and self._depth == 0 and self._level == 1:
+                if self.objects or self.errors:
+                    # 顶层数组结束，之后的文字忽略
+                    self._done = True
+                else:
+                    # 说明文字中的方括号，继续寻找真正的数组
+                    self._level = 0
+        else:
+            self._emit(ch)
+        return None
+
+    def _consume_string(self, ch: str):
+        if self._escape:
+            self._escape = False
+            self._emit(ch)
+        elif ch == '\\':
+            self._escape = True
+            self._emit(ch)
+        elif ch == self._quote:
+            self._quote = None
+            self._emit('"')
+        elif ch == '"':
+            # 以其他引号开始的字符串中的英文双引号需要转义
+            self._emit('\\"')
+        elif ch == '\n':
+            self._emit('\\n')
+        elif ch in '\r\t':
+            self._emit(' ')
+        else:
+            self._emit(ch)
+
+    def _decode(self, text: str) -> Optional[Dict]:
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            self.errors += 1
+            return None
+        self.objects += 1
+        return obj
+
+
+class SegmentStreamParser:
+    """增量解析模型输出的片段数组，逐个返回通过校验的片段"""
+
+    def __init__(self):
+        self._stream = JSONObjectStream()
+        self.parsed = 0
+        self.invalid = 0
+
+    @property
+    def truncated(self) -> bool:
+        """片段数组没有闭合，模型输出不完整"""
+        return self._stream.truncated
+
+    def feed(self, text: str) -> List[Dict]:
+        """喂入一段模型输出，返回新解析出的有效片段"""
+        segments = []
+        errors = self._stream.errors
+        for obj in self._stream.feed(text):
+            try:
+                segment = AnalysisSegment.model_validate(obj)
+            except ValidationError:
+                self.invalid += 1
+                SEGMENTS_INVALID_TOTAL.inc()
+                continue
+            self.parsed += 1
+            SEGMENTS_PARSED_TOTAL.inc()
+            segments.append(segment.model_dump())
+        broken = self._stream.errors - errors
+        if broken:
+            self.invalid += broken
+            SEGMENTS_INVALID_TOTAL.inc(broken)
+        return segments
+
+
+def parse_segments(content: str) -> List[Dict]:
+    """一次性解析完整的模型输出中的片段"""
+    return SegmentStreamParser().feed(content)
+
+
+def parse_json_object(content: str) -> Optional[Dict]:
+    """取出模型输出中的第一个JSON对象（带修复），没有时返回 None"""
+    for obj in JSONObjectStream().feed(content):
+        if isinstance(obj, dict):
+            return obj
+    return None
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+# 失效回调：key 为 None 表示整个命名空间失效
+InvalidationListener = Callable[[Optional[str]], None]
+
+
+class SharedCache:
+    """多进程共享的缓存存储：数据存放在 SQLite（WAL 模式）文件中，同一台机器上的所有worker共用
+
+    只负责持久化和跨进程失效，内存缓存仍由各使用方自己维护。每次写入或失效都会追加到失效日志，
+    各进程定期读取其他进程写入的日志并通知本命名空间的监听者丢弃内存中的旧条目，
+    因此一个worker上的写入最多 poll_interval 秒后在所有worker上生效。
+    定期清理时删除过期条目，每个命名空间超过 max_entries 条时先删除最早过期的条目。
+    """
+
+    def __init__(self, path: str, poll_interval: float = 1.0, log_retention: float = 600.0,
+                 max_entries: int = 100000):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.log_retention = log_retention
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries (namespace, expires_at)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_invalidations ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, key TEXT, "
+            "origin INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        # 启动前的失效记录与本进程无关，从当前位置开始读取
+        self._last_seq = self._conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM cache_invalidations"
+        ).fetchone()[0]
+        self._listeners: Dict[str, List[InvalidationListener]] = defaultdict(list)
+        self._polls = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+        self.evictions = 0
+
+    def add_listener(self, namespace: str, listener: InvalidationListener):
+        """注册命名空间的失效回调，其他进程写入或删除该命名空间的条目时调用"""
+        self._listeners[namespace].append(listener)
+
+    # 共享缓存出错（如数据库被锁）时只记录日志，按未命中处理，不影响请求
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        try:
+            return await asyncio.to_thread(self._get, namespace, key)
+        except sqlite3.Error as e:
+            print(f"读取共享缓存失败: {e}")
+            return None
+
+    async def set(self, namespace: str, key: str, value: str, ttl: float):
+        try:
+            await asyncio.to_thread(self._set, namespace, key, value, ttl)
+        except sqlite3.Error as e:
+            print(f"写入共享缓存失败: {e}")
+
+    async def invalidate(self, namespace: str, key: Optional[str] = None):
+        """删除一个条目，key 为 None 时删除整个命名空间；所有进程都会收到通知"""
+        try:
+            await asyncio.to_thread(self._invalidate, namespace, key)
+        except sqlite3.Error as e:
+            print(f"删除共享缓存失败: {e}")
+
+    async def sync(self) -> int:
+        """读取其他进程的失效记录并通知监听者，返回处理的记录数"""
+        rows = await asyncio.to_thread(self._read_log)
+        for namespace, key in rows:
+            for listener in self._listeners.get(namespace, ()):
+                listener(key)
+        self.invalidations_received += len(rows)
+        return len(rows)
+
+    async def run_sync_loop(self):
+        """定期同步失效记录，直到任务被取消"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+            except sqlite3.Error as e:
+                print(f"同步共享缓存失败: {e}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "invalidations_sent": self.invalidations_sent,
+            "invalidations_received": self.invalidations_received,
+            "evictions": self.evictions,
+            "max_entries": self.max_entries,
+        }
+
+    def _get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def _set(self, namespace: str, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, now + ttl)
+            )
+            # 其他进程内存中的旧值需要丢弃
+            self._log(namespace, key, now)
+            self._conn.commit()
+        self.writes += 1
+
+    def _invalidate(self, namespace: str, key: Optional[str]):
+        with self._lock:
+            if key is None:
+                self._conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+            else:
+                self._conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+            self._log(namespace, key, time.time())
+            self._conn.commit()
+
+    def _log(self, namespace: str, key: Optional[str], now: float):
+        self._conn.execute(
+            "INSERT INTO cache_invalidations (namespace, key, origin, created_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, self._pid, now)
+        )
+        self.invalidations_sent += 1
+
+    def _read_log(self) -> List[tuple]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, namespace, key, origin FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+                (self._last_seq,)
+            ).fetchall()
+            if rows:
+                self._last_seq = rows[-1][0]
+            self._polls += 1
+            # 定期清理过期条目、超出上限的条目和旧的失效记录
+            if self._polls % 60 == 0:
+                self._cleanup(time.time())
+        return [(namespace, key) for _, namespace, key, origin in rows if origin != self._pid]
+
+    def _cleanup(self, now: float):
+        self._conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+        counts = self._conn.execute(
+            "SELECT namespace, COUNT(*) FROM cache_entries GROUP BY namespace"
+        ).fetchall()
+        for namespace, count in counts:
+            excess = count - self.max_entries
+            if excess <= 0:
+                continue
+            # 其他进程内存中的条目由各自的容量限制淘汰，这里不写失效记录
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY expires_at LIMIT ?)",
+                (namespace, namespace, excess)
+            )
+            self.evictions += excess
+            print(f"共享缓存命名空间 {namespace} 超过 {self.max_entries} 条，淘汰 {excess} 条")
+        self._conn.execute(
+            "DELETE FROM cache_invalidations WHERE created_at < ?", (now - self.log_retention,)
+        )
+        self._conn.commit()
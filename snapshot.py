@@ -0,0 +1,423 @@
+"""视频目录和倒排索引的二进制快照
+
+快照是一个版本化的单文件，worker启动时以 mmap 只读映射，不需要全量读表、分词和建索引，
+之后只需从快照的 updated_at 水位开始增量刷新。多个worker映射同一个文件时共享页缓存，
+每个进程的常驻内存只包含快照之后发生变化的视频。
+
+文件布局（小端）：
+    头部         魔数、格式版本、水位、各类记录数，以及各数据段的偏移和长度
+    strings      所有文本的UTF-8字节，记录中以（偏移, 长度）引用
+    videos       视频表（按ID排序），含该视频片段在 segments 中的起始位置和数量
+    segments     片段表（按视频、开始时间排序）
+    term_hashes  词的64位哈希（升序），查询时二分查找
+    terms        与 term_hashes 对应的词文本，以及倒排列表的起始位置
+    post_docs    倒排列表：文档编号（0..视频数-1 为视频文档，之后为片段文档）
+    post_tfs     倒排列表：词频
+    doc_lengths  每个文档的词数
+
+用法：
+    python -m snapshot build [--output data/catalog.snap]   从数据库重建快照
+    python -m snapshot info [path]                           查看快照信息
+"""
+
+import argparse
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from catalog import SegmentRecord, VideoRecord
+from search_index import segment_document, tokenize, video_document
+from transcripts import SOURCE_ANALYSIS, SOURCE_TRANSCRIPT
+
+MAGIC = b'YTCSNAP\0'
+FORMAT_VERSION = 2
+
+_SECTIONS = ('strings', 'videos', 'segments', 'term_hashes', 'terms', 'post_docs', 'post_tfs', 'doc_lengths')
+# 魔数、格式版本、水位（微秒）、视频数、片段数、词数、倒排项数、各数据段（偏移, 长度）
+_HEADER = struct.Struct('<8sIq4Q' + 'QQ' * len(_SECTIONS))
+_ALIGN = 8
+
+# 文本字段为空（NULL）时的长度标记，时间为空时的标记
+_NULL_LENGTH = 0xFFFFFFFF
+_NULL_TIME = np.iinfo(np.int64).min
+_EPOCH = datetime(1970, 1, 1)
+
+VIDEO_DTYPE = np.dtype([
+    ('id', '<i8'), ('duration', '<i8'), ('updated_at', '<i8'),
+    ('youtube_id', '<u8'), ('youtube_id_len', '<u4'),
+    ('title', '<u8'), ('title_len', '<u4'),
+    ('description', '<u8'), ('description_len', '<u4'),
+    ('thumbnail', '<u8'), ('thumbnail_len', '<u4'),
+    ('segment_start', '<u8'), ('segment_count', '<u4'),
+])
+SEGMENT_DTYPE = np.dtype([
+    ('id', '<i8'), ('video_id', '<i8'), ('start_time', '<i8'), ('end_time', '<i8'), ('updated_at', '<i8'),
+    ('content', '<u8'), ('content_len', '<u4'),
+    ('summary', '<u8'), ('summary_len', '<u4'),
+    ('source', 'u1'),
+])
+# 片段来源在快照中的编码
+_SOURCES = (SOURCE_ANALYSIS, SOURCE_TRANSCRIPT)
+TERM_DTYPE = np.dtype([('text', '<u8'), ('text_len', '<u4'), ('postings', '<u8')])
+
+
+class SnapshotError(Exception):
+    """快照文件损坏或格式版本不兼容"""
+
+
+def term_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _to_micros(value: Optional[datetime]) -> int:
+    if value is None:
+        return _NULL_TIME
+    return (value.replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value: int) -> Optional[datetime]:
+    if value == _NULL_TIME:
+        return None
+    return _EPOCH + timedelta(microseconds=int(value))
+
+
+class _StringHeap:
+    def __init__(self):
+        self.data = bytearray()
+
+    def add(self, text: Optional[str]) -> Tuple[int, int]:
+        if text is None:
+            return 0, _NULL_LENGTH
+        encoded = text.encode('utf-8')
+        offset = len(self.data)
+        self.data += encoded
+        return offset, len(encoded)
+
+
+def write_snapshot(path: str, videos: Iterable[VideoRecord], watermark: Optional[datetime]) -> Dict:
+    """把视频目录及其倒排索引写入快照文件（原子替换），返回写入的统计信息"""
+    videos = sorted(videos, key=lambda video: video.id)
+    strings = _StringHeap()
+    video_table = np.zeros(len(videos), dtype=VIDEO_DTYPE)
+    segment_table = np.zeros(sum(len(video.segments) for video in videos), dtype=SEGMENT_DTYPE)
+    n_videos = len(videos)
+    doc_lengths = np.zeros(n_videos + len(segment_table), dtype=np.uint32)
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+
+    def index_document(doc: int, text: str):
+        counts: Dict[str, int] = defaultdict(int)
+        tokens = tokenize(text)
+        for token in tokens:
+            counts[token] += 1
+        for token, tf in counts.items():
+            postings[token].append((doc, tf))
+        doc_lengths[doc] = len(tokens)
+
+    segment_index = 0
+    for i, video in enumerate(videos):
+        entry = video_table[i]
+        entry['id'] = video.id
+        entry['duration'] = video.duration or 0
+        entry['updated_at'] = _to_micros(video.updated_at)
+        for name in ('youtube_id', 'title', 'description', 'thumbnail'):
+            entry[name], entry[f'{name}_len'] = strings.add(getattr(video, name))
+        entry['segment_start'] = segment_index
+        entry['segment_count'] = len(video.segments)
+        index_document(i, video_document(video))
+        for segment in video.segments:
+            row = segment_table[segment_index]
+            row['id'] = segment.id
+            row['video_id'] = video.id
+            row['start_time'] = segment.start_time or 0
+            row['end_time'] = segment.end_time or 0
+            row['updated_at'] = _to_micros(segment.updated_at)
+            row['content'], row['content_len'] = strings.add(segment.content)
+            row['summary'], row['summary_len'] = strings.add(segment.summary)
+            row['source'] = _SOURCES.index(segment.source) if segment.source in _SOURCES else 0
+            index_document(n_videos + segment_index, segment_document(video, segment))
+            segment_index += 1
+
+    terms = sorted(postings, key=term_hash)
+    term_hashes = np.array([term_hash(term) for term in terms], dtype='<u8')
+    term_table = np.zeros(len(terms) + 1, dtype=TERM_DTYPE)
+    n_postings = sum(len(postings[term]) for term in terms)
+    post_docs = np.zeros(n_postings, dtype='<u4')
+    post_tfs = np.zeros(n_postings, dtype='<u4')
+    position = 0
+    for i, term in enumerate(terms):
+        term_table[i]['text'], term_table[i]['text_len'] = strings.add(term)
+        term_table[i]['postings'] = position
+        entries = postings[term]
+        post_docs[position:position + len(entries)] = [doc for doc, _ in entries]
+        post_tfs[position:position + len(entries)] = [tf for _, tf in entries]
+        position += len(entries)
+    term_table[len(terms)]['postings'] = position
+
+    sections = {
+        'strings': bytes(strings.data),
+        'videos': video_table.tobytes(),
+        'segments': segment_table.tobytes(),
+        'term_hashes': term_hashes.tobytes(),
+        'terms': term_table.tobytes(),
+        'post_docs': post_docs.tobytes(),
+        'post_tfs': post_tfs.tobytes(),
+        'doc_lengths': doc_lengths.astype('<u4').tobytes(),
+    }
+    layout = []
+    offset = _HEADER.size
+    for name in _SECTIONS:
+        offset += -offset % _ALIGN
+        layout.extend((offset, len(sections[name])))
+        offset += len(sections[name])
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, _to_micros(watermark),
+        n_videos, len(segment_table), len(terms), n_postings, *layout
+    )
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 多个worker可能同时保存，临时文件按进程区分
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for name, section_offset in zip(_SECTIONS, layout[::2]):
+            f.write(b'\0' * (section_offset - f.tell()))
+            f.write(sections[name])
+    os.replace(tmp_path, path)
+    return {"videos": n_videos, "segments": len(segment_table), "terms": len(terms), "bytes": offset}
+
+
+def read_watermark(path: str) -> Optional[datetime]:
+    """只读取快照头部的水位，文件不存在或无效时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < _HEADER.size:
+        return None
+    magic, version, watermark = _HEADER.unpack(header)[:3]
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    return _from_micros(watermark)
+
+
+class CatalogSnapshot:
+    """以 mmap 只读映射的目录快照，记录和倒排列表在访问时才从映射中读取"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise SnapshotError(f"快照文件为空: {path}") from e
+        if len(self._mmap) < _HEADER.size:
+            raise SnapshotError(f"快照文件不完整: {path}")
+        fields = _HEADER.unpack_from(self._mmap, 0)
+        magic, version, watermark, n_videos, n_segments, n_terms, n_postings = fields[:7]
+        if magic != MAGIC:
+            raise SnapshotError(f"不是目录快照文件: {path}")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"快照格式版本 {version} 与当前版本 {FORMAT_VERSION} 不一致")
+        layout = dict(zip(_SECTIONS, zip(fields[7::2], fields[8::2])))
+        if any(offset + length > len(self._mmap) for offset, length in layout.values()):
+            raise SnapshotError(f"快照文件不完整: {path}")
+
+        self.watermark = _from_micros(watermark)
+        self.video_count = n_videos
+        self.segment_count = n_segments
+        self.term_count = n_terms
+        self.size = len(self._mmap)
+        self._strings = layout['strings'][0]
+        self.videos = self._array(layout['videos'], VIDEO_DTYPE, n_videos)
+        self.segments = self._array(layout['segments'], SEGMENT_DTYPE, n_segments)
+        self._term_hashes = self._array(layout['term_hashes'], np.dtype('<u8'), n_terms)
+        self._terms = self._array(layout['terms'], TERM_DTYPE, n_terms + 1)
+        self._post_docs = self._array(layout['post_docs'], np.dtype('<u4'), n_postings)
+        self._post_tfs = self._array(layout['post_tfs'], np.dtype('<u4'), n_postings)
+        self.doc_lengths = self._array(layout['doc_lengths'], np.dtype('<u4'), n_videos + n_segments)
+        self.video_ids = self.videos['id']
+
+    def close(self):
+        # numpy 视图仍引用映射时无法关闭，交给垃圾回收处理
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "format_version": FORMAT_VERSION,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "videos": self.video_count,
+            "segments": self.segment_count,
+            "terms": self.term_count,
+            "bytes": self.size,
+        }
+
+    def video_index(self, video_id: int) -> Optional[int]:
+        i = int(np.searchsorted(self.video_ids, video_id))
+        if i < self.video_count and self.video_ids[i] == video_id:
+            return i
+        return None
+
+    def youtube_id(self, index: int) -> str:
+        entry = self.videos[index]
+        return self._string(entry['youtube_id'], entry['youtube_id_len'])
+
+    def title(self, index: int) -> str:
+        entry = self.videos[index]
+        return self._string(entry['title'], entry['title_len']) or ''
+
+    def record(self, index: int) -> VideoRecord:
+        """从快照构造视频记录（不缓存，用完即释放）"""
+        entry = self.videos[index]
+        start = int(entry['segment_start'])
+        segments = [
+            SegmentRecord(self._segment_row(row))
+            for row in self.segments[start:start + int(entry['segment_count'])]
+        ]
+        return VideoRecord(self._video_row(entry), segments)
+
+    def records(self) -> Iterator[VideoRecord]:
+        for index in range(self.video_count):
+            yield self.record(index)
+
+    def document_range(self, index: int) -> Tuple[int, int, int]:
+        """视频的文档编号，及其片段文档编号的范围 [start, end)"""
+        entry = self.videos[index]
+        start = self.video_count + int(entry['segment_start'])
+        return index, start, start + int(entry['segment_count'])
+
+    def postings(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        """词的倒排列表（文档编号, 词频），不存在时为空数组"""
+        encoded = token.encode('utf-8')
+        h = term_hash(token)
+        i = int(np.searchsorted(self._term_hashes, h))
+        while i < self.term_count and self._term_hashes[i] == h:
+            term = self._terms[i]
+            if self._bytes(term['text'], term['text_len']) == encoded:
+                start, end = int(term['postings']), int(self._terms[i + 1]['postings'])
+                return self._post_docs[start:end], self._post_tfs[start:end]
+            i += 1
+        return self._post_docs[:0], self._post_tfs[:0]
+
+    def result_row(self, doc: int) -> Dict:
+        """文档对应的检索结果行（与 search_index.build_result_row 结构相同）"""
+        if doc < self.video_count:
+            video, segment = self.videos[doc], None
+        else:
+            segment = self.segments[doc - self.video_count]
+            video = self.videos[self.video_index(int(segment['video_id']))]
+        return {
+            'id': int(video['id']),
+            'title': self._string(video['title'], video['title_len']) or '',
+            'description': self._string(video['description'], video['description_len']),
+            'you_tube_id': self._string(video['youtube_id'], video['youtube_id_len']),
+            'duration': int(video['duration']),
+            'segment_id': int(segment['id']) if segment is not None else None,
+            'start_time': int(segment['start_time']) if segment is not None else None,
+            'end_time': int(segment['end_time']) if segment is not None else None,
+            'content': self._string(segment['content'], segment['content_len']) if segment is not None else None,
+            'summary': self._string(segment['summary'], segment['summary_len']) if segment is not None else None,
+        }
+
+    def _array(self, section: Tuple[int, int], dtype: np.dtype, count: int) -> np.ndarray:
+        offset, length = section
+        if length != dtype.itemsize * count:
+            raise SnapshotError(f"快照数据段长度不一致: {self.path}")
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+
+    def _bytes(self, offset, length) -> bytes:
+        start = self._strings + int(offset)
+        return self._mmap[start:start + int(length)]
+
+    def _string(self, offset, length) -> Optional[str]:
+        if length == _NULL_LENGTH:
+            return None
+        return self._bytes(offset, length).decode('utf-8')
+
+    def _video_row(self, entry) -> Dict:
+        return {
+            'id': int(entry['id']),
+            'you_tube_id': self._string(entry['youtube_id'], entry['youtube_id_len']),
+            'title': self._string(entry['title'], entry['title_len']),
+            'description': self._string(entry['description'], entry['description_len']),
+            'thumbnail': self._string(entry['thumbnail'], entry['thumbnail_len']),
+            'duration': int(entry['duration']),
+            'updated_at': _from_micros(entry['updated_at']),
+        }
+
+    def _segment_row(self, row) -> Dict:
+        return {
+            'id': int(row['id']),
+            'video_id': int(row['video_id']),
+            'start_time': int(row['start_time']),
+            'end_time': int(row['end_time']),
+            'content': self._string(row['content'], row['content_len']),
+            'summary': self._string(row['summary'], row['summary_len']),
+            'source': _SOURCES[int(row['source'])],
+            'updated_at': _from_micros(row['updated_at']),
+        }
+
+
+def open_snapshot(path: str) -> Optional[CatalogSnapshot]:
+    """打开快照，文件不存在时返回 None；文件无效时打印原因并返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return CatalogSnapshot(path)
+    except (OSError, SnapshotError) as e:
+        print(f"加载目录快照失败: {e}")
+        return None
+
+
+async def _build(path: str):
+    from python_service import catalog, database
+    await database.connect()
+    try:
+        started = time.perf_counter()
+        await catalog.refresh()
+        result = write_snapshot(path, catalog.videos(), catalog.watermark)
+        elapsed = time.perf_counter() - started
+        print(f"已写入 {path}: {result['videos']} 个视频, {result['segments']} 个片段, "
+              f"{result['terms']} 个词, {result['bytes'] / 1024 / 1024:.1f} MB, 耗时 {elapsed:.1f} 秒")
+    finally:
+        await database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='视频目录快照工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='从数据库重建快照（数据库配置与服务相同）')
+    build.add_argument('--output', default=None, help='快照路径，默认为 CATALOG_SNAPSHOT_PATH')
+    info = subparsers.add_parser('info', help='查看快照信息')
+    info.add_argument('path', nargs='?', default=None)
+    args = parser.parse_args()
+
+    default_path = os.getenv('CATALOG_SNAPSHOT_PATH') or 'data/catalog.snap'
+    if args.command == 'build':
+        asyncio.run(_build(args.output or default_path))
+    else:
+        path = args.path or default_path
+        try:
+            snapshot = CatalogSnapshot(path)
+        except (OSError, SnapshotError) as e:
+            raise SystemExit(f"无法读取快照: {e}")
+        for key, value in snapshot.stats().items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,7 @@ CREATE TABLE IF NOT EXISTS `video_segments` (
     `end_time` int(11) NOT NULL DEFAULT '0' COMMENT '结束时间(秒)',
     `content` text COMMENT '片段内容',
     `summary` text COMMENT '片段摘要',
+    `source` varchar(20) NOT NULL DEFAULT 'analysis' COMMENT '片段来源: analysis(内容分析) / transcript(字幕分块)',
     `created_at` datetime(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) COMMENT '创建时间',
     `updated_at` datetime(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3) COMMENT '更新时间',
     PRIMARY KEY (`id`),
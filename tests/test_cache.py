@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import deadline
+from cache import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        results = await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+        assert results == ['value'] * 5
+        assert calls == 1
+        assert flight.stats() == {"calls": 1, "coalesced": 4, "abandoned": 0, "inflight": 0}
+
+    asyncio.run(main())
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight = SingleFlight(cancel_when_abandoned=True)
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        leader = asyncio.ensure_future(flight.do('key', fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == 'value'
+        assert leader.cancelled()
+        assert flight.abandoned == 0
+
+    asyncio.run(main())
+
+
+def test_abandoned_flight_is_cancelled():
+    async def main():
+        flight = SingleFlight(cancel_when_abandoned=True)
+        cancelled = asyncio.Event()
+
+        async def fetch():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do('key', fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.abandoned == 1
+        assert flight.stats()["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_flight_does_not_inherit_leader_deadline():
+    async def main():
+        flight = SingleFlight(cancel_when_abandoned=True)
+
+        async def fetch():
+            # 与聊天处理一样在截止时间内执行
+            async with deadline.enforce():
+                await asyncio.sleep(0.1)
+            return 'value'
+
+        async def call(timeout: float):
+            with deadline.scope(timeout):
+                async with deadline.enforce():
+                    return await flight.do('key', fetch)
+
+        leader = asyncio.ensure_future(call(0.03))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(call(1.0))
+        with pytest.raises(deadline.DeadlineExceeded):
+            await leader
+        assert await follower == 'value'
+
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+
+import deadline
+
+
+def test_scope_keeps_earlier_deadline():
+    with deadline.scope(1.0):
+        outer = deadline.remaining()
+        with deadline.scope(10.0):
+            assert deadline.remaining() <= outer
+        with deadline.scope(0.5):
+            assert deadline.remaining() <= 0.5
+    assert deadline.remaining() is None
+
+
+def test_detached_context_has_no_deadline():
+    with deadline.scope(1.0):
+        assert deadline.detached_context().run(deadline.remaining) is None
+        assert deadline.remaining() is not None
+
+
+def test_enforce_cancels_and_raises_at_deadline():
+    async def main():
+        cancelled = False
+
+        async def slow():
+            nonlocal cancelled
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+
+        started = time.monotonic()
+        with deadline.scope(0.05):
+            with pytest.raises(deadline.DeadlineExceeded):
+                async with deadline.enforce():
+                    await slow()
+        assert cancelled
+        assert time.monotonic() - started < 1
+
+    asyncio.run(main())
+
+
+def test_enforce_raises_when_body_swallows_cancellation():
+    async def main():
+        with deadline.scope(0.05):
+            with pytest.raises(deadline.DeadlineExceeded):
+                async with deadline.enforce():
+                    try:
+                        await asyncio.sleep(10)
+                    except asyncio.CancelledError:
+                        pass
+
+    asyncio.run(main())
+
+
+def test_enforce_passes_through_without_deadline_or_in_time():
+    async def main():
+        async with deadline.enforce():
+            await asyncio.sleep(0.01)
+        with deadline.scope(1.0):
+            async with deadline.enforce():
+                await asyncio.sleep(0.01)
+        # 截止时间之前完成后计时器已取消，之后的等待不受影响
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+
+
+def test_enforce_keeps_outside_cancellation():
+    async def main():
+        async def body():
+            with deadline.scope(1.0):
+                async with deadline.enforce():
+                    await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(body())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+
+def test_iterate_raises_when_next_item_is_late():
+    async def main():
+        async def items():
+            yield 1
+            await asyncio.sleep(10)
+            yield 2
+
+        received = []
+        with deadline.scope(0.05):
+            with pytest.raises(deadline.DeadlineExceeded):
+                async for item in deadline.iterate(items()):
+                    received.append(item)
+        assert received == [1]
+
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import deadline
+from http_clients import http_clients
+from llm_client import CircuitBreaker, CircuitOpenError, HedgePolicy, LLMClient, PrioritySemaphore, TokenBucket
+
+UPSTREAM = 'test-llm'
+
+
+@pytest.fixture
+def upstream():
+    """用 MockTransport 模拟上游，delay 为每次请求的响应延迟"""
+    state = {'delay': 0.0, 'requests': 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state['requests'] += 1
+        await asyncio.sleep(state['delay'])
+        return httpx.Response(200, json={"result": "ok"})
+
+    http_clients._clients[UPSTREAM] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    yield state
+    del http_clients._clients[UPSTREAM]
+
+
+def half_open_client() -> LLMClient:
+    """熔断器已打开且冷却结束的客户端：下一个请求就是半开状态下的探测请求"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    return LLMClient('http://llm.test/', {}, upstream=UPSTREAM, rate=0, max_retries=0, breaker=breaker)
+
+
+def test_probe_released_after_deadline(upstream):
+    async def main():
+        client = half_open_client()
+        upstream['delay'] = 0.5
+        with deadline.scope(0.05):
+            with pytest.raises(deadline.DeadlineExceeded):
+                async with deadline.enforce():
+                    await client.complete({})
+        assert client.breaker.state == CircuitBreaker.HALF_OPEN
+        upstream['delay'] = 0.0
+        assert await client.complete({}) == {"result": "ok"}
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_probe_released_after_cancel(upstream):
+    async def main():
+        client = half_open_client()
+        upstream['delay'] = 0.5
+        task = asyncio.ensure_future(client.complete({}))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        upstream['delay'] = 0.0
+        assert await client.complete({}) == {"result": "ok"}
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_expired_request_does_not_take_probe(upstream):
+    async def main():
+        client = half_open_client()
+        with deadline.scope(0.0):
+            with pytest.raises(deadline.DeadlineExceeded):
+                await client.complete({})
+        assert upstream['requests'] == 0
+        assert client.rejected == 0
+        assert await client.complete({}) == {"result": "ok"}
+
+    asyncio.run(main())
+
+
+def test_probe_released_when_stream_consumer_raises(upstream):
+    async def main():
+        client = half_open_client()
+        with pytest.raises(ValueError):
+            async with client.stream({}):
+                raise ValueError("consumer failed")
+        async with client.stream({}) as response:
+            assert response.status_code == 200
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_half_open_allows_single_probe(upstream):
+    async def main():
+        client = half_open_client()
+        upstream['delay'] = 0.1
+        probe = asyncio.ensure_future(client.complete({}))
+        await asyncio.sleep(0.02)
+        with pytest.raises(CircuitOpenError):
+            await client.complete({})
+        assert await probe == {"result": "ok"}
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(main())
+
+
+def test_token_bucket_created_outside_event_loop():
+    # 与服务相同，在事件循环之外创建（Python 3.9 下锁会绑定到创建时的事件循环）
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    async def main():
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(5)))
+        return time.monotonic() - started
+
+    # 第一个令牌来自容量，其余4个按每秒50个补充
+    assert asyncio.run(main()) >= 0.07
+
+
+def test_priority_semaphore_wakes_highest_priority_first():
+    async def main():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire(0)
+        order = []
+
+        async def waiter(priority: int):
+            await semaphore.acquire(priority)
+            order.append(priority)
+            semaphore.release()
+
+        tasks = [asyncio.ensure_future(waiter(priority)) for priority in (10, 5, 0)]
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == [0, 5, 10]
+
+
+def test_priority_semaphore_cancelled_waiter_returns_slot():
+    async def main():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire(0)
+        waiter = asyncio.ensure_future(semaphore.acquire(0))
+        await asyncio.sleep(0)
+        # 名额已交给等待者，但它在恢复运行前被取消
+        semaphore.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(semaphore.acquire(0), 0.1)
+
+    asyncio.run(main())
+
+
+def test_hedge_threshold_uses_percentile_after_min_samples():
+    hedge = HedgePolicy('fast-model', delay=3.0, percentile=90.0, min_samples=10)
+    for latency in range(9):
+        hedge.observe(float(latency))
+    assert hedge.threshold() == 3.0
+    hedge.observe(9.0)
+    assert hedge.threshold() == 9.0
@@ -0,0 +1,52 @@
+from segment_parser import JSONObjectStream, SegmentStreamParser, parse_json_object, parse_segments
+
+
+def test_repairs_common_model_output_problems():
+    content = (
+        '好的，以下是分析结果：\n```json\n[\n'
+        '  {“start_time”： 0， "end_time": "2:00", \'content\': "开头\n介绍", "summary": "概述",},\n'
+        '  {"start_time": "120秒", "end_time": 300.5, "content": "正文", "summary": null},\n'
+        ']\n```\n以上。'
+    )
+    assert parse_segments(content) == [
+        {"start_time": 0, "end_time": 120, "content": "开头\n介绍", "summary": "概述"},
+        {"start_time": 120, "end_time": 300, "content": "正文", "summary": ""},
+    ]
+
+
+def test_objects_are_emitted_as_soon_as_they_close():
+    parser = SegmentStreamParser()
+    content = '[{"start_time": 0, "end_time": 60, "content": "a"}, {"start_time": 60, "end_time": 90, "content": "b"}]'
+    emitted = [parser.feed(ch) for ch in content]
+    closed_at = [i for i, segments in enumerate(emitted) if segments]
+    assert closed_at == [content.index('}'), content.rindex('}')]
+    assert not parser.truncated
+
+
+def test_invalid_segments_are_skipped():
+    parser = SegmentStreamParser()
+    segments = parser.feed(
+        '[{"start_time": 10, "end_time": 5, "content": "倒序"},'
+        ' {"start_time": 0, "end_time": 5, "content": "  "},'
+        ' {"start_time": 0, "end_time": 5 "content": "缺逗号"},'
+        ' {"start_time": 0, "end_time": 5, "content": "有效"}]'
+    )
+    assert [segment["content"] for segment in segments] == ["有效"]
+    assert parser.parsed == 1
+    assert parser.invalid == 3
+
+
+def test_truncated_output():
+    parser = SegmentStreamParser()
+    segments = parser.feed('[{"start_time": 0, "end_time": 60, "content": "a"}, {"start_time": 60, "end')
+    assert len(segments) == 1
+    assert parser.truncated
+
+
+def test_brackets_in_preamble_are_not_the_array():
+    stream = JSONObjectStream()
+    assert stream.feed('参考[1]和[注]，结果如下：[{"a": 1}] 后面的 {"b": 2} 忽略') == [{"a": 1}]
+
+
+def test_parse_json_object_with_single_quotes():
+    assert parse_json_object("结果：{'answer': '他说\"好\"', 'video_id': 3}") == {"answer": '他说"好"', "video_id": 3}
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+from catalog import SegmentRecord, VideoRecord
+from snapshot import CatalogSnapshot, SnapshotError, open_snapshot, read_watermark, write_snapshot
+from transcripts import SOURCE_ANALYSIS, SOURCE_TRANSCRIPT
+
+UPDATED_AT = datetime(2024, 5, 1, 12, 30, 15, 250000)
+
+
+def make_video(video_id: int, title: str, segments) -> VideoRecord:
+    row = {
+        'id': video_id, 'you_tube_id': f"video{video_id:06d}", 'title': title, 'description': f"{title}的描述",
+        'thumbnail': None, 'duration': 600, 'updated_at': UPDATED_AT,
+    }
+    return VideoRecord(row, [
+        SegmentRecord({
+            'id': video_id * 100 + i, 'video_id': video_id, 'start_time': start, 'end_time': end,
+            'content': content, 'summary': None if i else '摘要', 'source': source, 'updated_at': UPDATED_AT,
+        })
+        for i, (start, end, content, source) in enumerate(segments)
+    ])
+
+
+def video_state(video: VideoRecord):
+    return (
+        video.as_row(), video.updated_at, video.signature,
+        [(segment.as_row(), segment.updated_at) for segment in video.segments],
+    )
+
+
+@pytest.fixture
+def videos():
+    return [
+        make_video(7, 'Python 入门', [(0, 120, '安装 Python', SOURCE_ANALYSIS), (120, 300, '变量和类型', SOURCE_ANALYSIS)]),
+        make_video(3, '量子力学', [(0, 60, '波函数', SOURCE_TRANSCRIPT)]),
+        make_video(12, '没有片段的视频', []),
+    ]
+
+
+def test_round_trip(tmp_path, videos):
+    path = str(tmp_path / 'catalog.snap')
+    watermark = datetime(2024, 5, 2, 8, 0, 0, 1)
+    result = write_snapshot(path, videos, watermark)
+    assert (result['videos'], result['segments']) == (3, 3)
+    assert read_watermark(path) == watermark
+
+    snapshot = open_snapshot(path)
+    assert snapshot.watermark == watermark
+    assert list(snapshot.video_ids) == [3, 7, 12]
+    by_id = {video.id: video for video in videos}
+    for record in snapshot.records():
+        assert video_state(record) == video_state(by_id[record.id])
+    assert snapshot.video_index(7) == 1
+    assert snapshot.video_index(8) is None
+    assert snapshot.youtube_id(1) == 'video000007'
+    assert snapshot.title(0) == '量子力学'
+
+
+def test_postings_point_at_documents(tmp_path, videos):
+    path = str(tmp_path / 'catalog.snap')
+    write_snapshot(path, videos, None)
+    snapshot = CatalogSnapshot(path)
+    # 中文按字符二元组分词
+    docs, tfs = snapshot.postings('函数')
+    assert len(docs) == 1 and tfs[0] >= 1
+    row = snapshot.result_row(int(docs[0]))
+    assert (row['id'], row['segment_id'], row['content']) == (3, 300, '波函数')
+    assert len(snapshot.postings('不存在的词')[0]) == 0
+
+
+def test_invalid_files_are_rejected(tmp_path, videos):
+    path = tmp_path / 'catalog.snap'
+    write_snapshot(str(path), videos, None)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(SnapshotError):
+        CatalogSnapshot(str(path))
+    assert open_snapshot(str(path)) is None
+
+    path.write_bytes(b'')
+    assert open_snapshot(str(path)) is None
+    assert open_snapshot(str(tmp_path / 'missing.snap')) is None
@@ -0,0 +1,256 @@
+import html
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Deque, Iterable, Iterator, List, Optional
+
+# 支持的字幕格式及其文件扩展名
+FORMATS = ('vtt', 'srt', 'xml')
+
+# video_segments.source：字幕分块由字幕写入替换，分析片段由分析结果写入方（Go服务、批量导入）替换，互不覆盖
+SOURCE_TRANSCRIPT = 'transcript'
+SOURCE_ANALYSIS = 'analysis'
+
+_VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+_TIMESTAMP_RE = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})')
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACE_RE = re.compile(r'\s+')
+
+
+class TranscriptError(ValueError):
+    """字幕文件无法解析"""
+
+
+@dataclass
+class Cue:
+    start: float
+    end: float
+    text: str
+
+
+@dataclass
+class TranscriptChunk:
+    start_time: int
+    end_time: int
+    content: str
+    summary: str = ''
+
+
+def is_valid_video_id(video_id: str) -> bool:
+    """视频ID会用作文件名，只允许字母、数字、- 和 _"""
+    return bool(_VIDEO_ID_RE.match(video_id))
+
+
+def detect_format(head: str) -> str:
+    """根据文件开头的内容判断字幕格式"""
+    head = head.lstrip('﻿ \t\r\n')
+    if head.startswith('WEBVTT'):
+        return 'vtt'
+    if head.startswith('<'):
+        return 'xml'
+    return 'srt'
+
+
+def find_transcript_file(directory: str, video_id: str) -> Optional[str]:
+    """在字幕目录中查找视频的字幕文件：{video_id}.vtt/.srt/.xml，或带语言后缀的 {video_id}.zh.vtt 等"""
+    if not is_valid_video_id(video_id) or not os.path.isdir(directory):
+        return None
+    for ext in FORMATS:
+        path = os.path.join(directory, f"{video_id}.{ext}")
+        if os.path.isfile(path):
+            return path
+    prefix = f"{video_id}."
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(prefix) and name.rsplit('.', 1)[-1] in FORMATS:
+            return os.path.join(directory, name)
+    return None
+
+
+def _clean_text(text: str) -> str:
+    return _SPACE_RE.sub(' ', html.unescape(_TAG_RE.sub('', text))).strip()
+
+
+def _parse_timestamp(value: str) -> float:
+    match = _TIMESTAMP_RE.search(value)
+    if not match:
+        raise TranscriptError(f"无法解析时间戳: {value!r}")
+    hours, minutes, seconds, millis = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, '0')) / 1000
+
+
+def parse_cue_blocks(lines: Iterable[str]) -> Iterator[Cue]:
+    """逐行解析 WebVTT 或 SRT 字幕
+
+    两种格式都由空行分隔的块组成，块中含 "-->" 的一行为时间轴，其后为文本。
+    YouTube 自动字幕是滚动显示的，每条的第一行重复上一条的最后一行，这里会去掉重复行。
+    """
+    block: List[str] = []
+    previous_last = None
+
+    def flush():
+        nonlocal previous_last
+        timing = next((i for i, line in enumerate(block) if '-->' in line), None)
+        if timing is None:
+            return None
+        start, _, end = block[timing].partition('-->')
+        lines = [_clean_text(line) for line in block[timing + 1:]]
+        lines = [line for line in lines if line]
+        if lines and lines[0] == previous_last:
+            lines = lines[1:]
+        if not lines:
+            return None
+        previous_last = lines[-1]
+        return Cue(_parse_timestamp(start), _parse_timestamp(end), ' '.join(lines))
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            block.append(line)
+            continue
+        if block:
+            cue = flush()
+            block = []
+            if cue is not None:
+                yield cue
+    if block:
+        cue = flush()
+        if cue is not None:
+            yield cue
+
+
+def parse_timedtext(source) -> Iterator[Cue]:
+    """增量解析 YouTube timedtext XML（<text start dur> 或 format 3 的 <p t d>）"""
+    try:
+        context = ET.iterparse(source, events=('start', 'end'))
+        root = None
+        for event, element in context:
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            if element.tag == 'text' and 'start' in element.attrib:
+                start = float(element.get('start'))
+                end = start + float(element.get('dur', 0))
+            elif element.tag == 'p' and 't' in element.attrib:
+                start = int(element.get('t')) / 1000
+                end = start + int(element.get('d', 0)) / 1000
+            else:
+                continue
+            # 旧版接口的文本经过两次转义
+            text = _clean_text(html.unescape(''.join(element.itertext())))
+            # 释放已处理的元素，避免整棵树驻留内存
+            element.clear()
+            if root is not None:
+                root.clear()
+            if text:
+                yield Cue(start, end, text)
+    except ET.ParseError as e:
+        raise TranscriptError(f"字幕XML解析失败: {e}") from e
+
+
+def iter_cues(path: str, fmt: Optional[str] = None) -> Iterator[Cue]:
+    """流式读取字幕文件，格式未指定时根据扩展名或内容判断"""
+    if fmt is None:
+        ext = path.rsplit('.', 1)[-1].lower()
+        if ext in FORMATS:
+            fmt = ext
+        else:
+            with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+                fmt = detect_format(f.read(64))
+    if fmt == 'xml':
+        with open(path, 'rb') as f:
+            yield from parse_timedtext(f)
+    else:
+        with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+            yield from parse_cue_blocks(f)
+
+
+def _make_chunk(cues: Iterable[Cue]) -> TranscriptChunk:
+    cues = list(cues)
+    return TranscriptChunk(
+        start_time=int(cues[0].start),
+        end_time=int(math.ceil(max(cue.end for cue in cues))),
+        content=' '.join(cue.text for cue in cues),
+    )
+
+
+def chunk_cues(cues: Iterable[Cue], window: float = 60.0, stride: float = 45.0) -> Iterator[TranscriptChunk]:
+    """把字幕合并为按时间对齐、相互重叠的窗口
+
+    窗口长 window 秒、每 stride 秒一个，字幕按开始时间归入窗口；
+    只缓存当前窗口内的字幕，没有新字幕的窗口（与上一个窗口内容相同）不会重复输出。
+    """
+    if window <= 0 or stride <= 0:
+        raise ValueError("window 和 stride 必须大于0")
+    buffer: Deque[Cue] = deque()
+    window_start = None
+    last_emitted = None
+
+    def emit():
+        nonlocal last_emitted
+        if buffer and buffer[-1] is not last_emitted:
+            last_emitted = buffer[-1]
+            return _make_chunk(buffer)
+        return None
+
+    for cue in cues:
+        if window_start is None:
+            window_start = math.floor(cue.start / stride) * stride
+        while cue.start >= window_start + window:
+            chunk = emit()
+            if chunk is not None:
+                yield chunk
+            window_start += stride
+            while buffer and buffer[0].start < window_start:
+                buffer.popleft()
+            if not buffer:
+                # 跳过字幕的空白段，直接移到从当前字幕处开始的窗口
+                window_start = max(window_start, math.floor(cue.start / stride) * stride)
+        buffer.append(cue)
+
+    chunk = emit()
+    if chunk is not None:
+        yield chunk
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def store_transcript_segments(database, video_id: int, chunks: Iterable[TranscriptChunk],
+                                    batch_size: int = 500) -> int:
+    """在一个事务中用字幕分块替换视频的字幕片段（source 为 transcript），返回写入的片段数
+
+    分析生成的片段不受影响。分块在数据库线程中边解析边分批写入，解析失败时整个事务回滚。
+    """
+    def write(cursor) -> int:
+        now = datetime.now()
+        cursor.execute(
+            "DELETE FROM video_segments WHERE video_id = %s AND source = %s", (video_id, SOURCE_TRANSCRIPT)
+        )
+        count = 0
+        for batch in _batched(chunks, batch_size):
+            cursor.executemany(
+                "INSERT INTO video_segments"
+                " (video_id, start_time, end_time, content, summary, source, created_at, updated_at)"
+                " VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                [(video_id, chunk.start_time, chunk.end_time, chunk.content, chunk.summary, SOURCE_TRANSCRIPT, now, now)
+                 for chunk in batch]
+            )
+            count += len(batch)
+        # 更新视频的时间戳，让目录刷新时发现变化
+        cursor.execute("UPDATE videos SET updated_at = %s WHERE id = %s", (now, video_id))
+        return count
+
+    return await database.run_in_transaction(write)
@@ -0,0 +1,247 @@
+import importlib
+import json
+import math
+import os
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from search_index import tokenize
+
+
+class HashingEmbedder:
+    """哈希TF向量：无需训练、可在本地计算，词语经CRC32哈希到固定维度"""
+
+    # 查询时按桶的文档频率加权（即TF-IDF）
+    uses_idf = True
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts: Dict[int, float] = {}
+            for token in tokenize(text):
+                h = zlib.crc32(token.encode('utf-8'))
+                bucket = h % self.dim
+                sign = 1.0 if (h >> 31) & 1 else -1.0
+                counts[bucket] = counts.get(bucket, 0.0) + sign
+            for bucket, value in counts.items():
+                # 次线性TF
+                vectors[i, bucket] = math.copysign(1.0 + math.log(abs(value)), value) if value else 0.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+def load_embedder(spec: Optional[str], dim: int = 1024):
+    """加载向量化模型，spec 形如 "module:factory"，为空时使用哈希向量"""
+    if not spec:
+        return HashingEmbedder(dim)
+    module_name, _, attr = spec.partition(':')
+    factory: Callable = getattr(importlib.import_module(module_name), attr)
+    return factory()
+
+
+class VectorIndex:
+    """片段语义检索：向量存放在连续的 float32 矩阵中，一次矩阵乘法完成批量检索
+
+    向量分为两块：load() 得到的只读内存映射矩阵（前 _base 行），和内存中的追加块（其后的行）。
+    追加不会复制内存映射的矩阵，两块在压缩时合并，保存时依次写入同一个文件。
+    """
+
+    def __init__(self, embedder=None, initial_capacity: int = 1024):
+        self.embedder = embedder or HashingEmbedder()
+        self.dim = self.embedder.dim
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._base = 0
+        self._tail = np.zeros((initial_capacity, self.dim), dtype=np.float32)
+        self._alive = np.zeros(initial_capacity, dtype=bool)
+        self._size = 0
+        self._rows: List[Optional[Dict]] = []
+        self._video_slots: Dict[int, List[int]] = {}
+        self._video_signatures: Dict[int, str] = {}
+        # 每个维度上非零的存活行数，用于计算IDF
+        self._df = np.zeros(self.dim, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return int(self._alive[:self._size].sum())
+
+    def replace_video(self, video_id: int, rows: List[Dict], texts: List[str], signature: Optional[str] = None):
+        """替换某个视频的全部片段向量；签名未变化时跳过"""
+        if signature is not None and self._video_signatures.get(video_id) == signature:
+            return
+        self.remove_video(video_id)
+        self.append(video_id, rows, texts)
+        if signature is not None:
+            self._video_signatures[video_id] = signature
+
+    def append(self, video_id: int, rows: List[Dict], texts: List[str]):
+        """追加片段向量"""
+        if not rows:
+            return
+        vectors = self.embedder.embed(texts).astype(np.float32, copy=False)
+        start = self._size
+        self._reserve(start + len(rows))
+        self._tail[start - self._base:start - self._base + len(rows)] = vectors
+        self._alive[start:start + len(rows)] = True
+        self._size += len(rows)
+        self._rows.extend(rows)
+        self._video_slots.setdefault(video_id, []).extend(range(start, start + len(rows)))
+        self._df += (vectors != 0).sum(axis=0)
+        # 手动追加的行会在下次刷新时被替换
+        self._video_signatures.pop(video_id, None)
+
+    def video_ids(self) -> List[int]:
+        return list(self._video_slots)
+
+    def remove_video(self, video_id: int):
+        slots = self._video_slots.pop(video_id, None)
+        self._video_signatures.pop(video_id, None)
+        if not slots:
+            return
+        self._df -= (self._take(slots) != 0).sum(axis=0)
+        self._alive[slots] = False
+        for slot in slots:
+            self._rows[slot] = None
+        # 删除的行超过一半时压缩矩阵
+        if self._size and len(self) < self._size // 2:
+            self._compact()
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        return [row for _, row in self.search_batch([query], top_k)[0]]
+
+    def search_batch(self, queries: Sequence[str], top_k: int = 5) -> List[List[Tuple[float, Dict]]]:
+        """批量检索，返回每个查询的（得分, 行数据）列表"""
+        if not queries:
+            return []
+        if not self._size or top_k <= 0:
+            return [[] for _ in queries]
+        q = self.embedder.embed(queries).astype(np.float32, copy=False)
+        if getattr(self.embedder, 'uses_idf', False):
+            n_docs = max(len(self), 1)
+            q = q * np.log1p(n_docs / (1.0 + self._df))
+        scores = np.empty((len(queries), self._size), dtype=np.float32)
+        if self._base:
+            scores[:, :self._base] = q @ self._matrix.T
+        if self._size > self._base:
+            scores[:, self._base:] = q @ self._tail[:self._size - self._base].T
+        scores[:, ~self._alive[:self._size]] = -np.inf
+
+        k = min(top_k, self._size)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for i in range(len(queries)):
+            order = top[i][np.argsort(-scores[i, top[i]])]
+            results.append([
+                (float(scores[i, slot]), self._rows[slot])
+                for slot in order
+                if scores[i, slot] > 0
+            ])
+        return results
+
+    def save(self, path: str):
+        """将向量矩阵和元数据写入磁盘（原子替换）"""
+        self._compact()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 多个worker可能同时保存，临时文件按进程区分
+        tmp_matrix = f"{path}.npy.{os.getpid()}.tmp"
+        with open(tmp_matrix, 'wb') as f:
+            # 两块依次写入，不在内存中拼接内存映射的矩阵
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                'fortran_order': False,
+                'shape': (self._size, self.dim),
+            })
+            self._matrix[:self._base].tofile(f)
+            self._tail[:self._size - self._base].tofile(f)
+        meta = {
+            'dim': self.dim,
+            'rows': self._rows[:self._size],
+            'video_slots': {str(k): v for k, v in self._video_slots.items()},
+            'video_signatures': {str(k): v for k, v in self._video_signatures.items()},
+        }
+        tmp_meta = f"{path}.json.{os.getpid()}.tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, default=str)
+        os.replace(tmp_matrix, f"{path}.npy")
+        os.replace(tmp_meta, f"{path}.json")
+
+    def load(self, path: str) -> bool:
+        """以内存映射方式加载向量矩阵，多个worker共享同一份页缓存"""
+        try:
+            with open(f"{path}.json", encoding='utf-8') as f:
+                meta = json.load(f)
+            matrix = np.load(f"{path}.npy", mmap_mode='r')
+        except FileNotFoundError:
+            # 首次启动时还没有保存过
+            return False
+        except (OSError, ValueError) as e:
+            print(f"加载向量索引失败: {e}")
+            return False
+        if meta['dim'] != self.dim or matrix.shape[0] != len(meta['rows']):
+            print("向量索引文件与当前配置不一致，忽略")
+            return False
+        self._matrix = matrix
+        self._base = self._size = matrix.shape[0]
+        self._tail = np.zeros((0, self.dim), dtype=np.float32)
+        self._alive = np.ones(self._size, dtype=bool)
+        self._rows = meta['rows']
+        self._video_slots = {int(k): v for k, v in meta['video_slots'].items()}
+        self._video_signatures = {int(k): v for k, v in meta['video_signatures'].items()}
+        self._df = (matrix != 0).sum(axis=0).astype(np.float32)
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "rows": len(self),
+            "capacity": self._base + int(self._tail.shape[0]),
+            "appended_rows": self._size - self._base,
+            "dim": self.dim,
+            "memory_mapped": isinstance(self._matrix, np.memmap),
+        }
+
+    def _reserve(self, size: int):
+        """确保追加块和存活标记能容纳 size 行（内存映射的矩阵保持不变）"""
+        capacity = self._tail.shape[0]
+        if size - self._base > capacity:
+            tail = np.zeros((max(size - self._base, capacity * 2, 1024), self.dim), dtype=np.float32)
+            tail[:self._size - self._base] = self._tail[:self._size - self._base]
+            self._tail = tail
+        if size > len(self._alive):
+            alive = np.zeros(max(size, len(self._alive) * 2, 1024), dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._alive = alive
+
+    def _take(self, slots: Sequence[int]) -> np.ndarray:
+        """按行号取出向量，行可能在内存映射的矩阵或追加块中"""
+        slots = np.asarray(slots, dtype=np.int64)
+        vectors = np.empty((len(slots), self.dim), dtype=np.float32)
+        in_base = slots < self._base
+        vectors[in_base] = self._matrix[slots[in_base]]
+        vectors[~in_base] = self._tail[slots[~in_base] - self._base]
+        return vectors
+
+    def _compact(self):
+        alive_slots = np.flatnonzero(self._alive[:self._size])
+        if len(alive_slots) == self._size:
+            return
+        remap = {int(old): new for new, old in enumerate(alive_slots)}
+        capacity = max(len(alive_slots), 1024)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:len(alive_slots)] = self._take(alive_slots)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(alive_slots)] = True
+        self._rows = [self._rows[int(slot)] for slot in alive_slots]
+        self._video_slots = {
+            video_id: [remap[slot] for slot in slots]
+            for video_id, slots in self._video_slots.items()
+        }
+        # 压缩后所有行都在内存中，合并为追加块
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._base = 0
+        self._tail, self._alive, self._size = matrix, alive, len(alive_slots)
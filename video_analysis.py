@@ -0,0 +1,223 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Sequence
+
+import metrics
+from analysis_cache import mark_partial
+from context_builder import estimate_tokens, truncate_to_tokens
+from segment_parser import parse_segments
+from transcripts import TranscriptChunk
+
+CHUNK_FAILURES_TOTAL = metrics.counter(
+    'ytchat_analysis_chunk_failures_total', '长视频分块分析中失败的请求数', ('step',)
+)
+
+_SEGMENT_FORMAT = """输出格式为JSON数组：
+[
+  {
+    "start_time": 0,
+    "end_time": 300,
+    "content": "片段内容描述",
+    "summary": "片段详细摘要"
+  },
+  ...
+]"""
+
+
+def normalize_segments(items: Sequence, start: int, end: int) -> List[Dict]:
+    """过滤无效片段，并把时间限制在 [start, end] 范围内"""
+    segments = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('content'):
+            continue
+        try:
+            segment_start = min(max(int(item.get('start_time', start)), start), end)
+            segment_end = min(max(int(item.get('end_time', end)), segment_start), end)
+        except (TypeError, ValueError):
+            continue
+        segments.append({
+            'start_time': segment_start,
+            'end_time': segment_end,
+            'content': str(item['content']),
+            'summary': str(item.get('summary') or ''),
+        })
+    return sorted(segments, key=lambda segment: segment['start_time'])
+
+
+def merge_segments(segments: List[Dict], target: int) -> List[Dict]:
+    """不经过模型，把相邻片段两两合并到不超过 target 个（合并总时长最短的一对）"""
+    merged = sorted(segments, key=lambda segment: segment['start_time'])
+    while len(merged) > max(1, target):
+        i = min(range(len(merged) - 1),
+                key=lambda k: merged[k + 1]['end_time'] - merged[k]['start_time'])
+        left, right = merged[i], merged[i + 1]
+        merged[i:i + 2] = [{
+            'start_time': left['start_time'],
+            'end_time': max(left['end_time'], right['end_time']),
+            'content': f"{left['content']}；{right['content']}",
+            'summary': f"{left['summary']}{right['summary']}",
+        }]
+    return merged
+
+
+def _segment_line(segment: Dict) -> str:
+    return f"[{segment['start_time']}-{segment['end_time']}秒] {segment['content']}：{segment['summary']}"
+
+
+class MapReduceAnalyzer:
+    """长视频的分层分析：按时间分块并发生成局部片段（map），再合并为最终片段（reduce）
+
+    complete(prompt) 发送一次分析请求并返回模型输出的文本，失败时抛出异常。
+    单个分块失败只丢弃该分块；合并失败时不经过模型直接合并局部片段。
+    """
+
+    def __init__(
+        self,
+        complete: Callable[[str], Awaitable[str]],
+        concurrency: int = 4,
+        chunk_tokens: int = 2500,
+        reduce_tokens: int = 3000,
+        min_segments: int = 5,
+        max_segments: int = 10,
+    ):
+        self.complete = complete
+        self.concurrency = concurrency
+        self.chunk_tokens = chunk_tokens
+        self.reduce_tokens = reduce_tokens
+        self.min_segments = min_segments
+        self.max_segments = max_segments
+        self.videos = 0
+        self.chunks = 0
+        self.chunk_failures = 0
+        self.reduce_failures = 0
+
+    async def analyze(self, title: str, duration: int, chunks: List[TranscriptChunk]) -> List[Dict]:
+        """分析视频字幕，返回 min_segments 到 max_segments 个片段；所有分块都失败时抛出 RuntimeError"""
+        self.videos += 1
+        if not chunks:
+            raise RuntimeError("没有可分析的字幕")
+        duration = duration or max(chunk.end_time for chunk in chunks)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        if len(chunks) == 1:
+            # 短视频一次完成，不需要合并
+            chunk = chunks[0]
+            segments = await self._map(semaphore, title, chunk.content, 0, duration,
+                                       f"{self.min_segments}-{self.max_segments}")
+            if not segments:
+                raise RuntimeError("字幕分析失败")
+            return merge_segments(segments, self.max_segments)
+
+        with metrics.stage('analysis_map'):
+            results = await asyncio.gather(*(
+                self._map(semaphore, title, chunk.content, chunk.start_time, chunk.end_time, "1-3")
+                for chunk in chunks
+            ))
+        partials = [segment for segments in results for segment in segments]
+        if not partials:
+            raise RuntimeError("所有字幕分块分析均失败")
+
+        with metrics.stage('analysis_reduce'):
+            segments = await self._reduce(semaphore, title, duration, partials)
+        failed = sum(1 for chunk_segments in results if not chunk_segments)
+        if failed:
+            # 部分分块没有结果，片段缺少这些时间段的内容
+            print(f"字幕分析不完整：{failed}/{len(chunks)} 个分块失败")
+            mark_partial(segments)
+        return segments
+
+    def stats(self) -> Dict:
+        return {
+            "videos": self.videos,
+            "chunks": self.chunks,
+            "chunk_failures": self.chunk_failures,
+            "reduce_failures": self.reduce_failures,
+            "concurrency": self.concurrency,
+        }
+
+    async def _map(self, semaphore: asyncio.Semaphore, title: str, text: str,
+                   start: int, end: int, count: str) -> List[Dict]:
+        prompt = f"""你是一个专业的视频内容分析助手。以下是视频《{title}》第{start}秒到第{end}秒之间的字幕。
+
+{truncate_to_tokens(text, self.chunk_tokens)}
+
+请把这部分内容分成{count}个有意义的时间片段，时间必须在{start}到{end}秒之间，每个片段包含：
+1. 开始时间（秒）
+2. 结束时间（秒）
+3. 片段内容描述
+4. 片段摘要
+
+{_SEGMENT_FORMAT}"""
+        self.chunks += 1
+        async with semaphore:
+            try:
+                content = await self.complete(prompt)
+            except Exception as e:
+                print(f"字幕分块分析失败（{start}-{end}秒）: {e}")
+                self.chunk_failures += 1
+                CHUNK_FAILURES_TOTAL.inc(step='map')
+                return []
+        items = parse_segments(content)
+        if not items:
+            self.chunk_failures += 1
+            CHUNK_FAILURES_TOTAL.inc(step='map')
+            return []
+        return normalize_segments(items, start, end)
+
+    async def _reduce(self, semaphore: asyncio.Semaphore, title: str, duration: int,
+                      partials: List[Dict]) -> List[Dict]:
+        # 局部片段过多时分组逐层合并，直到能放进一次请求
+        while estimate_tokens('\n'.join(map(_segment_line, partials))) > self.reduce_tokens:
+            groups = self._split(partials)
+            if len(groups) == 1:
+                break
+            results = await asyncio.gather(*(
+                self._merge(semaphore, title, group, group[0]['start_time'],
+                            max(segment['end_time'] for segment in group), "2-4")
+                for group in groups
+            ))
+            reduced = [segment for segments in results for segment in segments]
+            if len(reduced) >= len(partials):
+                break
+            partials = reduced
+
+        if len(partials) <= self.min_segments:
+            return partials
+        return await self._merge(semaphore, title, partials, 0, duration,
+                                 f"{self.min_segments}-{self.max_segments}")
+
+    async def _merge(self, semaphore: asyncio.Semaphore, title: str, segments: List[Dict],
+                     start: int, end: int, count: str) -> List[Dict]:
+        target = int(count.split('-')[1])
+        lines = '\n'.join(_segment_line(segment) for segment in segments)
+        prompt = f"""你是一个专业的视频内容分析助手。以下是视频《{title}》第{start}秒到第{end}秒之间各部分的分析结果，每行一个片段：
+
+{lines}
+
+请把它们合并为{count}个连贯、有意义的时间片段，覆盖第{start}秒到第{end}秒，每个片段包含开始时间（秒）、结束时间（秒）、片段内容描述和片段摘要。
+
+{_SEGMENT_FORMAT}"""
+        async with semaphore:
+            try:
+                content = await self.complete(prompt)
+            except Exception as e:
+                print(f"合并分析结果失败（{start}-{end}秒）: {e}")
+                content = ''
+        merged = normalize_segments(parse_segments(content), start, end)
+        if not merged:
+            self.reduce_failures += 1
+            CHUNK_FAILURES_TOTAL.inc(step='reduce')
+            # 按时间直接拼接，没有经过模型合并
+            return mark_partial(merge_segments(segments, target))
+        return merge_segments(merged, target)
+
+    def _split(self, segments: List[Dict]) -> List[List[Dict]]:
+        groups: List[List[Dict]] = [[]]
+        used = 0
+        for segment in segments:
+            cost = estimate_tokens(_segment_line(segment))
+            if groups[-1] and used + cost > self.reduce_tokens:
+                groups.append([])
+                used = 0
+            groups[-1].append(segment)
+            used += cost
+        return groups
@@ -1,8 +1,13 @@
+import asyncio
+import json
 import os
 import re
-import httpx
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Union
+from dataclasses import asdict, dataclass
+from cache import SingleFlight, TTLCache
+from http_clients import http_clients
+from shared_cache import SharedCache
+from transcripts import TranscriptChunk, chunk_cues, find_transcript_file, iter_cues
 
 @dataclass
 class YouTubeVideoInfo:
@@ -14,55 +19,215 @@ class YouTubeVideoInfo:
     view_count: int
     like_count: int
 
+# videos.list 单次请求最多支持的视频ID数
+MAX_IDS_PER_REQUEST = 50
+
+# 视频信息在共享缓存中的命名空间
+VIDEO_INFO_NAMESPACE = 'video_info'
+
+_DURATION_RE = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+
+class VideoNotFoundError(ValueError):
+    """YouTube上不存在该视频"""
+
 class YouTubeService:
     def __init__(self):
         # 这里可以配置YouTube Data API密钥
         self.api_key = os.getenv('YOUTUBE_API_KEY', '')
-        self.base_url = 'https://www.googleapis.com/youtube/v3'
+        self.base_url = os.getenv('YOUTUBE_API_BASE_URL', 'https://www.googleapis.com/youtube/v3')
+        # 视频信息缓存：不存在的视频使用较短的过期时间（负缓存）
+        self.negative_ttl = float(os.getenv('YOUTUBE_NEGATIVE_CACHE_TTL', '300'))
+        self._cache = TTLCache(
+            maxsize=int(os.getenv('YOUTUBE_CACHE_SIZE', '2048')),
+            ttl=float(os.getenv('YOUTUBE_CACHE_TTL', '3600')),
+        )
+        self._inflight = SingleFlight()
+        # 多worker部署时的共享缓存，由 use_shared_cache 设置
+        self._shared: Optional[SharedCache] = None
+        # 批量获取时同时进行的 videos.list 请求数
+        self.batch_concurrency = int(os.getenv('YOUTUBE_BATCH_CONCURRENCY', '4'))
+        # 字幕文件目录（{video_id}.vtt/.srt/.xml），以及字幕分块的窗口长度和步长（秒）
+        self.transcript_dir = os.getenv('TRANSCRIPT_DIR', 'data/transcripts')
+        self.transcript_window = float(os.getenv('TRANSCRIPT_WINDOW', '60'))
+        self.transcript_stride = float(os.getenv('TRANSCRIPT_STRIDE', '45'))
     
     async def get_video_info(self, video_id: str) -> YouTubeVideoInfo:
-        """获取YouTube视频信息"""
+        """获取YouTube视频信息（带缓存，并发的相同请求只调用一次API）"""
         if not self.api_key:
             # 如果没有API密钥，返回模拟数据
             return self._get_mock_video_info(video_id)
         
+        info = await self._lookup(video_id)
+        if isinstance(info, VideoNotFoundError):
+            return self._get_mock_video_info(video_id)
+        if info is not None:
+            return info
+        return await self._inflight.do(video_id, lambda: self._fetch_video_info(video_id))
+    
+    def use_shared_cache(self, cache: SharedCache):
+        """视频信息同时保存到跨进程的共享缓存，其他worker的更新和失效会同步到本进程"""
+        self._shared = cache
+        cache.add_listener(VIDEO_INFO_NAMESPACE, self._on_invalidate)
+    
+    async def invalidate(self, video_id: str):
+        """丢弃视频信息缓存（包括其他worker中的）"""
+        self._cache.invalidate(video_id)
+        if self._shared is not None:
+            await self._shared.invalidate(VIDEO_INFO_NAMESPACE, video_id)
+    
+    async def _lookup(self, video_id: str) -> Union[YouTubeVideoInfo, VideoNotFoundError, None]:
+        """依次查找进程内缓存和共享缓存"""
+        info = self._cache.get(video_id)
+        if info is not None or self._shared is None:
+            return info
+        value = await self._shared.get(VIDEO_INFO_NAMESPACE, video_id)
+        if value is None:
+            return None
+        data = json.loads(value)
+        if 'missing' in data:
+            info = VideoNotFoundError(data['missing'])
+            self._cache.set(video_id, info, ttl=self.negative_ttl)
+        else:
+            info = YouTubeVideoInfo(**data)
+            self._cache.set(video_id, info)
+        return info
+    
+    async def _remember(self, video_id: str, info: Union[YouTubeVideoInfo, VideoNotFoundError]):
+        """写入进程内缓存和共享缓存，不存在的视频使用负缓存过期时间"""
+        if isinstance(info, VideoNotFoundError):
+            ttl, value = self.negative_ttl, {'missing': str(info)}
+        else:
+            ttl, value = self._cache.ttl, asdict(info)
+        self._cache.set(video_id, info, ttl=ttl)
+        if self._shared is not None:
+            await self._shared.set(VIDEO_INFO_NAMESPACE, video_id, json.dumps(value, ensure_ascii=False), ttl)
+    
+    def _on_invalidate(self, video_id: Optional[str]):
+        if video_id is None:
+            self._cache.clear()
+        else:
+            self._cache.invalidate(video_id)
+    
+    async def get_videos_info(self, video_ids: List[str]) -> Dict[str, Union[YouTubeVideoInfo, Exception]]:
+        """批量获取视频信息，返回每个视频ID对应的信息或错误"""
+        video_ids = list(dict.fromkeys(video_ids))
+        if not self.api_key:
+            return {video_id: self._get_mock_video_info(video_id) for video_id in video_ids}
+        
+        results: Dict[str, Union[YouTubeVideoInfo, Exception]] = {}
+        missing = []
+        for video_id in video_ids:
+            info = await self._lookup(video_id)
+            if info is None:
+                missing.append(video_id)
+            else:
+                results[video_id] = info
+        
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def fetch_chunk(chunk: List[str]):
+            async with semaphore:
+                try:
+                    results.update(await self._fetch_videos_chunk(chunk))
+                except Exception as e:
+                    print(f"批量获取YouTube视频信息失败: {e}")
+                    for video_id in chunk:
+                        results[video_id] = e
+        
+        chunks = [missing[i:i + MAX_IDS_PER_REQUEST] for i in range(0, len(missing), MAX_IDS_PER_REQUEST)]
+        await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+        return {video_id: results[video_id] for video_id in video_ids}
+    
+    async def _fetch_videos_chunk(self, video_ids: List[str]) -> Dict[str, Union[YouTubeVideoInfo, Exception]]:
+        """一次 videos.list 请求获取最多50个视频"""
+        client = http_clients.get('youtube')
+        params = {
+            'part': 'snippet,statistics,contentDetails',
+            'id': ','.join(video_ids),
+            'maxResults': MAX_IDS_PER_REQUEST,
+            'key': self.api_key
+        }
+        response = await client.get(f"{self.base_url}/videos", params=params)
+        data = response.json()
+        if 'error' in data:
+            raise RuntimeError(data['error'].get('message', str(data['error'])))
+        
+        results: Dict[str, Union[YouTubeVideoInfo, Exception]] = {}
+        for item in data.get('items', []):
+            video_id = item.get('id') if isinstance(item, dict) else None
+            if video_id is None:
+                # 无法对应到视频ID的条目忽略，对应的视频按不存在处理
+                print(f"YouTube返回的视频条目缺少ID: {str(item)[:200]}")
+                continue
+            try:
+                info = self._parse_video_item(item)
+            except (KeyError, TypeError, ValueError) as e:
+                # 单个条目格式异常只影响该视频，不缓存，下次请求时重试
+                print(f"解析视频信息失败 {video_id}: {e!r}")
+                results[video_id] = RuntimeError(f"解析视频 {video_id} 的信息失败: {e!r}")
+                continue
+            await self._remember(video_id, info)
+            results[video_id] = info
+        for video_id in video_ids:
+            if video_id not in results:
+                error = VideoNotFoundError(f"视频 {video_id} 不存在")
+                await self._remember(video_id, error)
+                results[video_id] = error
+        return results
+    
+    def cache_stats(self) -> Dict:
+        """视频信息缓存统计"""
+        return {**self._cache.stats(), "singleflight": self._inflight.stats()}
+    
+    async def _fetch_video_info(self, video_id: str) -> YouTubeVideoInfo:
         try:
-            async with httpx.AsyncClient() as client:
-                url = f"{self.base_url}/videos"
-                params = {
-                    'part': 'snippet,statistics,contentDetails',
-                    'id': video_id,
-                    'key': self.api_key
-                }
-                
-                response = await client.get(url, params=params)
-                data = response.json()
-                
-                if 'items' not in data or not data['items']:
-                    raise ValueError(f"视频 {video_id} 不存在")
-                
-                item = data['items'][0]
-                snippet = item['snippet']
-                statistics = item['statistics']
-                content_details = item['contentDetails']
-                
-                # 解析时长
-                duration = self._parse_duration(content_details['duration'])
-                
-                return YouTubeVideoInfo(
-                    title=snippet['title'],
-                    description=snippet['description'],
-                    thumbnail=snippet['thumbnails']['high']['url'],
-                    duration=duration,
-                    channel_title=snippet['channelTitle'],
-                    view_count=int(statistics.get('viewCount', 0)),
-                    like_count=int(statistics.get('likeCount', 0))
-                )
-                
+            client = http_clients.get('youtube')
+            url = f"{self.base_url}/videos"
+            params = {
+                'part': 'snippet,statistics,contentDetails',
+                'id': video_id,
+                'key': self.api_key
+            }
+            
+            response = await client.get(url, params=params)
+            data = response.json()
+            
+            if 'error' in data:
+                raise RuntimeError(data['error'].get('message', str(data['error'])))
+            if not data.get('items'):
+                raise VideoNotFoundError(f"视频 {video_id} 不存在")
+            
+            info = self._parse_video_item(data['items'][0])
+            await self._remember(video_id, info)
+            return info
+            
+        except VideoNotFoundError as e:
+            print(f"获取YouTube视频信息失败: {e}")
+            await self._remember(video_id, e)
+            return self._get_mock_video_info(video_id)
         except Exception as e:
             print(f"获取YouTube视频信息失败: {e}")
             return self._get_mock_video_info(video_id)
     
+    def _parse_video_item(self, item: Dict) -> YouTubeVideoInfo:
+        """解析 videos.list 返回的单个视频"""
+        snippet = item['snippet']
+        statistics = item['statistics']
+        content_details = item['contentDetails']
+        
+        # 解析时长
+        duration = self._parse_duration(content_details['duration'])
+        
+        return YouTubeVideoInfo(
+            title=snippet['title'],
+            description=snippet['description'],
+            thumbnail=snippet['thumbnails']['high']['url'],
+            duration=duration,
+            channel_title=snippet['channelTitle'],
+            view_count=int(statistics.get('viewCount', 0)),
+            like_count=int(statistics.get('likeCount', 0))
+        )
+    
     def _get_mock_video_info(self, video_id: str) -> YouTubeVideoInfo:
         """返回模拟视频信息（用于演示）"""
         return YouTubeVideoInfo(
@@ -78,8 +243,7 @@ class YouTubeService:
     def _parse_duration(self, duration: str) -> int:
         """解析ISO 8601格式的时长"""
         # 格式: PT1H2M3S
-        pattern = r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?'
-        match = re.match(pattern, duration)
+        match = _DURATION_RE.match(duration)
         
         if not match:
             return 0
@@ -90,11 +254,23 @@ class YouTubeService:
         
         return hours * 3600 + minutes * 60 + seconds
     
-    async def get_video_transcript(self, video_id: str) -> Optional[str]:
-        """获取视频字幕（需要YouTube Data API v3）"""
-        # 这里可以实现获取视频字幕的功能
-        # 由于YouTube API限制，可能需要使用第三方服务
-        return None
+    async def get_video_transcript(self, video_id: str, window: Optional[float] = None,
+                                   stride: Optional[float] = None) -> Optional[Iterator[TranscriptChunk]]:
+        """获取视频字幕的时间窗口分块
+
+        YouTube Data API 只允许频道所有者下载字幕，因此从字幕目录读取
+        （可由 yt-dlp 等工具下载，或通过上传接口保存）。返回惰性的分块迭代器，
+        字幕文件在迭代时才流式解析；没有字幕文件时返回 None。
+        window 和 stride 默认为 TRANSCRIPT_WINDOW 和 TRANSCRIPT_STRIDE。
+        """
+        path = find_transcript_file(self.transcript_dir, video_id)
+        if path is None:
+            return None
+        return chunk_cues(
+            iter_cues(path),
+            self.transcript_window if window is None else window,
+            self.transcript_stride if stride is None else stride,
+        )
     
     async def search_videos(self, query: str, max_results: int = 10) -> List[Dict]:
         """搜索YouTube视频"""
@@ -102,31 +278,31 @@ class YouTubeService:
             return []
         
         try:
-            async with httpx.AsyncClient() as client:
-                url = f"{self.base_url}/search"
-                params = {
-                    'part': 'snippet',
-                    'q': query,
-                    'type': 'video',
-                    'maxResults': max_results,
-                    'key': self.api_key
-                }
-                
-                response = await client.get(url, params=params)
-                data = response.json()
-                
-                videos = []
-                for item in data.get('items', []):
-                    videos.append({
-                        'video_id': item['id']['videoId'],
-                        'title': item['snippet']['title'],
-                        'description': item['snippet']['description'],
-                        'thumbnail': item['snippet']['thumbnails']['high']['url'],
-                        'channel_title': item['snippet']['channelTitle']
-                    })
-                
-                return videos
-                
+            client = http_clients.get('youtube')
+            url = f"{self.base_url}/search"
+            params = {
+                'part': 'snippet',
+                'q': query,
+                'type': 'video',
+                'maxResults': max_results,
+                'key': self.api_key
+            }
+            
+            response = await client.get(url, params=params)
+            data = response.json()
+            
+            videos = []
+            for item in data.get('items', []):
+                videos.append({
+                    'video_id': item['id']['videoId'],
+                    'title': item['snippet']['title'],
+                    'description': item['snippet']['description'],
+                    'thumbnail': item['snippet']['thumbnails']['high']['url'],
+                    'channel_title': item['snippet']['channelTitle']
+                })
+            
+            return videos
+            
         except Exception as e:
             print(f"搜索YouTube视频失败: {e}")
             return []